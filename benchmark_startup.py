@@ -0,0 +1,130 @@
+"""
+    启动耗时基准测试
+
+    多次以 `python main.py --profile-startup` 启动桌宠，统计各阶段耗时的中位数，并与基准报告比较，
+    任何一个阶段的耗时超过阈值即视为回归，以非零状态码退出（便于在CI或提交前检查）。
+
+    用法：
+        python benchmark_startup.py --runs 5 --save-baseline gpt_log/startup_baseline.json   # 记录基准
+        python benchmark_startup.py --runs 5 --baseline gpt_log/startup_baseline.json        # 与基准比较
+        python benchmark_startup.py --compare old.json new.json                              # 比较两份已有报告
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+
+def run_once(timeout):
+    """
+    启动一次桌宠（性能分析模式），返回json报告
+    """
+    fd, report_path = tempfile.mkstemp(suffix='.json', prefix='startup_profile_')
+    os.close(fd)
+    try:
+        subprocess.run([sys.executable, 'main.py', '--profile-startup', '--profile-output', report_path],
+                       cwd=os.path.dirname(os.path.abspath(__file__)), timeout=timeout, check=True)
+        with open(report_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    finally:
+        os.remove(report_path)
+
+
+def summarize(reports, top_imports=20):
+    """
+    合并多次运行的报告：各阶段与各模块的导入耗时均取中位数
+    """
+    phases = {}
+    imports = {}
+    for report in reports:
+        for name, t in report['phases_ms'].items():
+            phases.setdefault(name, []).append(t)
+        for record in report.get('imports', []):
+            imports.setdefault(record['module'], []).append(record['cumulative_ms'])
+    phases_ms = {name: round(statistics.median(ts), 3) for name, ts in phases.items()}
+    imports_ms = {name: round(statistics.median(ts), 3) for name, ts in imports.items()}
+    top = sorted(imports_ms.items(), key=lambda kv: kv[1], reverse=True)[:top_imports]
+    return {
+        'runs': len(reports),
+        'phases_ms': phases_ms,
+        'total_import_ms': round(statistics.median([r.get('total_import_ms', 0) for r in reports]), 3),
+        'imports': [{'module': name, 'cumulative_ms': t} for name, t in top],
+    }
+
+
+def load_summary(file_path):
+    with open(file_path, 'r', encoding='utf-8') as f:
+        report = json.load(f)
+    return report if 'runs' in report else summarize([report])
+
+
+def compare(baseline, current, threshold, min_delta_ms):
+    """
+    逐阶段比较，耗时增加超过 threshold（相对比例）且超过 min_delta_ms（绝对值）视为回归
+    """
+    regressions = []
+    print(f"{'阶段':<24s}{'基准(ms)':>12s}{'当前(ms)':>12s}{'变化':>10s}")
+    for name, t_new in current['phases_ms'].items():
+        t_old = baseline['phases_ms'].get(name)
+        if t_old is None:
+            print(f"{name:<24s}{'-':>12s}{t_new:12.1f}{'新增':>10s}")
+            continue
+        ratio = (t_new - t_old) / t_old if t_old > 0 else 0
+        flag = ''
+        if ratio > threshold and (t_new - t_old) > min_delta_ms:
+            regressions.append(name)
+            flag = '  <-- 回归'
+        print(f"{name:<24s}{t_old:12.1f}{t_new:12.1f}{ratio*100:9.1f}%{flag}")
+
+    # 导入耗时变化最大的模块，便于定位回归来源
+    old_imports = {r['module']: r['cumulative_ms'] for r in baseline.get('imports', [])}
+    deltas = [(r['module'], r['cumulative_ms'] - old_imports.get(r['module'], 0)) for r in current.get('imports', [])]
+    deltas = [d for d in sorted(deltas, key=lambda d: d[1], reverse=True) if d[1] > min_delta_ms]
+    if deltas:
+        print('\n导入耗时增加最多的模块：')
+        for module, delta in deltas[:10]:
+            print(f'\t{module:<40s}+{delta:.1f} ms')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='桌宠启动耗时基准测试')
+    parser.add_argument('--runs', type=int, default=5, help='启动次数，结果取中位数')
+    parser.add_argument('--timeout', type=float, default=120, help='单次启动的超时时间（秒）')
+    parser.add_argument('--baseline', help='基准报告路径，提供时与之比较')
+    parser.add_argument('--save-baseline', help='把本次的汇总结果保存为基准报告')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), help='直接比较两份已有的报告，不重新启动')
+    parser.add_argument('--threshold', type=float, default=0.2, help='相对回归阈值，默认0.2即20%%')
+    parser.add_argument('--min-delta-ms', type=float, default=50, help='小于该绝对变化量的波动不视为回归')
+    args = parser.parse_args()
+
+    if args.compare:
+        baseline, current = load_summary(args.compare[0]), load_summary(args.compare[1])
+    else:
+        reports = []
+        for i in range(args.runs):
+            print(f'第 {i+1}/{args.runs} 次启动 ……')
+            reports.append(run_once(args.timeout))
+        current = summarize(reports)
+        print(json.dumps(current['phases_ms'], ensure_ascii=False, indent=4))
+        if args.save_baseline:
+            with open(args.save_baseline, 'w', encoding='utf-8') as f:
+                json.dump(current, f, ensure_ascii=False, indent=4)
+            print('基准报告已保存到' + os.path.abspath(args.save_baseline))
+        if not args.baseline:
+            return 0
+        baseline = load_summary(args.baseline)
+
+    regressions = compare(baseline, current, args.threshold, args.min_delta_ms)
+    if regressions:
+        print(f"\n启动耗时回归：{', '.join(regressions)}")
+        return 1
+    print('\n未发现启动耗时回归')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
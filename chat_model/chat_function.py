@@ -7,6 +7,7 @@ import os
 from .openai_request import OpenAI_request
 from .chat_windows import MessageWidget, ChatWidget
 from .user_info import UserInfo
+from .conversation import Conversation
 
 # 聊天的具体实现
 class ChatDialogBody(QDialog):
@@ -45,8 +46,8 @@ class ChatDialogBody(QDialog):
         #请求中的组件
         self.system_message_index = -1
 
-        # 创建变量以保存聊天上下文，注意user和gpt的对话轮流进入m，0是user，1是pet,3是system
-        self.context_history = [[],[],[]]
+        # 保存聊天上下文，每一轮对话在收到回复后由OpenAI_request写入
+        self.conversation = Conversation()
         self.init_ui()
 
     def init_ui(self):
@@ -179,16 +180,13 @@ class ChatDialogBody(QDialog):
             # 禁用输入框和发送按钮
             self.message_input.setEnabled(False)
             self.send_button.setEnabled(False)
-            # 用户反馈
-            self.context_history[0].append(text)
             if not sys_prompt:
                 sys_prompt = "You are an AI language model."
-            self.open_ai.prompt_queue.put((text, self.context_history, sys_prompt, False))
+            self.open_ai.prompt_queue.put((text, self.conversation, sys_prompt, False))
             self.message_input.clear()
 
     # 处理gpt的返回数据
     def handle_response(self, response):
-        self.context_history[1].append(response)
         if self.system_message_index != -1:
             self.remove_message_at_index(self.system_message_index)
             self.system_message_index = -1
@@ -218,13 +216,13 @@ class ChatDialogBody(QDialog):
     def clear_chat_history(self):
         # 清空聊天记录和聊天上下文
         self.chat_history.clear_chat_history()
-        self.context_history = [[],[]]
+        self.conversation = Conversation()
         # 创建一个新的聊天记录文件
         self.create_chat_log_file()
 
     # # 关闭按钮事件
     def closeEvent(self, event):
-        self.context_history = [[],[]]
+        self.conversation = Conversation()
         event.accept()
         # self.parent().closed.connect(self.parent().set_chat_window_closed)
         # # 发送 chat_window_closed 信号
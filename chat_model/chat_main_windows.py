@@ -109,9 +109,9 @@ class ChatWindow(QMainWindow):
     def send_to_gpt(self,message):
         self.chat_dialog_body.add_message("system",message)
         # 更新历史上下文
-        self.chat_dialog_body.context_history[2].append(message)
+        self.chat_dialog_body.conversation.add_system(message)
         prompt = message
-        self.chat_dialog_body.open_ai.prompt_queue.put((prompt, self.chat_dialog_body.context_history,message,False))  # 将聊天上下文作为第二个参数传递
+        self.chat_dialog_body.open_ai.prompt_queue.put((prompt, self.chat_dialog_body.conversation,message,False))  # 将聊天上下文作为第二个参数传递
 
 
     # 为下拉按钮创建槽函数-模板
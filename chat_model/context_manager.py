@@ -0,0 +1,196 @@
+import re
+import bisect
+import threading
+
+def get_token_counter(llm_model):
+    """
+    获取模型的token计数函数与tokenizer：优先使用bridge_all.model_info中登记的，
+    未登记的模型使用gpt-3.5的tokenizer；没有安装tiktoken或无法下载BPE文件（离线）时按字符数估算
+    """
+    from request_llm.bridge_all import model_info, tokenizer_gpt35
+    info = model_info.get(llm_model, None)
+    tokenizer = tokenizer_gpt35 if info is None else info["tokenizer"]
+    try:
+        tokenizer.encode("test", disallowed_special=())
+    except Exception as e:
+        print(f'[上下文] 无法加载 {llm_model} 的tokenizer，按字符数估算token: {e}')
+        return estimate_token_num, None
+    return (lambda txt: len(tokenizer.encode(txt, disallowed_special=()))), tokenizer
+
+def estimate_token_num(txt):
+    # 中日韩文字约1个token/字，其余约4个字符/token
+    n_cjk = len(re.findall(r'[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]', txt))
+    return n_cjk + (len(txt) - n_cjk + 3) // 4
+
+def get_model_max_token(llm_model, default=4096):
+    from request_llm.bridge_all import model_info
+    if llm_model in model_info:
+        return model_info[llm_model]["max_token"]
+    return default
+
+
+class ContextWindowManager():
+    """
+    按token预算管理发送给模型的上下文（chat_model.conversation.Conversation）。
+    每轮对话的token数在该轮第一次出现时计算并缓存在Turn上，同时维护前缀和；
+    组装请求时，系统prompt与本次输入总是保留（固定），剩余预算通过二分查找前缀和，选出能放下的最近若干轮（滑动窗口），
+    再从Conversation增量维护的messages中直接切出这些轮次，因此组装请求的开销与对话总轮数基本无关，
+    也不会发出超过模型上下文长度的请求。
+    未压缩的历史超过预算的summary_threshold时，较早的轮次（保留最近keep_recent_turns轮）可以在后台被压缩成摘要，
+    此后请求中发送 摘要 + 摘要之后的对话。
+    """
+    message_overhead = 4    # 每条message的格式开销（role等）
+    summary_threshold = 0.6
+    keep_recent_turns = 4
+    memory_ratio = 0.15     # 长期记忆最多占用的预算比例
+
+    def __init__(self, llm_model, max_token=None, reply_reserve=None):
+        self.llm_model = llm_model
+        self.max_token = get_model_max_token(llm_model, default=max_token or 4096)
+        # 为模型的回复预留的token数
+        self.reply_reserve = reply_reserve if reply_reserve is not None else min(1024, self.max_token // 4)
+        self.exceed_margin = 0  # 模型报告token溢出后追加的余量
+        # tokenizer第一次使用时可能需要下载BPE文件，因此不在构造时（Qt主线程）加载，而是在第一次计数时（请求线程）加载
+        self.counter = None
+        self.counter_lock = threading.Lock()
+        self.summary_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.conversation = None
+        self.prefix = [0]       # token数前缀和
+        self.summary = ""
+        self.summary_tokens = 0
+        self.summarized_until = 0   # 前多少轮已经被压缩进摘要
+
+    def get_counter(self):
+        if self.counter is None:
+            with self.counter_lock:
+                if self.counter is None:
+                    self.counter = get_token_counter(self.llm_model)
+        return self.counter
+
+    def token_num(self, txt):
+        return self.get_counter()[0](txt)
+
+    @property
+    def tokenizer(self):
+        return self.get_counter()[1]
+
+    def get_budget(self):
+        return self.max_token - self.reply_reserve - self.exceed_margin
+
+    def on_token_exceeded(self, n_exceed=None):
+        """
+        模型仍然报告token溢出时（token计数与模型实际不一致），增加余量后重试
+        """
+        self.exceed_margin += max(n_exceed or 0, 256)
+
+    def get_turn_tokens(self, turn):
+        if turn.n_token is None:
+            if not turn.sendable:
+                turn.n_token = 0
+            elif turn.question == "":
+                turn.n_token = self.token_num(turn.answer) + self.message_overhead
+            else:
+                turn.n_token = self.token_num(turn.question) + self.token_num(turn.answer) + 2 * self.message_overhead
+        return turn.n_token
+
+    def sync(self, conversation):
+        """
+        把conversation中新增的轮次加入前缀和；换成了另一段对话（清空聊天）时重新开始
+        """
+        if conversation is not self.conversation:
+            self.reset()
+            self.conversation = conversation
+        turns = conversation.turns
+        for index in range(len(self.prefix) - 1, len(turns)):
+            self.prefix.append(self.prefix[-1] + self.get_turn_tokens(turns[index]))
+
+    def get_compaction_range(self):
+        """
+        需要压缩时返回待压缩的轮次范围 (start, end)，否则返回None；单次最多压缩半个预算的内容
+        """
+        n_turn = len(self.prefix) - 1
+        start, end = self.summarized_until, n_turn - self.keep_recent_turns
+        if end <= start: return None
+        if self.prefix[n_turn] - self.prefix[start] <= self.summary_threshold * self.get_budget(): return None
+        limit = self.prefix[start] + self.get_budget() // 2
+        end = min(end, max(start + 1, bisect.bisect_right(self.prefix, limit) - 1))
+        return start, end
+
+    def format_turns(self, start, end):
+        """
+        把待压缩的轮次（连同已有的摘要）整理成文本，作为摘要请求的输入
+        """
+        lines = [f"之前的摘要：{self.summary}"] if self.summary else []
+        for turn in self.conversation.turns[start:end]:
+            if not turn.sendable: continue
+            if turn.question != "": lines.append(f"用户：{turn.question}")
+            lines.append(f"桌宠：{turn.answer}")
+        return self.clip_text("\n".join(lines), self.get_budget() // 2 + self.summary_tokens)
+
+    def set_summary(self, summary, start, end, conversation):
+        """
+        写入后台生成的摘要；对话已被清空或摘要已被其他请求更新时放弃，返回是否写入
+        """
+        with self.summary_lock:
+            if conversation is not self.conversation or start != self.summarized_until or end > len(self.prefix) - 1:
+                return False
+            self.summary = summary
+            self.summary_tokens = self.token_num(summary) + self.message_overhead
+            self.summarized_until = end
+            return True
+
+    def clip_text(self, txt, max_token):
+        """
+        把超长的文本截断到max_token以内（保留开头）
+        """
+        if self.tokenizer is not None:
+            encoded = self.tokenizer.encode(txt, disallowed_special=())
+            return self.tokenizer.decode(encoded[:max_token])
+        n_token = self.token_num(txt)
+        return txt[:max(0, len(txt) * max_token // max(n_token, 1))]
+
+    def build_messages(self, inputs, conversation, system_prompt, memories=()):
+        """
+        memories为按相关度排列的长期记忆文本，在预算内尽量多地放入
+        返回 (messages, 被省略的轮数)
+        """
+        self.sync(conversation)
+        summary, summary_tokens, summarized_until = self.summary, self.summary_tokens, self.summarized_until
+        budget = self.get_budget() - self.token_num(system_prompt) - 2 * self.message_overhead - summary_tokens
+        n_input = self.token_num(inputs)
+        if n_input > budget:
+            # 本次输入本身就超出了上下文长度，截断输入，避免请求必然失败
+            inputs = self.clip_text(inputs, max(budget, 0))
+            print(f'[上下文] 输入过长（{n_input} tokens），已截断到 {max(budget, 0)} tokens')
+            n_input = budget
+        budget -= n_input
+
+        # 长期记忆：按相关度依次放入，不超过memory_ratio的预算
+        memory_budget = min(budget, int(self.get_budget() * self.memory_ratio)) - self.message_overhead
+        memory_texts = []
+        for memory in memories:
+            n_token = self.token_num(memory) + 1
+            if n_token > memory_budget: break
+            memory_texts.append(memory)
+            memory_budget -= n_token
+        if memory_texts:
+            memory_message = "与当前话题相关的过往对话（长期记忆）：\n" + "\n\n".join(memory_texts)
+            budget -= self.token_num(memory_message) + self.message_overhead
+
+        # 滑动窗口：保留最近的、总token数不超过剩余预算的若干轮（已经压缩进摘要的轮次不再发送）
+        n_turn = len(self.prefix) - 1
+        start = max(bisect.bisect_left(self.prefix, self.prefix[n_turn] - budget), summarized_until)
+        messages = [{"role": "system", "content": system_prompt}]
+        if memory_texts:
+            messages.append({"role": "system", "content": memory_message})
+        if summary:
+            messages.append({"role": "system", "content": "之前对话的摘要：" + summary})
+        turns = self.conversation.turns
+        if start < n_turn:
+            end = turns[n_turn].message_start if n_turn < len(turns) else len(self.conversation.messages)
+            messages.extend(self.conversation.messages[turns[start].message_start:end])
+        messages.append({"role": "user", "content": inputs})
+        return messages, start - summarized_until
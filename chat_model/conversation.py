@@ -0,0 +1,82 @@
+timeout_bot_msg = '[Local Message] Request timeout. Network error. Please check proxy settings in config.py.' + \
+                  '网络错误，检查代理服务器是否可用，以及代理设置的格式是否正确，格式须是[协议]://[地址]:[端口]，缺一不可。'
+
+class Turn():
+    """
+    一轮对话。question为空表示只有桌宠一侧的消息（例如插件写入的中间结果）；
+    n_token由ContextWindowManager第一次见到该轮时计算并缓存；
+    message_start为该轮在Conversation.messages中的起始位置。
+    """
+    __slots__ = ('question', 'answer', 'n_token', 'message_start')
+
+    def __init__(self, question, answer, message_start):
+        self.question = question
+        self.answer = answer
+        self.n_token = None
+        self.message_start = message_start
+
+    @property
+    def sendable(self):
+        # 空回复与超时提示不发送给模型
+        return self.answer != "" and self.answer != timeout_bot_msg
+
+
+class Conversation():
+    """
+    一段对话的上下文，取代原来的 context_history = [[用户...], [桌宠...], [系统...]]。
+    messages是所有轮次对应的OpenAI格式消息，随着新的轮次增量追加，组装请求时只需要从中切出窗口内的部分。
+    """
+    def __init__(self):
+        self.turns = []
+        self.messages = []
+        self.system_messages = []
+
+    def __len__(self):
+        return len(self.turns)
+
+    def add_turn(self, question, answer):
+        """
+        追加一轮完整的对话（用户消息与桌宠回复）
+        """
+        turn = Turn(question, answer, len(self.messages))
+        if turn.sendable:
+            if question != "":
+                self.messages.append({"role": "user", "content": question})
+            self.messages.append({"role": "assistant", "content": answer})
+        # 先写messages再写turns，其他线程读到新的一轮时，它的消息一定已经就绪
+        self.turns.append(turn)
+        return turn
+
+    def add_note(self, text):
+        """
+        只追加桌宠一侧的消息，例如插件的中间结果
+        """
+        return self.add_turn("", text)
+
+    def add_system(self, text):
+        self.system_messages.append(text)
+
+    def get_flat_history(self):
+        """
+        [问, 答, 问, 答, ...] 格式，供request_llm中的接口使用
+        """
+        flat_history = []
+        for turn in self.turns:
+            if turn.question != "" and turn.sendable:
+                flat_history.extend([turn.question, turn.answer])
+        return flat_history
+
+    def to_legacy(self):
+        """
+        与原来context_history相同的 [[用户...], [桌宠...], [系统...]] 格式，用于保存聊天记录
+        """
+        return [[turn.question for turn in self.turns], [turn.answer for turn in self.turns], list(self.system_messages)]
+
+    @staticmethod
+    def from_legacy(history):
+        conversation = Conversation()
+        for question, answer in zip(history[0], history[1]):
+            conversation.add_turn(question, answer)
+        if len(history) > 2:
+            conversation.system_messages.extend(history[2])
+        return conversation
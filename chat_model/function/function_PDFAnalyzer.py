@@ -26,7 +26,7 @@ class PDFAnalyzer:
         print("Starting tools_handle_response")
         self.iteration_results.append(response)
         self.last_iteration_result = response
-        self.chat_dialog_body.context_history[1].append("The main idea of the previous section is?" + response)
+        self.chat_dialog_body.conversation.add_note("The main idea of the previous section is?" + response)
         self.key = 1
         print("release key")
 
@@ -61,7 +61,7 @@ class PDFAnalyzer:
         # 发送信息的模板（包括更新到对话框，发送请求以及保存到历史记录，禁用输入框）
         self.chat_dialog_body.send_message(tool=i_say_show_user, sys_prompt=self.sys_prompt)
         # add_message是只增加到聊天框，不做其他
-        self.chat_dialog_body.context_history[1].append("The main idea of the previous section is?" + paper_meta)
+        self.chat_dialog_body.conversation.add_note("The main idea of the previous section is?" + paper_meta)
         MAX_WORD_TOTAL = 4096
         n_fragment = len(paper_fragments)
         if n_fragment >= 20:
@@ -79,7 +79,7 @@ class PDFAnalyzer:
             i_say = f"Read this section, recapitulate the content of this section with less than {NUM_OF_WORD} words: {paper_fragments[i]}"
             i_say_show_user = f"[{i + 1}/{n_fragment}] Read this section, recapitulate the content of this section with less than {NUM_OF_WORD} words: {paper_fragments[i][:200]}"
             self.chat_dialog_body.message_received.emit("system", i_say_show_user)
-            self.chat_dialog_body.open_ai.prompt_queue.put((i_say, self.chat_dialog_body.context_history, self.sys_prompt, True))
+            self.chat_dialog_body.open_ai.prompt_queue.put((i_say, self.chat_dialog_body.conversation, self.sys_prompt, True))
 
         ############################## <第 3 步，整理history> ##################################
         final_results.extend(self.iteration_results)
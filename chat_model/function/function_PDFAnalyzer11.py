@@ -20,7 +20,7 @@ class PDFAnalyzer:
                     i_say = f"Read this section, recapitulate the content of this section with less than {NUM_OF_WORD} words: {self.paper_fragments[self.current_index]}"
                     i_say_show_user = f"[{self.current_index + 1}/{self.n_fragment}] Read this section, recapitulate the content of this section with less than {NUM_OF_WORD} words: {self.paper_fragments[self.current_index][:200]}"
                     self.chat_dialog_body.message_received.emit("system", i_say_show_user)
-                    self.chat_dialog_body.open_ai.prompt_queue.put((i_say, self.chat_dialog_body.context_history, self.sys_prompt, True))
+                    self.chat_dialog_body.open_ai.prompt_queue.put((i_say, self.chat_dialog_body.conversation, self.sys_prompt, True))
                 finally:
                     self.semaphore.release()
                     self.start_next_thread()
@@ -36,7 +36,7 @@ class PDFAnalyzer:
 
     def tools_handle_response(self, response):
         print("Starting tools_handle_response")
-        self.chat_dialog_body.context_history[1].append("The main idea of the previous section is?" + response)
+        self.chat_dialog_body.conversation.add_note("The main idea of the previous section is?" + response)
         self.iteration_results.append(response)
         self.last_iteration_result = response
         self.semaphore.release()
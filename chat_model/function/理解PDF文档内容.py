@@ -5,14 +5,14 @@ import threading
 def send_request_in_thread(self):
     while not self.get_key:
         time.sleep(0.1)
-    self.open_ai.prompt_queue.put((i_say, chat_dialog_body.context_history, sys_prompt, True))
+    self.open_ai.prompt_queue.put((i_say, chat_dialog_body.conversation, sys_prompt, True))
 
 def 解析PDF(pdf_dir, chat_dialog_body):
     #控制队列中的线程，避免一瞬间把所有请求发完，要拿到钥匙之后才能发送下一个
     get_key = True
     def tools_handle_response(response):
         #添加历史到gpt回复
-        chat_dialog_body.context_history[1].append("The main idea of the previous section is?"+response)
+        chat_dialog_body.conversation.add_note("The main idea of the previous section is?"+response)
         iteration_results.append(response)
         get_key = False
 
@@ -58,12 +58,12 @@ def 解析PDF(pdf_dir, chat_dialog_body):
     for i in range(n_fragment):
         
         # 保存到历史
-        # chat_dialog_body.context_history[0].append(i_say)
+        # chat_dialog_body.conversation.add_turn(i_say, response)
         # 将请求放进线程中，避免界面卡顿
         while not get_key:
             print("waitting.....")
             time.sleep(0.1)  # 等待100毫秒后再次检查
-        chat_dialog_body.open_ai.prompt_queue.put((i_say, chat_dialog_body.context_history, sys_prompt,True))
+        chat_dialog_body.open_ai.prompt_queue.put((i_say, chat_dialog_body.conversation, sys_prompt,True))
         get_key = False
 
     ############################## <第 3 步，整理history> ##################################
@@ -0,0 +1,241 @@
+"""
+    桌宠的长期记忆
+
+    HashingEmbedder: 纯CPU、无需下载模型的文本向量化：中文取单字与相邻两字、其他语言取单词，
+        哈希到固定维度后做L2归一化，余弦相似度近似反映两段文本的词汇重合程度。
+    LongTermMemory: 把每一轮对话向量化后存入 user_data/memory 下的内存映射矩阵（numpy .npy），
+        以倒排文件（IVF）作为近似最近邻索引：用球面k-means把向量分成若干簇，每条记忆记录所属的簇，
+        查询时只在与query最接近的n_probe个簇中精确计算余弦相似度。
+        10万轮对话时单次检索只需读取几千行向量，耗时在毫秒级。
+"""
+import os
+import re
+import json
+import zlib
+import threading
+import numpy as np
+
+class HashingEmbedder():
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    @staticmethod
+    def get_features(text):
+        text = text.lower()
+        features = re.findall(r'[a-z0-9]+', text)
+        for segment in re.findall(r'[\u3000-\u9fff\uac00-\ud7af]+', text):
+            features.extend(segment)
+            features.extend(segment[i:i+2] for i in range(len(segment) - 1))
+        return features
+
+    def embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature in self.get_features(text):
+            h = zlib.crc32(feature.encode('utf-8'))
+            vector[h % self.dim] += 1.0 if (h >> 16) & 1 else -1.0
+        vector = np.sign(vector) * np.log1p(np.abs(vector))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+
+class LongTermMemory():
+    """
+    目录结构：
+        meta.json       条目数、向量维度、容量、上次训练索引时的条目数
+        vectors.npy     [容量, 维度] float32，内存映射
+        lists.npy       [容量] int32，每条记忆所属的簇（-1表示尚未分配）
+        offsets.npy     [容量] int64，每条记忆在records.jsonl中的字节偏移
+        centroids.npy   [簇数, 维度] float32，簇中心
+        records.jsonl   记忆原文（用户消息、回复、会话ID、时间）
+    条目数少于train_min时直接暴力检索；条目数每翻一倍重新训练一次簇中心。
+    """
+    def __init__(self, memory_dir, dim=256, n_probe=16, train_min=4096, initial_capacity=1024, reindex_threshold=1024):
+        self.memory_dir = memory_dir
+        self.embedder = HashingEmbedder(dim)
+        self.dim = dim
+        self.n_probe = n_probe
+        self.train_min = train_min
+        self.reindex_threshold = reindex_threshold  # 未排序进倒排索引的新条目超过该数量时重建排序
+        self.lock = threading.Lock()
+        os.makedirs(memory_dir, exist_ok=True)
+        self.meta_file = os.path.join(memory_dir, 'meta.json')
+        self.records_file = os.path.join(memory_dir, 'records.jsonl')
+        self.centroids_file = os.path.join(memory_dir, 'centroids.npy')
+        self.load(initial_capacity)
+
+    def get_path(self, name):
+        return os.path.join(self.memory_dir, name)
+
+    def load(self, initial_capacity):
+        self.centroids = None
+        self.n_trained = 0
+        if os.path.exists(self.meta_file):
+            with open(self.meta_file, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta['dim'] != self.dim:
+                raise RuntimeError(f"长期记忆的向量维度与{self.meta_file}不一致，请删除该目录后重建。")
+            self.count, self.n_trained = meta['count'], meta['n_trained']
+            self.open_arrays()
+            self.truncate_records()
+            if self.n_trained > 0:
+                self.centroids = np.load(self.centroids_file)
+        else:
+            self.count = 0
+            self.create_arrays(initial_capacity)
+            self.open_arrays()
+            self.save_meta()
+        self.build_index()
+
+    def create_arrays(self, capacity, suffix=''):
+        open_memmap = np.lib.format.open_memmap
+        vectors = open_memmap(self.get_path('vectors.npy' + suffix), mode='w+', dtype=np.float32, shape=(capacity, self.dim))
+        lists = open_memmap(self.get_path('lists.npy' + suffix), mode='w+', dtype=np.int32, shape=(capacity,))
+        offsets = open_memmap(self.get_path('offsets.npy' + suffix), mode='w+', dtype=np.int64, shape=(capacity,))
+        lists[:] = -1
+        return vectors, lists, offsets
+
+    def truncate_records(self):
+        """
+        截掉records.jsonl中条目数之后的部分（上次写入原文后、写入meta前退出时留下的），
+        否则这些原文会一直留在文件中，之后追加的条目也会接在它们后面
+        """
+        if not os.path.exists(self.records_file): return
+        if self.count == 0:
+            end = 0
+        else:
+            with open(self.records_file, 'rb') as f:
+                f.seek(int(self.offsets[self.count - 1]))
+                end = f.tell() + len(f.readline())
+        if os.path.getsize(self.records_file) > end:
+            with open(self.records_file, 'r+b') as f:
+                f.truncate(end)
+
+    def open_arrays(self):
+        self.vectors = np.load(self.get_path('vectors.npy'), mmap_mode='r+')
+        self.lists = np.load(self.get_path('lists.npy'), mmap_mode='r+')
+        self.offsets = np.load(self.get_path('offsets.npy'), mmap_mode='r+')
+
+    def grow(self):
+        """
+        容量翻倍：写入新文件后替换旧文件
+        """
+        vectors, lists, offsets = self.create_arrays(self.vectors.shape[0] * 2, suffix='.tmp')
+        vectors[:self.count] = self.vectors[:self.count]
+        lists[:self.count] = self.lists[:self.count]
+        offsets[:self.count] = self.offsets[:self.count]
+        for arr in (vectors, lists, offsets): arr.flush()
+        del self.vectors, self.lists, self.offsets
+        del vectors, lists, offsets
+        for name in ('vectors.npy', 'lists.npy', 'offsets.npy'):
+            os.replace(self.get_path(name + '.tmp'), self.get_path(name))
+        self.open_arrays()
+
+    def save_meta(self):
+        tmp_file = self.meta_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'count': self.count, 'dim': self.dim, 'n_trained': self.n_trained,
+                       'capacity': int(self.vectors.shape[0])}, f)
+        os.replace(tmp_file, self.meta_file)
+
+    def train(self, n_iter=8, max_sample=32768):
+        """
+        球面k-means训练簇中心（簇数约为sqrt(条目数)），并重新分配所有条目
+        """
+        rng = np.random.default_rng(0)
+        n_list = int(np.clip(np.sqrt(self.count), 16, 1024))
+        sample_ids = np.sort(rng.choice(self.count, min(self.count, max_sample), replace=False))
+        sample = np.asarray(self.vectors[sample_ids])
+        centroids = sample[rng.choice(len(sample), n_list, replace=False)]
+        for _ in range(n_iter):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+        self.centroids = centroids.astype(np.float32)
+        np.save(self.centroids_file, self.centroids)
+        for start in range(0, self.count, 8192):
+            end = min(start + 8192, self.count)
+            self.lists[start:end] = self.assign(np.asarray(self.vectors[start:end]))
+        self.n_trained = self.count
+
+    def assign(self, vectors):
+        return np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+    def build_index(self):
+        """
+        按簇号排序，查询时用二分查找取出各个簇的条目
+        """
+        lists = np.asarray(self.lists[:self.count])
+        self.sorted_ids = np.argsort(lists, kind='stable')
+        self.sorted_lists = lists[self.sorted_ids]
+        self.n_indexed = self.count
+
+    def add(self, question, answer, chat_id=None, timestamp=None):
+        """
+        记住一轮对话
+        """
+        self.add_many([(question, answer, chat_id, timestamp)])
+
+    def add_many(self, turns):
+        """
+        批量记住多轮对话 [(用户消息, 回复, 会话ID, 时间)]，只写一次meta
+        """
+        if len(turns) == 0: return
+        vectors = np.stack([self.embedder.embed(q + "\n" + a) for q, a, _, _ in turns])
+        records = [json.dumps({'q': q, 'a': a, 'chat_id': chat_id, 'time': timestamp}, ensure_ascii=False).encode('utf-8') + b'\n'
+                   for q, a, chat_id, timestamp in turns]
+        with self.lock:
+            while self.count + len(turns) > self.vectors.shape[0]:
+                self.grow()
+            offsets = []
+            with open(self.records_file, 'ab') as f:
+                for record in records:
+                    offsets.append(f.tell())
+                    f.write(record)
+            start, end = self.count, self.count + len(turns)
+            self.vectors[start:end] = vectors
+            self.offsets[start:end] = offsets
+            if self.centroids is not None:
+                self.lists[start:end] = self.assign(vectors)
+            self.count = end
+            if self.count >= self.train_min and self.count >= 2 * self.n_trained:
+                self.train()
+            self.save_meta()    # 条目数最后写入，中途退出时多写的向量会被下一次写入覆盖，多写的原文在下一次打开时截掉
+            if self.count - self.n_indexed >= self.reindex_threshold or self.n_trained == self.count:
+                self.build_index()
+
+    def get_candidates(self, vector):
+        if self.centroids is None:
+            return np.arange(self.count)
+        probes = np.argsort(-(self.centroids @ vector))[:self.n_probe]
+        candidates = [np.arange(self.n_indexed, self.count)]   # 尚未排序进索引的新条目直接作为候选
+        for list_id in probes:
+            left = np.searchsorted(self.sorted_lists, list_id, side='left')
+            right = np.searchsorted(self.sorted_lists, list_id, side='right')
+            candidates.append(self.sorted_ids[left:right])
+        return np.sort(np.concatenate(candidates))
+
+    def read_record(self, index):
+        with open(self.records_file, 'rb') as f:
+            f.seek(int(self.offsets[index]))
+            return json.loads(f.readline().decode('utf-8'))
+
+    def search(self, query, top_k=5, min_score=0.3, exclude_chat_id=None):
+        """
+        返回与query最相关的至多top_k条记忆 [(相似度, 记录)]，按相似度从高到低排列
+        """
+        vector = self.embedder.embed(query)
+        if not vector.any(): return []
+        with self.lock:
+            if self.count == 0: return []
+            candidates = self.get_candidates(vector)
+            scores = self.vectors[candidates] @ vector
+            order = np.argsort(-scores)
+            results = []
+            for i in order:
+                if scores[i] < min_score or len(results) >= top_k: break
+                record = self.read_record(candidates[i])
+                if exclude_chat_id is not None and record.get('chat_id') == exclude_chat_id: continue
+                results.append((float(scores[i]), record))
+            return results
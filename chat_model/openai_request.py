@@ -1,13 +1,17 @@
 # 借鉴了 https://github.com/binary-husky/chatgpt_academic 项目
 
+import os
 import json
 import traceback
 import requests
 from queue import Queue
 import time
+import threading
 from PyQt5.QtCore import QThread, pyqtSignal
 from concurrent.futures import ThreadPoolExecutor
 from .user_info import UserInfo
+from .context_manager import ContextWindowManager
+from request_llm.circuit_breaker import post_with_breaker, CircuitOpenError
 
 # private_config.py放自己的秘密如API和代理网址
 # 读取时首先看是否存在私密的config_private配置文件（不受git管控），如果有，则覆盖原config文件
@@ -40,6 +44,13 @@ class OpenAI_request(QThread):
         self.top_p = float(self.config["OpenAI"]["TOP_P"])
         self.temperature = float(self.config["OpenAI"]["TEMPERATURE"])
         self.max_tokens = int(self.config["OpenAI"]["MAX_TOKENS"])
+        # 上下文长度以bridge_all.model_info中登记的max_token为准，未登记的模型使用MAX_TOKENS
+        self.context_manager = ContextWindowManager(self.llm_model, max_token=self.max_tokens)
+        self.summarizing = False
+        self.memory = None
+        self.memory_loaded = False
+        self.current_chat_id = None
+        self.current_chat_ref = None
 
         self.session = requests.Session()
         self.headers = {"Content-Type": "application/json", "Authorization": f"Bearer {self.api_key}"}
@@ -64,10 +75,12 @@ class OpenAI_request(QThread):
     #获取gpt回复
     def get_response_from_gpt(self, inputs, history, sys_prompt='',
                               handle_token_exceed=True,retry_times_at_unknown_error=2,tools=False):
-        # 生成一个唯一的聊天ID，用于保存聊天历史
-        self.current_chat_id = f"chat_{int(time.time())}"
+        # 生成一个唯一的聊天ID，用于保存聊天历史（同一段对话沿用同一个ID，清空聊天后重新生成）
+        if self.current_chat_id is None or history is not self.current_chat_ref:
+            self.current_chat_id = f"chat_{int(time.time())}"
+            self.current_chat_ref = history
         # 保存聊天历史到用户信息中
-        self.user_info_manager.save_chat_history(self.current_chat_id, history)
+        self.user_info_manager.save_chat_history(self.current_chat_id, history.to_legacy())
         # 多线程的时候，需要一个mutable结构在不同线程之间传递信息
         # list就是最简单的mutable结构，我们第一个位置放gpt输出，第二个位置传递报错信息
 
@@ -86,18 +99,23 @@ class OpenAI_request(QThread):
                     result = self.gpt_stream_connection(
                         inputs=inputs, history=history, sys_prompt=sys_prompt)
                     return result
+                except CircuitOpenError as circuit_open_error:
+                    # 【第四种情况】：端点已熔断，不再等待重试，直接转发给后备模型
+                    try:
+                        return self.request_fallback(inputs, history, sys_prompt, circuit_open_error)
+                    except Exception as e:
+                        mutable[0] += f"[Local Message] {e}\n\n"
+                        return mutable[0]
                 except ConnectionAbortedError as token_exceeded_error:
                     # 【第二种情况】：Token溢出
-                    if handle_token_exceed:
+                    if handle_token_exceed and exceeded_cnt < 3:
                         exceeded_cnt += 1
                         # 【选择处理】 尝试计算比例，尽可能多地保留文本
                         from toolbox import get_reduce_token_percent
                         p_ratio, n_exceed = get_reduce_token_percent(
                             str(token_exceeded_error))
-                        MAX_TOKEN = 4096
-                        EXCEED_ALLO = 512 + 512 * exceeded_cnt
-                        inputs, history = self.input_clipping(
-                            inputs, history, max_token_limit=MAX_TOKEN-EXCEED_ALLO)
+                        # 上下文管理器的token计数与模型不一致，扩大余量后重新组装上下文
+                        self.context_manager.on_token_exceeded(int(n_exceed) if n_exceed.isdigit() else None)
                         mutable[0] += f'[Local Message] 警告，文本过长将进行截断，Token溢出数：{n_exceed}。\n\n'
                         continue  # 返回重试
                     else:
@@ -133,28 +151,117 @@ class OpenAI_request(QThread):
         # 更新聊天历史并保存
         if not tools:
             # 更新历史记录
-            history[0].append(inputs)
-            history[1].append(final_result)
+            history.add_turn(inputs, final_result)
             # 保存更新后的聊天历史
-            self.user_info_manager.save_chat_history(self.current_chat_id, history)
+            self.user_info_manager.save_chat_history(self.current_chat_id, history.to_legacy())
+            # 历史过长时，在后台把较早的轮次压缩成摘要
+            self.compact_history_in_background()
+            # 写入长期记忆
+            self.remember(inputs, final_result)
             
         if tools:
             self.tools_received.emit(final_result)
         else:
             self.response_received.emit(final_result)
     
+    def get_memory(self):
+        """
+            打开 user_data/memory 下的长期记忆（第一次使用时），第一次创建时在后台导入已有的聊天历史
+        """
+        if not self.memory_loaded:
+            self.memory_loaded = True
+            try:
+                from .long_term_memory import LongTermMemory
+                self.memory = LongTermMemory(os.path.join(self.user_info_manager.user_data_dir, 'memory'))
+                if self.memory.count == 0:
+                    threading.Thread(target=self.import_chat_histories, name="memory-import", daemon=True).start()
+            except Exception:
+                traceback.print_exc()
+                print('[长期记忆] 初始化失败，本次运行不使用长期记忆')
+                self.memory = None
+        return self.memory
+
+    def import_chat_histories(self):
+        turns = []
+        for session in self.user_info_manager.get_all_chat_sessions():
+            history = self.user_info_manager.load_chat_history(session["id"])
+            if len(history) < 2: continue
+            for question, answer in zip(history[0], history[1]):
+                if question and answer and not answer.startswith("[Local Message]"):
+                    turns.append((question, answer, session["id"], session.get("last_updated")))
+        self.memory.add_many(turns)
+        if turns: print(f'[长期记忆] 已导入 {len(turns)} 轮历史对话')
+
+    def remember(self, inputs, response):
+        memory = self.get_memory()
+        if memory is None or not inputs or response.startswith("[Local Message]"): return
+        try:
+            memory.add(inputs, response, self.current_chat_id, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()))
+        except Exception:
+            traceback.print_exc()
+
+    def recall(self, inputs, top_k=5):
+        """
+            检索与本次输入相关的过往对话（不包括当前会话，当前会话已经在上下文中）
+        """
+        memory = self.get_memory()
+        if memory is None: return []
+        try:
+            results = memory.search(inputs, top_k=top_k, exclude_chat_id=self.current_chat_id)
+        except Exception:
+            traceback.print_exc()
+            return []
+        return [f"[{record.get('time') or ''}] 用户：{record['q']}\n桌宠：{record['a']}" for score, record in results]
+
+    def compact_history_in_background(self):
+        """
+            未压缩的历史超过阈值时，启动一个后台线程生成摘要，不阻塞后续的对话请求
+        """
+        if self.summarizing: return
+        compaction_range = self.context_manager.get_compaction_range()
+        if compaction_range is None: return
+        self.summarizing = True
+        threading.Thread(target=self.compact_history, name="chat-summarizer", daemon=True,
+                         args=(compaction_range, self.context_manager.conversation, self.current_chat_id)).start()
+
+    def compact_history(self, compaction_range, conversation, chat_id):
+        start, end = compaction_range
+        try:
+            payload = {
+                "model": self.llm_model,
+                "messages": [
+                    {"role": "system", "content": "你负责为桌宠与用户的对话生成摘要。请把之前的摘要与下面的对话合并成一段简洁的摘要，"
+                                                  "保留用户的个人信息、偏好、约定的事项以及未完成的话题，不超过300字，只输出摘要。"},
+                    {"role": "user", "content": self.context_manager.format_turns(start, end)},
+                ],
+                "temperature": 0.3,
+                "n": 1,
+                "stream": False,
+            }
+            summary = self.send_payload(self.headers, payload)
+            if self.context_manager.set_summary(summary, start, end, conversation):
+                self.user_info_manager.save_chat_summary(chat_id, summary, end)
+                print(f'[上下文] 已把前 {end} 轮对话压缩为摘要')
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self.summarizing = False
+
     def gpt_stream_connection(self, inputs, history, sys_prompt):
         headers, payload = self.generate_payload(inputs=inputs, system_prompt=sys_prompt, stream=False, history=history)
+        return self.send_payload(headers, payload)
+
+    def send_payload(self, headers, payload):
         retry = 0
         while True:
             try:
                 # make a POST request to the API endpoint, stream=False
                 if self.proxies:
-                    response = requests.post(self.openaiapi_url, headers=headers, proxies=self.proxies,
+                    response = post_with_breaker(self.openaiapi_url, headers=headers, proxies=self.proxies,
                                             json=payload, stream=False, timeout=self.timeout_seconds)
                 else:
                     # 当代理为None时，不传递proxies参数
-                    response = requests.post(self.openaiapi_url, headers=headers,
+                    response = post_with_breaker(self.openaiapi_url, headers=headers,
                                             json=payload, stream=False, timeout=self.timeout_seconds)
                 break
             except requests.exceptions.ReadTimeout as e:
@@ -182,13 +289,36 @@ class OpenAI_request(QThread):
             print(f"JSON解析错误: {e}, 原始数据: {response.text}")
             raise RuntimeError(f"处理响应时出错: {str(e)}\n{tb_str}")
 
+    def request_fallback(self, inputs, history, sys_prompt, error):
+        """
+            端点熔断时转发请求到后备模型，后备链取自配置[OpenAI] LLM_FALLBACK（逗号分隔的模型名），
+            未配置时使用config.py中LLM_FALLBACK为当前模型登记的后备链（只对bridge_all.model_info中的模型有效）；
+            后备模型使用桌宠配置的OPENAI_API_KEY，跳过没有可用api-key的模型，没有可用的后备模型时直接报错
+        """
+        from toolbox import get_conf, get_avail_api_keys
+        from request_llm.bridge_all import predict_no_ui_long_connection, model_info
+        value = self.config.get("OpenAI", "LLM_FALLBACK", fallback="")
+        if value.strip():
+            fallback = [m.strip() for m in value.split(',') if m.strip()]
+        else:
+            LLM_FALLBACK, = get_conf('LLM_FALLBACK')
+            fallback = LLM_FALLBACK.get(self.llm_model, [])
+        chain = []
+        for m in fallback:
+            if m not in model_info or m == self.llm_model or m in chain: continue
+            if model_info[m]["backend"] == "chatgpt" and len(get_avail_api_keys(self.api_key, m)) == 0: continue
+            chain.append(m)
+        if len(chain) == 0: raise error
+        print(f'[后备模型] {error}，切换到 {chain[0]}')
+        flat_history = history.get_flat_history()
+        llm_kwargs = {'api_key': self.api_key, 'llm_model': chain[0], 'fallback': chain[1:],
+                      'top_p': self.top_p, 'temperature': self.temperature, 'max_length': self.max_tokens}
+        return predict_no_ui_long_connection(inputs, llm_kwargs, flat_history, sys_prompt, observe_window=None, console_slience=True)
+
     def generate_payload(self, inputs, system_prompt, stream, history):
         """
             整合所有信息，选择LLM模型，生成http请求，为发送请求做准备
         """
-        timeout_bot_msg = '[Local Message] Request timeout. Network error. Please check proxy settings in config.py.' + \
-                  '网络错误，检查代理服务器是否可用，以及代理设置的格式是否正确，格式须是[协议]://[地址]:[端口]，缺一不可。'
-        
         if len(self.api_key) != 51:
             raise AssertionError("你提供了错误的API_KEY。\n\n1. 临时解决方案：直接在输入区键入api_key，然后回车提交。\n\n2. 长效解决方案：在config.py中配置。")
 
@@ -201,34 +331,10 @@ class OpenAI_request(QThread):
             "Authorization": f"Bearer {self.api_key}"
         }  # 单用户模式，不需要用户ID标识
 
-        messages = [{"role": "system", "content": system_prompt}]
-        user_history = history[0]
-        pet_history = history[1]
-        if user_history:
-            for index in range(0, len(user_history)):
-                what_i_have_asked = {}
-                what_i_have_asked["role"] = "user"
-                what_i_have_asked["content"] = user_history[index]
-                
-                what_gpt_answer = {}
-                what_gpt_answer["role"] = "assistant"
-
-                try:
-                    what_gpt_answer["content"] = pet_history[index]
-                except:
-                    what_gpt_answer["content"] = ""
-                if what_i_have_asked["content"] != "":
-                    if what_gpt_answer["content"] == "": continue
-                    if what_gpt_answer["content"] == timeout_bot_msg: continue
-                    messages.append(what_i_have_asked)
-                    messages.append(what_gpt_answer)
-                else:
-                    messages[-1]['content'] = what_gpt_answer['content']
-
-        what_i_ask_now = {}
-        what_i_ask_now["role"] = "user"
-        what_i_ask_now["content"] = inputs
-        messages.append(what_i_ask_now)
+        # 按token预算组装上下文：固定系统prompt与本次输入，历史对话按滑动窗口保留最近的若干轮
+        messages, n_dropped = self.context_manager.build_messages(inputs, history, system_prompt, memories=self.recall(inputs))
+        if n_dropped > 0:
+            print(f'[上下文] 超出 {self.context_manager.llm_model} 的上下文长度，省略了最早的 {n_dropped} 轮对话')
 
         payload = {
             "model": self.llm_model,
@@ -241,7 +347,7 @@ class OpenAI_request(QThread):
             "frequency_penalty": 0,
         }
         try:
-            print(f" {self.llm_model} : {len(history[0])} : {inputs[:100]} ..........")
+            print(f" {self.llm_model} : {len(history)} : {inputs[:100]} ..........")
         except:
             print('输入中可能存在乱码。')
         return headers,payload
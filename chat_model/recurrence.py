@@ -0,0 +1,164 @@
+"""
+    日程的重复规则，语法取RFC 5545 RRULE的一个子集，例如：
+        FREQ=DAILY;INTERVAL=2                  每两天
+        FREQ=WEEKLY;BYDAY=MO,WE;COUNT=10       每周一、周三，共10次
+        FREQ=MONTHLY;BYDAY=-1FR                每月最后一个周五
+        FREQ=MONTHLY;UNTIL=20301231T235959     每月与开始日期同一天，直到2030年底
+    重复的日程只保存一条（开始时间为第一次发生的时间），各次发生的时间由生成器在查询范围内按需展开，不写入磁盘。
+"""
+import calendar
+import datetime
+
+WEEKDAYS = ["MO", "TU", "WE", "TH", "FR", "SA", "SU"]
+FREQS = ["DAILY", "WEEKLY", "MONTHLY", "YEARLY"]
+
+def parse_until(value):
+    """
+    UNTIL可以是 YYYYMMDD、YYYYMMDDTHHMMSS（UTC时以Z结尾）或 YYYY-MM-DD HH:MM:SS，返回本地时间
+    """
+    value = value.strip()
+    if "-" in value:
+        return datetime.datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+    if len(value) == 8:
+        # 只有日期时包含当天
+        return datetime.datetime.strptime(value, "%Y%m%d").replace(hour=23, minute=59, second=59)
+    if value.endswith("Z"):
+        dt = datetime.datetime.strptime(value[:-1], "%Y%m%dT%H%M%S").replace(tzinfo=datetime.timezone.utc)
+        return dt.astimezone().replace(tzinfo=None)
+    return datetime.datetime.strptime(value, "%Y%m%dT%H%M%S")
+
+
+class Recurrence:
+    """
+    解析后的重复规则。iter_from是惰性生成器：没有COUNT时直接跳到查询起点附近的周期开始展开，
+    因此查询远期的范围也只需要常数时间；有COUNT时从第一次开始计数（次数本身就是有限的）。
+    """
+    max_empty_periods = 100     # 连续这么多个周期没有任何发生时间（例如每月30日遇到2月）就停止，防止死循环
+
+    def __init__(self, freq, interval=1, byday=(), until=None, count=None):
+        if freq not in FREQS:
+            raise ValueError(f"不支持的重复频率: {freq}")
+        if interval < 1 or (count is not None and count < 1):
+            raise ValueError("INTERVAL与COUNT必须是正整数")
+        self.freq = freq
+        self.interval = interval
+        self.byday = list(byday)    # [(序号或None, 星期几0-6)]
+        self.until = until
+        self.count = count
+
+    @staticmethod
+    def parse(text):
+        """
+        解析RRULE字符串（可以带"RRULE:"前缀），格式错误时抛出ValueError
+        """
+        text = text.strip()
+        if text.upper().startswith("RRULE:"): text = text[6:]
+        parts = {}
+        for part in text.split(";"):
+            if not part: continue
+            key, sep, value = part.partition("=")
+            if not sep: raise ValueError(f"重复规则格式错误: {part}")
+            parts[key.strip().upper()] = value.strip()
+        if "UNTIL" in parts and "COUNT" in parts:
+            raise ValueError("UNTIL与COUNT不能同时使用")
+        byday = []
+        for day in filter(None, parts.get("BYDAY", "").upper().split(",")):
+            if day[-2:] not in WEEKDAYS:
+                raise ValueError(f"重复规则中的星期格式错误: {day}")
+            byday.append((int(day[:-2]) if day[:-2] else None, WEEKDAYS.index(day[-2:])))
+        return Recurrence(
+            freq=parts.get("FREQ", "").upper(),
+            interval=int(parts.get("INTERVAL", 1)),
+            byday=byday,
+            until=parse_until(parts["UNTIL"]) if "UNTIL" in parts else None,
+            count=int(parts["COUNT"]) if "COUNT" in parts else None,
+        )
+
+    def __str__(self):
+        parts = [f"FREQ={self.freq}"]
+        if self.interval != 1: parts.append(f"INTERVAL={self.interval}")
+        if self.byday:
+            parts.append("BYDAY=" + ",".join(f"{n or ''}{WEEKDAYS[d]}" for n, d in self.byday))
+        if self.until is not None: parts.append(f"UNTIL={self.until.strftime('%Y%m%dT%H%M%S')}")
+        if self.count is not None: parts.append(f"COUNT={self.count}")
+        return ";".join(parts)
+
+    def describe(self):
+        """
+        中文描述，例如"每2周（周一、周三），共10次"
+        """
+        unit = {"DAILY": "天", "WEEKLY": "周", "MONTHLY": "月", "YEARLY": "年"}[self.freq]
+        text = f"每{self.interval if self.interval > 1 else ''}{'个' if unit == '月' and self.interval > 1 else ''}{unit}"
+        if self.byday:
+            names = "一二三四五六日"
+            days = [(f"第{n}个" if n and n > 0 else "最后一个" if n == -1 else f"倒数第{-n}个" if n else "") + "周" + names[d]
+                    for n, d in self.byday]
+            text += f"（{'、'.join(days)}）"
+        if self.until is not None: text += f"，直到{self.until.strftime('%Y-%m-%d')}"
+        if self.count is not None: text += f"，共{self.count}次"
+        return text
+
+    def get_period(self, dtstart, k):
+        """
+        第k个周期内的候选时间（升序，可能早于dtstart）
+        """
+        if self.freq == "DAILY":
+            day = dtstart + datetime.timedelta(days=k * self.interval)
+            if self.byday and day.weekday() not in [d for _, d in self.byday]: return []
+            return [day]
+        if self.freq == "WEEKLY":
+            week_start = dtstart - datetime.timedelta(days=dtstart.weekday() - 7 * self.interval * k)
+            weekdays = sorted(set(d for _, d in self.byday)) if self.byday else [dtstart.weekday()]
+            return [week_start + datetime.timedelta(days=d) for d in weekdays]
+        months = k * self.interval * (12 if self.freq == "YEARLY" else 1)
+        index = dtstart.year * 12 + dtstart.month - 1 + months
+        year, month = index // 12, index % 12 + 1
+        n_days = calendar.monthrange(year, month)[1]
+        if not self.byday:
+            return [dtstart.replace(year=year, month=month, day=dtstart.day)] if dtstart.day <= n_days else []
+        days = set()
+        for n, weekday in self.byday:
+            first = (weekday - calendar.weekday(year, month, 1)) % 7 + 1
+            matches = list(range(first, n_days + 1, 7))
+            if n is None:
+                days.update(matches)
+            elif -len(matches) <= n <= len(matches) and n != 0:
+                days.add(matches[n - 1] if n > 0 else matches[n])
+        return [dtstart.replace(year=year, month=month, day=day) for day in sorted(days)]
+
+    def get_first_period(self, dtstart, window_start):
+        """
+        不会错过window_start之后任何发生时间的最晚周期序号
+        """
+        if self.count is not None or window_start <= dtstart: return 0
+        if self.freq == "DAILY":
+            elapsed = (window_start - dtstart).days
+        elif self.freq == "WEEKLY":
+            elapsed = (window_start.date() - dtstart.date()).days + dtstart.weekday()
+            elapsed //= 7
+        elif self.freq == "MONTHLY":
+            elapsed = (window_start.year - dtstart.year) * 12 + window_start.month - dtstart.month
+        else:
+            elapsed = window_start.year - dtstart.year
+        return max(0, elapsed // self.interval - 1)
+
+    def iter_from(self, dtstart, window_start=None):
+        """
+        按时间顺序产出不早于window_start的各次发生时间，直到UNTIL/COUNT为止（都没有时是无限的，由调用方截止）
+        """
+        window_start = window_start or dtstart
+        k, n_yield, n_empty = self.get_first_period(dtstart, window_start), 0, 0
+        while n_empty < self.max_empty_periods:
+            candidates = [dt for dt in self.get_period(dtstart, k) if dt >= dtstart]
+            n_empty = 0 if candidates else n_empty + 1
+            for dt in candidates:
+                if self.until is not None and dt > self.until: return
+                n_yield += 1
+                if dt >= window_start: yield dt
+                if self.count is not None and n_yield >= self.count: return
+            k += 1
+
+    def iter_between(self, dtstart, start, end):
+        for dt in self.iter_from(dtstart, start):
+            if dt > end: return
+            yield dt
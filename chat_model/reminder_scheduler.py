@@ -0,0 +1,120 @@
+import time
+import heapq
+import itertools
+from PyQt5.QtCore import QTimer
+
+class ReminderScheduler:
+    """
+    基于小顶堆的提醒调度器，取代每分钟扫描全部日程与每个日程一个QTimer的做法。
+    堆中按预先计算好的触发时间戳排序，始终只有一个单次QTimer指向最早的触发时间；
+    添加/更新为O(log n)，删除只做标记（O(1)，被标记的条目到达堆顶时丢弃，失效条目过多时重建堆）。
+    同一个日程的多个提醒（例如重复日程的各次发生）可以归入同一个group，一次全部取消。
+    """
+    def __init__(self, callback, late_tolerance=300, max_interval_ms=10*60*1000):
+        """
+        :param callback: 到期时调用 callback(payload)
+        :param late_tolerance: 允许补发的延迟秒数（例如电脑休眠后醒来），超过则跳过该提醒
+        :param max_interval_ms: 定时器单次最长等待时间，防止系统休眠或修改时间后定时器漂移
+        """
+        self.callback = callback
+        self.late_tolerance = late_tolerance
+        self.max_interval_ms = max_interval_ms
+        self.heap = []              # [触发时间戳, 序号, key, payload, 是否有效, group]
+        self.entries = {}           # key -> 堆中的条目
+        self.groups = {}            # group -> {key}
+        self.n_removed = 0
+        self.counter = itertools.count()
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.check)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def add(self, key, trigger_ts, payload, group=None):
+        """
+        添加或更新一个提醒，key相同的旧提醒被替换
+        """
+        self.remove(key, rearm=False)
+        entry = [trigger_ts, next(self.counter), key, payload, True, group]
+        self.entries[key] = entry
+        if group is not None:
+            self.groups.setdefault(group, set()).add(key)
+        heapq.heappush(self.heap, entry)
+        if self.heap[0] is entry:
+            self.arm()
+
+    def remove(self, key, rearm=True):
+        entry = self.entries.pop(key, None)
+        if entry is None: return False
+        entry[4] = False
+        self.discard_from_group(entry)
+        self.n_removed += 1
+        if self.n_removed > 64 and self.n_removed > len(self.heap) // 2:
+            self.heap = [e for e in self.heap if e[4]]
+            heapq.heapify(self.heap)
+            self.n_removed = 0
+        if rearm: self.arm()
+        return True
+
+    def remove_group(self, group):
+        """
+        取消一个group中的所有提醒
+        """
+        for key in list(self.groups.get(group, ())):
+            self.remove(key, rearm=False)
+        self.arm()
+
+    def discard_from_group(self, entry):
+        group = entry[5]
+        if group is not None and group in self.groups:
+            self.groups[group].discard(entry[2])
+            if not self.groups[group]: del self.groups[group]
+
+    def clear(self):
+        self.heap, self.entries, self.groups, self.n_removed = [], {}, {}, 0
+        self.timer.stop()
+
+    def get_next(self):
+        """
+        返回最早的有效条目 (触发时间戳, key, payload)，没有时返回None
+        """
+        while self.heap and not self.heap[0][4]:
+            heapq.heappop(self.heap)
+            self.n_removed -= 1
+        if not self.heap: return None
+        trigger_ts, _, key, payload, _, _ = self.heap[0]
+        return trigger_ts, key, payload
+
+    def arm(self):
+        """
+        让唯一的定时器指向最早的触发时间
+        """
+        item = self.get_next()
+        if item is None:
+            self.timer.stop()
+            return
+        delay_ms = int(max(0, item[0] - time.time()) * 1000)
+        self.timer.start(min(delay_ms, self.max_interval_ms))
+
+    def check(self):
+        """
+        触发所有已经到期的提醒，然后重新设定定时器
+        """
+        now = time.time()
+        while True:
+            item = self.get_next()
+            if item is None or item[0] > now: break
+            trigger_ts, key, payload = item
+            entry = heapq.heappop(self.heap)
+            del self.entries[key]
+            self.discard_from_group(entry)
+            if now - trigger_ts <= self.late_tolerance:
+                try:
+                    self.callback(payload)
+                except Exception as e:
+                    print(f"提醒回调失败: {e}")
+        self.arm()
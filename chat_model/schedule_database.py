@@ -0,0 +1,82 @@
+import os
+import json
+import sqlite3
+import threading
+from chat_model.schedule_store import ScheduleStore
+
+class ScheduleDatabase:
+    """
+    日程的SQLite持久化，取代每次改动都整体重写schedule.json。
+    使用WAL日志，每次增删改只写入对应的行并在一个事务内提交，写入耗时与日程总数无关，中途崩溃也不会损坏已有数据。
+    id、标题、开始时间单独成列（带索引），完整的日程以JSON保存在data列中，日程新增字段时无需修改表结构。
+    """
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS schedules ("
+                              "id INTEGER PRIMARY KEY, title TEXT NOT NULL, start_time TEXT NOT NULL, data TEXT NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_schedules_start_time ON schedules (start_time)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_schedules_key ON schedules (title, start_time)")
+
+    @staticmethod
+    def to_row(schedule):
+        return (schedule["id"], schedule["title"], schedule["start_time"], json.dumps(schedule, ensure_ascii=False))
+
+    def load_all(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT data FROM schedules ORDER BY start_time, id").fetchall()
+        return [json.loads(data) for data, in rows]
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM schedules").fetchone()[0]
+
+    def insert_many(self, schedules):
+        """
+        在同一个事务中写入多个日程（已存在的id被覆盖）
+        """
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO schedules (id, title, start_time, data) VALUES (?, ?, ?, ?)",
+                                  [self.to_row(schedule) for schedule in schedules])
+
+    def insert(self, schedule):
+        self.insert_many([schedule])
+
+    def update(self, schedule):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE schedules SET title = ?, start_time = ?, data = ? WHERE id = ?",
+                              self.to_row(schedule)[1:] + (schedule["id"],))
+
+    def delete_many(self, schedule_ids):
+        with self.lock, self.conn:
+            self.conn.executemany("DELETE FROM schedules WHERE id = ?", [(schedule_id,) for schedule_id in schedule_ids])
+
+    def delete(self, schedule_id):
+        self.delete_many([schedule_id])
+
+    def migrate_from_json(self, json_file):
+        """
+        一次性迁移：数据库为空且存在旧的schedule.json时，为其中的日程分配id后写入数据库，
+        原文件重命名为 schedule.json.migrated 保留备份
+        """
+        if not os.path.exists(json_file) or self.count() > 0:
+            return False
+        try:
+            with open(json_file, 'r', encoding='utf-8') as f:
+                schedules = ScheduleStore(json.load(f)).get_all()
+            self.insert_many(schedules)
+            os.replace(json_file, json_file + '.migrated')
+            print(f"已将{len(schedules)}个日程从{json_file}迁移到数据库")
+            return True
+        except Exception as e:
+            # 迁移失败时保留原文件，下次启动重试
+            print(f"迁移日程信息失败: {e}")
+            return False
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
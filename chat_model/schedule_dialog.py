@@ -2,10 +2,169 @@ import os
 import json
 import datetime
 from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, 
-                             QFileDialog, QTableWidget, QTableWidgetItem, QHeaderView,
-                             QDateTimeEdit, QLineEdit, QTextEdit, QMessageBox)
+                             QFileDialog, QTableView, QAbstractItemView, QHeaderView,
+                             QDateTimeEdit, QLineEdit, QTextEdit, QMessageBox, QComboBox, QPlainTextEdit)
 # 注意：import_schedule_dialog 模块会在需要时动态导入
-from PyQt5.QtCore import Qt, QDateTime
+from PyQt5.QtCore import Qt, QDateTime, QAbstractTableModel, QModelIndex, QThread, pyqtSignal
+
+class ScheduleTableModel(QAbstractTableModel):
+    """
+    日程表格的model，取代每次刷新都为所有日程创建QTableWidgetItem。
+    排序与过滤由ScheduleStore.query完成，model只保存结果的id列表；
+    视图通过canFetchMore/fetchMore每次取page_size行，data()只读取可见单元格对应的日程；
+    日程增删改时通过ScheduleManager的监听者接口增量插入或移除行，不重新加载整个表格。
+    """
+    headers = ["标题", "开始时间", "重复", "地点", "描述"]
+    fields = ["title", "start_time", "rrule", "location", "description"]
+    page_size = 200
+
+    def __init__(self, schedule_manager, parent=None):
+        super().__init__(parent)
+        self.schedule_manager = schedule_manager
+        self.store = schedule_manager.store
+        self.keyword = ""
+        self.sort_field = "start_time"
+        self.descending = False
+        self.ids = []           # 查询结果的全部id
+        self.n_loaded = 0       # 已经交给视图的行数
+        self.refresh()
+        schedule_manager.add_listener(self.on_schedule_changed)
+
+    def detach(self):
+        """
+        对话框关闭时停止监听日程变化
+        """
+        self.schedule_manager.remove_listener(self.on_schedule_changed)
+
+    def refresh(self):
+        self.beginResetModel()
+        self.ids = self.store.query(self.keyword, self.sort_field, self.descending)
+        self.n_loaded = min(self.page_size, len(self.ids))
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.n_loaded
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid(): return None
+        schedule_id = self.ids[index.row()]
+        if role == Qt.UserRole:
+            return schedule_id
+        if role == Qt.DisplayRole:
+            field = self.fields[index.column()]
+            if field == "rrule":
+                recurrence = self.store.recurring.get(schedule_id)
+                return recurrence.describe() if recurrence is not None else ""
+            return self.store.get(schedule_id).get(field, "")
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.headers[section]
+        return super().headerData(section, orientation, role)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.n_loaded < len(self.ids)
+
+    def fetchMore(self, parent=QModelIndex()):
+        n = min(self.page_size, len(self.ids) - self.n_loaded)
+        if parent.isValid() or n <= 0: return
+        self.beginInsertRows(QModelIndex(), self.n_loaded, self.n_loaded + n - 1)
+        self.n_loaded += n
+        self.endInsertRows()
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.sort_field = self.fields[column]
+        self.descending = order == Qt.DescendingOrder
+        self.refresh()
+
+    def set_filter(self, keyword):
+        self.keyword = keyword.strip()
+        self.refresh()
+
+    def get_schedule_id(self, row):
+        return self.ids[row]
+
+    def get_sort_key(self, schedule_id):
+        schedule = self.store.get(schedule_id)
+        if self.sort_field == "start_time":
+            return (schedule["start_time"], schedule_id)
+        return self.store.get_sort_key(schedule, self.sort_field)
+
+    def find_position(self, schedule_id):
+        """
+        二分查找新日程在当前排序下应处的行
+        """
+        key = self.get_sort_key(schedule_id)
+        low, high = 0, len(self.ids)
+        while low < high:
+            middle = (low + high) // 2
+            other = self.get_sort_key(self.ids[middle])
+            if (other > key) if self.descending else (other < key):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def on_schedule_changed(self, event, schedule_id):
+        if event == "reset":
+            self.refresh()
+            return
+        if event in ("updated", "deleted"):
+            self.remove_row(schedule_id)
+        if event in ("added", "updated"):
+            self.insert_row(schedule_id)
+
+    def remove_row(self, schedule_id):
+        try:
+            row = self.ids.index(schedule_id)
+        except ValueError:
+            return
+        if row < self.n_loaded:
+            self.beginRemoveRows(QModelIndex(), row, row)
+            del self.ids[row]
+            self.n_loaded -= 1
+            self.endRemoveRows()
+        else:
+            del self.ids[row]
+
+    def insert_row(self, schedule_id):
+        schedule = self.store.get(schedule_id)
+        if schedule is None: return
+        if self.keyword and not self.store.match(schedule, self.keyword.casefold()): return
+        row = self.find_position(schedule_id)
+        if row <= self.n_loaded:
+            self.beginInsertRows(QModelIndex(), row, row)
+            self.ids.insert(row, schedule_id)
+            self.n_loaded += 1
+            self.endInsertRows()
+        else:
+            # 还没有加载到的位置，等视图fetchMore时再显示
+            self.ids.insert(row, schedule_id)
+
+
+class ScheduleParseThread(QThread):
+    """
+    在后台请求大模型解析文本中的日程，完成后发出 parsed(日程列表, 无效条目数, 错误信息)
+    """
+    parsed = pyqtSignal(list, int, str)
+
+    def __init__(self, text, config, parent=None):
+        super().__init__(parent)
+        self.text = text
+        self.config = config
+
+    def run(self):
+        from chat_model.schedule_parser import request_schedules
+        try:
+            schedules, n_invalid = request_schedules(self.text, self.config)
+            self.parsed.emit(schedules, n_invalid, "")
+        except Exception as e:
+            self.parsed.emit([], 0, str(e))
+
 
 class ScheduleDialog(QDialog):
     """
@@ -35,41 +194,40 @@ class ScheduleDialog(QDialog):
         self.delete_btn = QPushButton("删除日程")
         self.delete_btn.clicked.connect(self.delete_schedule)
         
+        self.text_btn = QPushButton("从文字添加")
+        self.text_btn.clicked.connect(self.show_text_dialog)
+        
         button_layout.addWidget(self.import_btn)
         button_layout.addWidget(self.add_btn)
+        button_layout.addWidget(self.text_btn)
         button_layout.addWidget(self.delete_btn)
         
-        # 日程表格
-        self.schedule_table = QTableWidget()
-        self.schedule_table.setColumnCount(4)
-        self.schedule_table.setHorizontalHeaderLabels(["标题", "开始时间", "地点", "描述"])
+        # 搜索框
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText("搜索标题、地点或描述")
+        
+        # 日程表格（只读，数据由ScheduleTableModel按需提供）
+        self.schedule_table = QTableView()
         self.schedule_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
-        self.schedule_table.setEditTriggers(QTableWidget.NoEditTriggers)  # 设置表格为只读
+        self.schedule_table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)  # 固定行高，不需要逐行计算高度
+        self.schedule_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.schedule_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.schedule_table.setSelectionMode(QAbstractItemView.SingleSelection)
         
-        # 加载日程数据
-        self.load_schedules()
+        if self.schedule_manager:
+            self.schedule_model = ScheduleTableModel(self.schedule_manager, self)
+            self.schedule_table.setModel(self.schedule_model)
+            self.schedule_table.setSortingEnabled(True)
+            self.schedule_table.sortByColumn(1, Qt.AscendingOrder)
+            self.search_edit.textChanged.connect(self.schedule_model.set_filter)
+            self.finished.connect(self.schedule_model.detach)
         
         main_layout.addLayout(button_layout)
+        main_layout.addWidget(self.search_edit)
         main_layout.addWidget(self.schedule_table)
         
         self.setLayout(main_layout)
     
-    def load_schedules(self):
-        """
-        加载日程数据到表格
-        """
-        if not self.schedule_manager:
-            return
-        
-        schedules = self.schedule_manager.get_all_schedules()
-        self.schedule_table.setRowCount(len(schedules))
-        
-        for row, schedule in enumerate(schedules):
-            self.schedule_table.setItem(row, 0, QTableWidgetItem(schedule["title"]))
-            self.schedule_table.setItem(row, 1, QTableWidgetItem(schedule["start_time"]))
-            self.schedule_table.setItem(row, 2, QTableWidgetItem(schedule.get("location", "")))
-            self.schedule_table.setItem(row, 3, QTableWidgetItem(schedule.get("description", "")))
-    
     def import_schedule(self):
         """
         导入日程 - 通过对话框直接输入
@@ -95,7 +253,6 @@ class ScheduleDialog(QDialog):
                 
                 if success_count > 0:
                     QMessageBox.information(self, "导入成功", f"成功导入 {success_count} 个日程！")
-                    self.load_schedules()  # 重新加载日程数据
                 else:
                     QMessageBox.warning(self, "导入失败", "没有成功导入任何日程！")
             else:
@@ -112,27 +269,57 @@ class ScheduleDialog(QDialog):
             start_time = add_dialog.datetime_edit.dateTime().toString("yyyy-MM-dd hh:mm:ss")
             location = add_dialog.location_edit.text()
             description = add_dialog.description_edit.toPlainText()
+            rrule = add_dialog.repeat_combo.currentData()
+            reminders = add_dialog.reminder_combo.currentData()
             
             # 添加日程
-            if self.schedule_manager.add_schedule(title, start_time, description, location):
+            if self.schedule_manager.add_schedule(title, start_time, description, location, rrule, reminders):
                 QMessageBox.information(self, "添加成功", "日程添加成功！")
-                self.load_schedules()  # 重新加载日程数据
             else:
                 QMessageBox.warning(self, "添加失败", "日程添加失败！")
     
+    def show_text_dialog(self):
+        """
+        粘贴一段文字（例如"每周三下午三点组会"或一封邮件），由大模型一次解析出其中所有日程后添加
+        """
+        text_dialog = TextScheduleDialog(self)
+        if text_dialog.exec_() != QDialog.Accepted or not self.schedule_manager:
+            return
+        text = text_dialog.text_edit.toPlainText().strip()
+        if not text:
+            return
+        self.text_btn.setEnabled(False)
+        self.text_btn.setText("正在解析……")
+        self.parse_thread = ScheduleParseThread(text, self.schedule_manager.config, self)
+        self.parse_thread.parsed.connect(self.on_text_parsed)
+        self.parse_thread.start()
+    
+    def on_text_parsed(self, schedules, n_invalid, error):
+        self.text_btn.setEnabled(True)
+        self.text_btn.setText("从文字添加")
+        if error:
+            QMessageBox.warning(self, "解析失败", f"解析日程失败：{error}")
+            return
+        # 所有日程在一个事务中写入
+        n_added = self.schedule_manager.add_schedules(schedules)
+        message = f"识别出 {len(schedules)} 个日程，成功添加 {n_added} 个"
+        if len(schedules) > n_added:
+            message += f"，{len(schedules) - n_added} 个与已有日程重复或添加失败"
+        if n_invalid:
+            message += f"，{n_invalid} 个格式有误被忽略"
+        QMessageBox.information(self, "添加日程", message + "。")
+    
     def delete_schedule(self):
         """
         删除选中的日程
         """
-        selected_rows = self.schedule_table.selectedItems()
+        selected_rows = self.schedule_table.selectionModel().selectedRows() if self.schedule_manager else []
         if not selected_rows:
             QMessageBox.warning(self, "警告", "请先选择要删除的日程！")
             return
         
-        # 获取选中行的标题和开始时间
-        row = selected_rows[0].row()
-        title = self.schedule_table.item(row, 1).text()
-        start_time = self.schedule_table.item(row, 2).text()
+        # 获取选中行的日程id
+        schedule_id = self.schedule_model.get_schedule_id(selected_rows[0].row())
         
         # 确认删除
         reply = QMessageBox.question(
@@ -141,9 +328,8 @@ class ScheduleDialog(QDialog):
         )
         
         if reply == QMessageBox.Yes and self.schedule_manager:
-            if self.schedule_manager.delete_schedule(title, start_time):
+            if self.schedule_manager.delete_schedule_by_id(schedule_id):
                 QMessageBox.information(self, "删除成功", "日程删除成功！")
-                self.load_schedules()  # 重新加载日程数据
             else:
                 QMessageBox.warning(self, "删除失败", "日程删除失败！")
 
@@ -178,6 +364,26 @@ class AddScheduleDialog(QDialog):
         time_layout.addWidget(time_label)
         time_layout.addWidget(self.datetime_edit)
         
+        # 重复
+        repeat_layout = QHBoxLayout()
+        repeat_label = QLabel("重复:")
+        self.repeat_combo = QComboBox()
+        for text, rrule in [("不重复", None), ("每天", "FREQ=DAILY"), ("每个工作日", "FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR"),
+                            ("每周", "FREQ=WEEKLY"), ("每月", "FREQ=MONTHLY"), ("每年", "FREQ=YEARLY")]:
+            self.repeat_combo.addItem(text, rrule)
+        repeat_layout.addWidget(repeat_label)
+        repeat_layout.addWidget(self.repeat_combo)
+        
+        # 提醒（开始前的分钟数，None为默认设置）
+        reminder_layout = QHBoxLayout()
+        reminder_label = QLabel("提醒:")
+        self.reminder_combo = QComboBox()
+        for text, reminders in [("默认", None), ("开始时", [0]), ("提前10分钟", [10]), ("提前1小时", [60]),
+                                ("提前1天、1小时和10分钟", [1440, 60, 10]), ("不提醒", [])]:
+            self.reminder_combo.addItem(text, reminders)
+        reminder_layout.addWidget(reminder_label)
+        reminder_layout.addWidget(self.reminder_combo)
+        
         # 地点
         location_layout = QHBoxLayout()
         location_label = QLabel("地点:")
@@ -203,6 +409,8 @@ class AddScheduleDialog(QDialog):
         
         layout.addLayout(title_layout)
         layout.addLayout(time_layout)
+        layout.addLayout(repeat_layout)
+        layout.addLayout(reminder_layout)
         layout.addLayout(location_layout)
         layout.addLayout(description_layout)
         layout.addLayout(button_layout)
@@ -220,4 +428,31 @@ class AddScheduleDialog(QDialog):
     
     def accept(self):
         if self.validate():
-            super().accept()
\ No newline at end of file
+            super().accept()
+
+
+class TextScheduleDialog(QDialog):
+    """
+    从文字添加日程的输入对话框
+    """
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("从文字添加日程")
+        self.setMinimumSize(400, 300)
+        
+        layout = QVBoxLayout()
+        layout.addWidget(QLabel("输入或粘贴包含日程的文字，可以一次包含多个日程："))
+        self.text_edit = QPlainTextEdit()
+        self.text_edit.setPlaceholderText("例如：每周三下午三点组会；下周五上午十点在301会议室答辩")
+        layout.addWidget(self.text_edit)
+        
+        button_layout = QHBoxLayout()
+        self.ok_btn = QPushButton("确定")
+        self.cancel_btn = QPushButton("取消")
+        self.ok_btn.clicked.connect(self.accept)
+        self.cancel_btn.clicked.connect(self.reject)
+        button_layout.addWidget(self.ok_btn)
+        button_layout.addWidget(self.cancel_btn)
+        layout.addLayout(button_layout)
+        
+        self.setLayout(layout)
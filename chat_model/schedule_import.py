@@ -0,0 +1,249 @@
+"""
+    日程文件的流式读取，导入大文件时不需要一次性读入内存
+
+    iter_json_schedules: 逐个解析JSON数组中的日程对象
+    iter_ics_schedules: 按RFC 5545解析iCalendar（.ics）文件中的VEVENT
+    iter_schedules_from_file: 按扩展名选择上面两种之一
+    每个函数都是生成器，产出 {"title", "start_time", "description", "location"} 格式的日程
+    （重复日程另有"rrule"，自定义了提醒时间的另有"reminders"）；
+    单个条目无法解析时产出 None，由调用方计入失败数量。
+"""
+import re
+import json
+import datetime
+from chat_model.recurrence import Recurrence
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+TIME_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}')
+MAX_REMINDER_MINUTES = 7 * 24 * 60     # 最多提前7天提醒
+
+def parse_time(text):
+    """
+    解析"YYYY-MM-DD HH:MM:SS"格式的时间，格式错误时抛出ValueError；
+    先用正则检查格式，再用fromisoformat解析，比strptime快一个数量级
+    """
+    if not TIME_PATTERN.fullmatch(text):
+        raise ValueError(f"时间格式错误: {text}")
+    return datetime.datetime.fromisoformat(text)
+
+def normalize_reminders(value):
+    """
+    整理提醒时间：开始前多少分钟提醒的列表（例如[1440, 60, 10]），也接受"1440,60,10"这样的字符串；
+    去重后按从早到晚（分钟数从大到小）排列，空列表表示不提醒；格式错误或超出范围时抛出ValueError
+    """
+    if isinstance(value, str):
+        value = [part for part in re.split(r'[,，\s]+', value) if part]
+    if not isinstance(value, (list, tuple)):
+        raise ValueError(f"提醒时间格式错误: {value}")
+    reminders = set()
+    for minutes in value:
+        if isinstance(minutes, bool): raise ValueError(f"提醒时间格式错误: {minutes}")
+        minutes = int(minutes)
+        if not 0 <= minutes <= MAX_REMINDER_MINUTES:
+            raise ValueError(f"提醒时间超出范围（0到{MAX_REMINDER_MINUTES}分钟）: {minutes}")
+        reminders.add(minutes)
+    return sorted(reminders, reverse=True)
+
+def normalize_schedule(item):
+    """
+    校验并整理一个日程，返回整理后的日程；缺少字段或时间格式错误时返回None
+    """
+    if not isinstance(item, dict) or not item.get("title") or not isinstance(item.get("start_time"), str):
+        return None
+    try:
+        parse_time(item["start_time"])
+        if item.get("rrule"): Recurrence.parse(item["rrule"])
+        reminders = normalize_reminders(item["reminders"]) if item.get("reminders") is not None else None
+    except (ValueError, TypeError):
+        return None
+    schedule = dict(item)
+    if reminders is not None:
+        schedule["reminders"] = reminders
+    else:
+        schedule.pop("reminders", None)
+    schedule.pop("id", None)
+    schedule.setdefault("description", "")
+    schedule.setdefault("location", "")
+    return schedule
+
+
+def iter_json_schedules(file_path, chunk_size=1 << 16):
+    """
+    分块读取文件，用JSONDecoder.raw_decode逐个解析顶层数组中的对象
+    """
+    decoder = json.JSONDecoder()
+    with open(file_path, 'r', encoding='utf-8-sig') as f:
+        buffer, pos, eof = "", 0, False
+
+        def fill():
+            nonlocal buffer, pos, eof
+            chunk = f.read(chunk_size)
+            if chunk == "": eof = True
+            buffer = buffer[pos:] + chunk
+            pos = 0
+
+        def skip_space():
+            nonlocal pos
+            while True:
+                while pos < len(buffer) and buffer[pos] in " \t\r\n":
+                    pos += 1
+                if pos < len(buffer) or eof: return
+                fill()
+
+        skip_space()
+        if pos >= len(buffer) or buffer[pos] != "[":
+            raise ValueError("数据格式错误，应为日程列表")
+        pos += 1
+        while True:
+            skip_space()
+            if pos >= len(buffer):
+                raise ValueError("文件不完整：日程列表没有结束")
+            if buffer[pos] == "]": return
+            if buffer[pos] == ",":
+                pos += 1
+                continue
+            while True:
+                try:
+                    item, pos = decoder.raw_decode(buffer, pos)
+                    break
+                except json.JSONDecodeError:
+                    # 对象跨越了分块边界，继续读取；已经读到文件末尾则说明格式错误
+                    if eof: raise
+                    fill()
+            yield normalize_schedule(item)
+
+
+def unfold_lines(f):
+    """
+    RFC 5545 3.1: 以空格或制表符开头的行是上一行的延续
+    """
+    current = None
+    for line in f:
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and current is not None:
+            current += line[1:]
+            continue
+        if current is not None: yield current
+        current = line
+    if current is not None: yield current
+
+
+def parse_content_line(line):
+    """
+    把 NAME;PARAM=VALUE;...:VALUE 拆分为 (名称, 参数字典, 值)，参数值可以带引号（其中可以有冒号和分号）
+    """
+    params, in_quote, start, parts = {}, False, 0, []
+    for i, ch in enumerate(line):
+        if ch == '"':
+            in_quote = not in_quote
+        elif not in_quote and ch in ";:":
+            parts.append(line[start:i])
+            start = i + 1
+            if ch == ":": break
+    else:
+        return None, params, None
+    for part in parts[1:]:
+        key, _, value = part.partition("=")
+        params[key.upper()] = value.strip('"')
+    return parts[0].upper(), params, line[start:]
+
+
+def unescape_text(value):
+    return re.sub(r'\\([\\;,nN])', lambda m: "\n" if m.group(1) in "nN" else m.group(1), value)
+
+
+def parse_ics_datetime(value, params):
+    """
+    把DTSTART转换为本地时间的"YYYY-MM-DD HH:MM:SS"：支持全天日期、UTC（Z结尾）、TZID与浮动时间
+    """
+    value = value.strip()
+    if params.get("VALUE") == "DATE" or len(value) == 8:
+        return datetime.datetime.strptime(value[:8], "%Y%m%d").strftime(TIME_FORMAT)
+    if value.endswith("Z"):
+        dt = datetime.datetime.strptime(value[:-1], "%Y%m%dT%H%M%S").replace(tzinfo=datetime.timezone.utc)
+        return dt.astimezone().strftime(TIME_FORMAT)
+    dt = datetime.datetime.strptime(value, "%Y%m%dT%H%M%S")
+    tzid = params.get("TZID")
+    if tzid:
+        try:
+            from zoneinfo import ZoneInfo
+            dt = dt.replace(tzinfo=ZoneInfo(tzid)).astimezone().replace(tzinfo=None)
+        except Exception:
+            pass    # 未知时区按本地时间处理
+    return dt.strftime(TIME_FORMAT)
+
+
+def parse_ics_trigger(value, params):
+    """
+    把VALARM中相对开始时间的TRIGGER（例如-PT15M、-P1DT2H、-P1W）转换为提前的分钟数；
+    绝对时间或相对结束时间的TRIGGER返回None
+    """
+    if params.get("VALUE", "DURATION") != "DURATION" or params.get("RELATED", "START") != "START":
+        return None
+    match = re.fullmatch(r'([+-]?)P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?', value.strip())
+    if match is None: return None
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    total = ((int(weeks or 0) * 7 + int(days or 0)) * 24 + int(hours or 0)) * 60 + int(minutes or 0) + int(seconds or 0) // 60
+    if sign != "-" and total != 0: return None     # 开始之后的提醒不支持
+    return total
+
+
+def iter_ics_schedules(file_path):
+    """
+    逐行读取.ics文件，每遇到一个完整的VEVENT产出一个日程；
+    VEVENT内部VALARM的TRIGGER作为提醒时间，其余子组件被忽略
+    """
+    with open(file_path, 'r', encoding='utf-8-sig', newline='') as f:
+        event, depth, in_alarm = None, 0, False
+        for line in unfold_lines(f):
+            name, params, value = parse_content_line(line)
+            if name is None: continue
+            if name == "BEGIN":
+                if value.upper() == "VEVENT" and event is None:
+                    event, depth = {}, 0
+                elif event is not None:
+                    depth += 1
+                    in_alarm = depth == 1 and value.upper() == "VALARM"
+            elif name == "END":
+                if event is None: continue
+                if depth > 0:
+                    depth -= 1
+                    in_alarm = False
+                elif value.upper() == "VEVENT":
+                    yield finish_ics_event(event)
+                    event = None
+            elif event is not None and depth == 0:
+                event[name] = (params, value)
+            elif in_alarm and name == "TRIGGER":
+                event.setdefault("TRIGGERS", []).append((params, value))
+
+
+def finish_ics_event(event):
+    try:
+        params, value = event["DTSTART"]
+        schedule = {
+            "title": unescape_text(event.get("SUMMARY", ({}, ""))[1]),
+            "start_time": parse_ics_datetime(value, params),
+            "description": unescape_text(event.get("DESCRIPTION", ({}, ""))[1]),
+            "location": unescape_text(event.get("LOCATION", ({}, ""))[1]),
+        }
+    except (KeyError, ValueError):
+        return None
+    if "RRULE" in event:
+        try:
+            # 规范化（UNTIL转换为本地时间）；不支持的规则（例如FREQ=HOURLY）只导入第一次发生
+            schedule["rrule"] = str(Recurrence.parse(event["RRULE"][1]))
+        except ValueError:
+            pass
+    if "TRIGGERS" in event:
+        reminders = [parse_ics_trigger(value, params) for params, value in event["TRIGGERS"]]
+        reminders = [minutes for minutes in reminders if minutes is not None and minutes <= MAX_REMINDER_MINUTES]
+        if reminders:
+            schedule["reminders"] = normalize_reminders(reminders)
+    return schedule if schedule["title"] else None
+
+
+def iter_schedules_from_file(file_path):
+    if file_path.lower().endswith((".ics", ".ical", ".ifb", ".icalendar")):
+        return iter_ics_schedules(file_path)
+    return iter_json_schedules(file_path)
@@ -3,6 +3,11 @@ import json
 import datetime
 from pathlib import Path
 from PyQt5.QtCore import QTimer, QDateTime
+from chat_model.reminder_scheduler import ReminderScheduler
+from chat_model.schedule_store import ScheduleStore
+from chat_model.schedule_database import ScheduleDatabase
+from chat_model.schedule_import import iter_schedules_from_file, normalize_reminders, MAX_REMINDER_MINUTES
+from chat_model.recurrence import Recurrence
 
 class ScheduleManager:
     """
@@ -13,14 +18,28 @@ class ScheduleManager:
         self.desktop_pet = desktop_pet
         self.user_data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'user_data')
         self.ensure_user_data_dir()
-        self.schedule_file = os.path.join(self.user_data_dir, 'schedule.json')
-        self.schedules = self.load_schedules()
-        self.reminder_timers = {}
+        self.schedule_file = os.path.join(self.user_data_dir, 'schedule.json')   # 旧版本的日程文件，启动时迁移到数据库
+        self.database = ScheduleDatabase(os.path.join(self.user_data_dir, 'schedule.db'))
+        self.database.migrate_from_json(self.schedule_file)
+        self.store = ScheduleStore(self.load_schedules())
+        self.listeners = []         # 日程变化的监听者 callback(事件, 日程id)，例如日程表格的model
+        # 没有单独设置提醒时间的日程，在开始前这些分钟提醒（配置[Schedule] REMINDERS，例如"1440,60,10"）
+        self.default_reminders = self.load_default_reminders()
+        self.snooze_minutes = 5     # 提醒气泡上"稍后提醒"推迟的分钟数
         
-        # 初始化定时器，每分钟检查一次是否有需要提醒的日程
-        self.check_timer = QTimer()
-        self.check_timer.timeout.connect(self.check_schedules)
-        self.check_timer.start(60000)  # 60000毫秒 = 1分钟
+        # 提醒按触发时间放入小顶堆，只用一个定时器等待最早的提醒；
+        # 每个日程的每个提醒时间都是堆中的一个条目（触发时间在设置时计算好），多个提醒不增加轮询；
+        # 错过不超过5分钟的提醒（例如刚启动或从休眠中恢复）仍然补发
+        self.reminder_scheduler = ReminderScheduler(self.show_reminder, late_tolerance=300)
+        
+        # 只为触发时间在reminder_horizon之内的提醒排期，每过半个horizon向后补充一次，
+        # 日历中远期的日程（例如导入的一整年数据）不占用调度器
+        self.reminder_horizon = datetime.timedelta(days=2)
+        self.armed_until = None
+        self.horizon_timer = QTimer()
+        self.horizon_timer.setSingleShot(True)
+        self.horizon_timer.timeout.connect(self.extend_reminders)
+        self.extend_reminders()
         
         # 立即检查一次日程
         self.check_schedules()
@@ -32,41 +51,68 @@ class ScheduleManager:
         if not os.path.exists(self.user_data_dir):
             os.makedirs(self.user_data_dir)
     
-    def load_schedules(self):
+    def add_listener(self, callback):
         """
-        加载日程信息，如果文件不存在则创建空列表
+        注册日程变化的监听者：callback(event, schedule_id)，event为"added"、"updated"、"deleted"，
+        批量导入后为"reset"（schedule_id为None）
         """
-        if os.path.exists(self.schedule_file):
+        self.listeners.append(callback)
+    
+    def remove_listener(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+    
+    def notify(self, event, schedule_id=None):
+        for callback in list(self.listeners):
             try:
-                with open(self.schedule_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                callback(event, schedule_id)
             except Exception as e:
-                print(f"加载日程信息失败: {e}")
-                return []
-        else:
-            return []
+                print(f"日程监听者处理失败: {e}")
     
-    def save_schedules(self):
+    def load_default_reminders(self):
         """
-        保存日程信息
+        从配置中读取默认的提醒时间，没有配置或格式错误时为开始前15分钟
         """
         try:
-            with open(self.schedule_file, 'w', encoding='utf-8') as f:
-                json.dump(self.schedules, f, ensure_ascii=False, indent=4)
-            return True
+            value = self.config.get("Schedule", "REMINDERS", fallback="15") if self.config is not None else "15"
+            return normalize_reminders(value)
+        except (ValueError, AttributeError) as e:
+            print(f"提醒时间配置错误，使用默认值: {e}")
+            return [15]
+    
+    def get_reminders(self, schedule):
+        """
+        日程的提醒时间（开始前的分钟数列表），没有单独设置时使用默认值；空列表表示不提醒
+        """
+        reminders = schedule.get("reminders")
+        return self.default_reminders if reminders is None else reminders
+    
+    def load_schedules(self):
+        """
+        从数据库加载日程信息
+        """
+        try:
+            return self.database.load_all()
         except Exception as e:
-            print(f"保存日程信息失败: {e}")
-            return False
+            print(f"加载日程信息失败: {e}")
+            return []
     
-    def add_schedule(self, title, start_time, description="", location=""):
+    def add_schedule(self, title, start_time, description="", location="", rrule=None, reminders=None):
         """
         添加新日程
         :param title: 日程标题
-        :param start_time: 开始时间，格式为"YYYY-MM-DD HH:MM:SS"
+        :param start_time: 开始时间（重复日程为第一次发生的时间），格式为"YYYY-MM-DD HH:MM:SS"
         :param description: 日程描述
         :param location: 地点
+        :param rrule: 重复规则，例如"FREQ=WEEKLY;BYDAY=MO,WE"，见chat_model/recurrence.py；None表示不重复
+        :param reminders: 开始前多少分钟提醒，例如[1440, 60, 10]；None表示使用默认值，[]表示不提醒
         :return: 是否添加成功
         """
+        if rrule and not self.validate_rrule(rrule):
+            return False
+        if reminders is not None:
+            reminders = self.validate_reminders(reminders)
+            if reminders is None: return False
         try:
             # 验证时间格式
             datetime.datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S")
@@ -78,15 +124,22 @@ class ScheduleManager:
                 "location": location,
                 "created_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             }
+            if rrule:
+                new_schedule["rrule"] = rrule
+            if reminders is not None:
+                new_schedule["reminders"] = reminders
             
-            self.schedules.append(new_schedule)
-            success = self.save_schedules()
-            
-            if success:
-                # 设置提醒
-                self.set_reminder(new_schedule)
+            schedule_id = self.store.add(new_schedule)
+            try:
+                self.database.insert(new_schedule)
+            except Exception:
+                self.store.delete(schedule_id)
+                raise
             
-            return success
+            # 设置提醒
+            self.set_reminder(new_schedule)
+            self.notify("added", schedule_id)
+            return True
         except ValueError:
             print("时间格式错误，请使用YYYY-MM-DD HH:MM:SS格式")
             return False
@@ -102,33 +155,48 @@ class ScheduleManager:
         :param kwargs: 要更新的字段，可以包括新的title, start_time, description, location
         :return: 是否更新成功
         """
-        try:
-            for i, schedule in enumerate(self.schedules):
-                if schedule["title"] == title and schedule["start_time"] == start_time:
-                    # 如果更新了开始时间，验证格式
-                    if "start_time" in kwargs:
-                        datetime.datetime.strptime(kwargs["start_time"], "%Y-%m-%d %H:%M:%S")
-                    
-                    # 更新字段
-                    for key, value in kwargs.items():
-                        if key in ["title", "start_time", "description", "location"]:
-                            schedule[key] = value
-                    
-                    self.schedules[i] = schedule
-                    success = self.save_schedules()
-                    
-                    if success and "start_time" in kwargs:
-                        # 如果更新了开始时间，重新设置提醒
-                        # 使用标题和旧的开始时间组合作为键
-                        timer_key = f"{title}_{start_time}"
-                        if timer_key in self.reminder_timers and self.reminder_timers[timer_key].isActive():
-                            self.reminder_timers[timer_key].stop()
-                        self.set_reminder(schedule)
-                    
-                    return success
-            
+        schedule_id = self.store.find(title, start_time)
+        if schedule_id is None:
             print(f"未找到标题为'{title}'且开始时间为'{start_time}'的日程")
             return False
+        return self.update_schedule_by_id(schedule_id, **kwargs)
+    
+    def update_schedule_by_id(self, schedule_id, **kwargs):
+        """
+        按id更新日程信息
+        :param schedule_id: 日程id
+        :param kwargs: 要更新的字段，可以包括新的title, start_time, description, location, rrule, reminders
+        :return: 是否更新成功
+        """
+        if kwargs.get("rrule") and not self.validate_rrule(kwargs["rrule"]):
+            return False
+        if kwargs.get("reminders") is not None:
+            kwargs["reminders"] = self.validate_reminders(kwargs["reminders"])
+            if kwargs["reminders"] is None: return False
+        try:
+            if schedule_id not in self.store:
+                print(f"未找到id为{schedule_id}的日程")
+                return False
+            
+            # 如果更新了开始时间，验证格式
+            if "start_time" in kwargs:
+                datetime.datetime.strptime(kwargs["start_time"], "%Y-%m-%d %H:%M:%S")
+            
+            old_values = dict(self.store.get(schedule_id))
+            schedule = self.store.update(schedule_id, **kwargs)
+            try:
+                self.database.update(schedule)
+            except Exception:
+                self.store.update(schedule_id, **old_values)
+                raise
+            
+            if "start_time" in kwargs or "rrule" in kwargs or "reminders" in kwargs:
+                # 如果更新了开始时间、重复规则或提醒时间，重新设置提醒
+                self.reminder_scheduler.remove_group(schedule_id)
+                self.set_reminder(schedule)
+            
+            self.notify("updated", schedule_id)
+            return True
         except ValueError:
             print("时间格式错误，请使用YYYY-MM-DD HH:MM:SS格式")
             return False
@@ -143,31 +211,66 @@ class ScheduleManager:
         :param start_time: 日程开始时间
         :return: 是否删除成功
         """
-        try:
-            for i, schedule in enumerate(self.schedules):
-                if schedule["title"] == title and schedule["start_time"] == start_time:
-                    # 停止提醒定时器
-                    timer_key = f"{title}_{start_time}"
-                    if timer_key in self.reminder_timers and self.reminder_timers[timer_key].isActive():
-                        self.reminder_timers[timer_key].stop()
-                        del self.reminder_timers[timer_key]
-                    
-                    # 删除日程
-                    self.schedules.pop(i)
-                    return self.save_schedules()
-            
+        schedule_id = self.store.find(title, start_time)
+        if schedule_id is None:
             print(f"未找到标题为'{title}'且开始时间为'{start_time}'的日程")
             return False
+        return self.delete_schedule_by_id(schedule_id)
+    
+    def delete_schedule_by_id(self, schedule_id):
+        """
+        按id删除日程
+        :param schedule_id: 日程id
+        :return: 是否删除成功
+        """
+        try:
+            if schedule_id not in self.store:
+                print(f"未找到id为{schedule_id}的日程")
+                return False
+            self.database.delete(schedule_id)
+            self.store.delete(schedule_id)
+            # 取消提醒（重复日程的各次发生都在同一个group中）
+            self.reminder_scheduler.remove_group(schedule_id)
+            self.notify("deleted", schedule_id)
+            return True
         except Exception as e:
             print(f"删除日程失败: {e}")
             return False
     
+    @staticmethod
+    def validate_rrule(rrule):
+        try:
+            Recurrence.parse(rrule)
+            return True
+        except ValueError as e:
+            print(f"重复规则错误: {e}")
+            return False
+    
+    @staticmethod
+    def validate_reminders(reminders):
+        """
+        返回整理后的提醒时间，格式错误时返回None
+        """
+        try:
+            return normalize_reminders(reminders)
+        except (ValueError, TypeError) as e:
+            print(f"提醒时间错误: {e}")
+            return None
+    
     def get_all_schedules(self):
         """
         获取所有日程
-        :return: 日程列表
+        :return: 按开始时间排列的日程列表（重复日程只出现一次）
         """
-        return self.schedules
+        return self.store.get_all()
+    
+    def get_schedule(self, schedule_id):
+        """
+        根据id获取日程
+        :param schedule_id: 日程id
+        :return: 日程信息或None
+        """
+        return self.store.get(schedule_id)
     
     def get_schedule_by_title_and_time(self, title, start_time):
         """
@@ -176,141 +279,220 @@ class ScheduleManager:
         :param start_time: 开始时间
         :return: 日程信息或None
         """
-        for schedule in self.schedules:
-            if schedule["title"] == title and schedule["start_time"] == start_time:
-                return schedule
-        return None
+        schedule_id = self.store.find(title, start_time)
+        return None if schedule_id is None else self.store.get(schedule_id)
+    
+    def get_upcoming_schedules(self, n=10):
+        """
+        获取即将开始的n个日程（重复日程按各次发生计）
+        :param n: 数量
+        :return: 按开始时间排列的日程列表
+        """
+        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        return self.store.get_upcoming(n, now)
+    
+    def get_schedules_between(self, start_time, end_time):
+        """
+        获取开始时间在指定范围内的日程（重复日程按各次发生计）
+        :param start_time: 起始时间，格式为"YYYY-MM-DD HH:MM:SS"
+        :param end_time: 结束时间，格式为"YYYY-MM-DD HH:MM:SS"
+        :return: 按开始时间排列的日程列表
+        """
+        return self.store.get_between(start_time, end_time)
+    
+    def get_reminder_window_start(self):
+        """
+        提醒仍可能触发（最晚的提醒在开始时，允许补发late_tolerance秒）的发生，开始时间不早于这个时间
+        """
+        now = datetime.datetime.now()
+        window_start = now - datetime.timedelta(seconds=self.reminder_scheduler.late_tolerance)
+        return window_start.strftime("%Y-%m-%d %H:%M:%S")
+    
+    def extend_reminders(self):
+        """
+        为开始时间在 (上次补充到的时间, 现在+reminder_horizon+最长提前量] 之间的日程
+        （包括重复日程在这段时间内的各次发生）设置提醒，
+        这样触发时间在 现在+reminder_horizon 之前的提醒都已经排期
+        """
+        now = datetime.datetime.now()
+        start = self.armed_until or self.get_reminder_window_start()
+        lead = datetime.timedelta(minutes=MAX_REMINDER_MINUTES)
+        self.armed_until = (now + self.reminder_horizon + lead).strftime("%Y-%m-%d %H:%M:%S")
+        for occurrence in self.store.iter_between(start, self.armed_until):
+            self.arm_reminder(occurrence)
+        self.horizon_timer.start(int(self.reminder_horizon.total_seconds() * 1000 / 2))
     
     def set_reminder(self, schedule):
         """
-        设置日程提醒
+        设置日程提醒：只为提醒范围内的发生设置，超出范围的由extend_reminders在之后设置
         :param schedule: 日程信息
         """
+        for occurrence in self.store.iter_occurrences(schedule, self.get_reminder_window_start(), self.armed_until):
+            self.arm_reminder(occurrence)
+    
+    def arm_reminder(self, occurrence):
+        """
+        为日程的一次发生设置提醒：每个提醒时间的触发时间只在这里计算一次，之后由调度器按时间顺序触发
+        :param occurrence: 日程（重复日程为展开出的一次发生）
+        """
         try:
-            start_time = datetime.datetime.strptime(schedule["start_time"], "%Y-%m-%d %H:%M:%S")
-            reminder_time = start_time - datetime.timedelta(minutes=15)  # 提前15分钟提醒
-            
-            # 如果提醒时间已经过去，则不设置提醒
-            if reminder_time < datetime.datetime.now():
-                return
-            
-            # 计算当前时间到提醒时间的毫秒数
-            now = datetime.datetime.now()
-            delta_ms = int((reminder_time - now).total_seconds() * 1000)
-            
-            # 创建定时器
-            timer = QTimer()
-            timer.setSingleShot(True)  # 只触发一次
-            timer.timeout.connect(lambda: self.show_reminder(schedule))
-            timer.start(delta_ms)
-            
-            # 保存定时器引用，使用标题和开始时间的组合作为键
-            timer_key = f"{schedule['title']}_{schedule['start_time']}"
-            self.reminder_timers[timer_key] = timer
+            start_ts = datetime.datetime.strptime(occurrence["start_time"], "%Y-%m-%d %H:%M:%S").timestamp()
+            min_ts = datetime.datetime.now().timestamp() - self.reminder_scheduler.late_tolerance
+            for minutes in self.get_reminders(occurrence):
+                # 提醒时间已经过去太久的不再设置（调度器会丢弃超过补发时限的提醒）
+                reminder_ts = start_ts - minutes * 60
+                if reminder_ts < min_ts: continue
+                
+                # 以(日程id, 本次开始时间, 提前分钟数)区分各个提醒，同一日程的提醒归入同一个group
+                key = (occurrence["id"], occurrence["start_time"], minutes)
+                self.reminder_scheduler.add(key, reminder_ts, occurrence, group=occurrence["id"])
         except Exception as e:
             print(f"设置提醒失败: {e}")
     
+    def snooze_reminder(self, occurrence, minutes=None):
+        """
+        稍后再次提醒：在现在之后minutes分钟（默认snooze_minutes）再提醒一次
+        :param occurrence: 提醒的日程（重复日程为展开出的一次发生）
+        """
+        minutes = self.snooze_minutes if minutes is None else minutes
+        if occurrence["id"] not in self.store:
+            return
+        key = (occurrence["id"], occurrence["start_time"], "snooze")
+        reminder_ts = datetime.datetime.now().timestamp() + minutes * 60
+        self.reminder_scheduler.add(key, reminder_ts, occurrence, group=occurrence["id"])
+    
+    @staticmethod
+    def format_time_left(start_time, now=None):
+        """
+        距离开始还有多久，例如"1天2小时后开始"、"10分钟后开始"、"已经开始"
+        """
+        now = now or datetime.datetime.now()
+        seconds = (datetime.datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S") - now).total_seconds()
+        minutes = int(seconds + 59) // 60
+        if minutes <= 0:
+            return "已经开始"
+        days, minutes = divmod(minutes, 24 * 60)
+        hours, minutes = divmod(minutes, 60)
+        text = (f"{days}天" if days else "") + (f"{hours}小时" if hours else "") + (f"{minutes}分钟" if minutes else "")
+        return text + "后开始"
+    
     def show_reminder(self, schedule):
         """
-        显示提醒
-        :param schedule: 日程信息
+        显示提醒；提醒后日程仍然保留，需要时由用户在日程管理中删除
+        :param schedule: 日程信息（重复日程为展开出的一次发生）
         """
-        print(f"[DEBUG] 尝试显示提醒，桌宠对象存在: {self.desktop_pet is not None}")
         if self.desktop_pet:
             title = schedule["title"]
             start_time = schedule["start_time"]
-            location = schedule["location"]
-            description = schedule["description"]
+            location = schedule.get("location", "")
+            description = schedule.get("description", "")
             
-            # 构建提醒消息
-            message = f"提醒：{title}将在15分钟后开始\n时间：{start_time}"
+            # 构建提醒消息，剩余时间在显示时计算（补发或稍后提醒时也是准确的）
+            message = f"提醒：{title}{self.format_time_left(start_time)}\n时间：{start_time}"
             if location:
                 message += f"\n地点：{location}"
             if description:
                 message += f"\n描述：{description}"
             
-            # 创建一个回调函数，用于在用户关闭提醒后删除该日程
-            def on_reminder_closed():
-                print(f"[DEBUG] 用户关闭了日程提醒，准备删除日程: {title}_{start_time}")
-                self.delete_schedule(title, start_time)
-                print(f"[DEBUG] 日程已删除: {title}_{start_time}")
-            
-            # 显示提醒，传递is_schedule_reminder=True参数使气泡持续显示并有关闭按钮，同时传递回调函数
-            print(f"[DEBUG] 发送气泡提醒: {message}")
-            self.desktop_pet.show_bubble(message, is_schedule_reminder=True, on_close_callback=on_reminder_closed)
-            
-            # 确保这个日程被记录为已提醒，防止重复提醒
-            timer_key = f"{title}_{start_time}"
-            if timer_key not in self.reminder_timers:
-                self.reminder_timers[timer_key] = "reminded"
+            # 显示提醒，传递is_schedule_reminder=True参数使气泡持续显示并有关闭按钮；
+            # 点击"稍后提醒"时在snooze_minutes分钟后再提醒一次
+            # 提醒触发后即从调度器中移除，不会重复提醒
+            self.desktop_pet.show_bubble(message, is_schedule_reminder=True,
+                                         on_snooze_callback=lambda: self.snooze_reminder(schedule))
         else:
-            print(f"[DEBUG] 无法显示提醒，桌宠对象不存在")
+            print("无法显示日程提醒，桌宠对象不存在")
     
     def check_schedules(self):
         """
-        检查是否有需要提醒的日程
+        立即触发所有已经到期的提醒（平时由调度器的定时器在最早的提醒时间自动调用）
         """
-        now = datetime.datetime.now()
-        print(f"[DEBUG] 检查日程提醒，当前时间: {now}")
-        
-        for schedule in self.schedules:
-            try:
-                title = schedule["title"]
-                start_time = schedule["start_time"]
-                start_time_dt = datetime.datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S")
-                reminder_time = start_time_dt - datetime.timedelta(minutes=15)  # 提前15分钟提醒
-                
-                # 如果当前时间接近提醒时间（误差在1分钟内），且没有设置过提醒，则显示提醒
-                time_diff = (reminder_time - now).total_seconds()
-                timer_key = f"{title}_{start_time}"
-                print(f"[DEBUG] 日程 '{title}' 的提醒时间差: {time_diff}秒, 是否在提醒列表中: {timer_key in self.reminder_timers}")
-                
-                # 修改条件：如果时间差在-300到300秒之间（允许前后5分钟误差），且没有设置过提醒，则显示提醒
-                if -300 <= time_diff <= 300 and timer_key not in self.reminder_timers:
-                    print(f"[DEBUG] 触发日程提醒: {title}")
-                    self.show_reminder(schedule)
-            except Exception as e:
-                print(f"检查日程失败: {e}")
-
+        self.reminder_scheduler.check()
     
-    def import_schedules_from_file(self, file_path):
+    def import_schedules_from_file(self, file_path, batch_size=500):
         """
-        从文件导入日程
-        :param file_path: 文件路径，支持JSON格式
-        :return: 是否导入成功
+        从文件导入日程：边读取边写入，每batch_size个日程提交一次事务；
+        与已有日程标题和开始时间都相同的视为重复，跳过；缺少字段或时间格式错误的条目也被跳过。
+        文件中途损坏（例如JSON不完整）时，已经提交的批次保留，尚未提交的一批被撤销
+        :param file_path: 文件路径，支持JSON格式（日程列表）与iCalendar格式（.ics）
+        :param batch_size: 每个事务写入的日程数量
+        :return: 是否完整导入
         """
+        created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        n_imported, n_duplicate, n_invalid = 0, 0, 0
+        batch = []
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                imported_schedules = json.load(f)
-            
-            # 验证导入的数据格式
-            if not isinstance(imported_schedules, list):
-                print("导入失败：数据格式错误，应为日程列表")
-                return False
-            
-            for schedule in imported_schedules:
-                if not all(key in schedule for key in ["title", "start_time"]):
-                    print("导入失败：日程数据缺少必要字段")
-                    return False
-                
-                # 验证时间格式
-                try:
-                    datetime.datetime.strptime(schedule["start_time"], "%Y-%m-%d %H:%M:%S")
-                except ValueError:
-                    print("导入失败：时间格式错误，请使用YYYY-MM-DD HH:MM:SS格式")
-                    return False
-            
-            # 合并日程，不再分配ID
-            for schedule in imported_schedules:
-                # 添加创建时间
-                schedule["created_at"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                self.schedules.append(schedule)
-                self.set_reminder(schedule)
-            
-            return self.save_schedules()
+            for schedule in iter_schedules_from_file(file_path):
+                if schedule is None:
+                    n_invalid += 1
+                    continue
+                if self.store.find(schedule["title"], schedule["start_time"]) is not None:
+                    n_duplicate += 1
+                    continue
+                schedule["created_at"] = created_at
+                self.store.add(schedule)
+                batch.append(schedule)
+                if len(batch) >= batch_size:
+                    self.commit_imported_schedules(batch)
+                    n_imported += len(batch)
+                    batch = []
+            self.commit_imported_schedules(batch)
+            n_imported += len(batch)
+            batch = []
+            return True
         except Exception as e:
-            print(f"导入日程失败: {e}")
+            # 尚未提交的日程不在数据库中，从索引中撤销（commit失败时已经撤销过，delete对不存在的id无影响）
+            for schedule in batch:
+                self.store.delete(schedule["id"])
+            print(f"导入日程失败: {e}（之前已经提交的{n_imported}个日程已保留）")
             return False
+        finally:
+            if n_imported > 0:
+                self.notify("reset")
+            print(f"导入日程：新增{n_imported}个，重复{n_duplicate}个，无效{n_invalid}个")
+    
+    def add_schedules(self, schedules):
+        """
+        在一个事务中添加多个日程（例如从一段文字中解析出的日程），与已有日程重复的跳过
+        :param schedules: 日程列表，格式同add_schedule的参数，需要已经校验过（见schedule_import.normalize_schedule）
+        :return: 实际添加的日程数
+        """
+        created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        added = []
+        try:
+            for schedule in schedules:
+                if self.store.find(schedule["title"], schedule["start_time"]) is not None:
+                    continue
+                schedule["created_at"] = created_at
+                self.store.add(schedule)
+                added.append(schedule)
+        except Exception as e:
+            for schedule in added:
+                self.store.delete(schedule["id"])
+            print(f"添加日程失败: {e}")
+            return 0
+        try:
+            self.commit_imported_schedules(added)
+        except Exception as e:
+            print(f"添加日程失败: {e}")
+            return 0
+        for schedule in added:
+            self.notify("added", schedule["id"])
+        return len(added)
+    
+    def commit_imported_schedules(self, schedules):
+        """
+        在一个事务中写入一批导入的日程，失败时从索引中撤销这一批；
+        set_reminder只为近期的日程设置提醒
+        """
+        if len(schedules) == 0: return
+        try:
+            self.database.insert_many(schedules)
+        except Exception:
+            for schedule in schedules:
+                self.store.delete(schedule["id"])
+            raise
+        for schedule in schedules:
+            self.set_reminder(schedule)
     
     def export_schedules_to_file(self, file_path):
         """
@@ -320,7 +502,7 @@ class ScheduleManager:
         """
         try:
             with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(self.schedules, f, ensure_ascii=False, indent=4)
+                json.dump(self.store.get_all(), f, ensure_ascii=False, indent=4)
             return True
         except Exception as e:
             print(f"导出日程失败: {e}")
\ No newline at end of file
@@ -0,0 +1,110 @@
+"""
+    用大模型把自然语言（例如"每周三下午三点组会"，或者一封粘贴进来的邮件）解析为日程
+
+    一段文本只发送一次请求，模型一次性返回其中所有日程的JSON数组，粘贴几十个日程也只需要一次往返。
+    系统prompt是固定不变的常量（当前时间放在用户消息里），每次请求的前缀完全相同，可以命中服务端的prompt缓存；
+    输出使用单字母键名，减少需要生成的token数。
+"""
+import re
+import json
+import datetime
+from chat_model.schedule_import import normalize_schedule, normalize_reminders
+
+SCHEDULE_PARSE_PROMPT = (
+    "从用户文本中提取所有日程，只输出JSON数组，不要解释。每个日程一个对象，键：\n"
+    't:标题; s:开始时间"YYYY-MM-DD HH:MM"; l:地点; d:备注; '
+    'r:重复规则（RFC 5545 RRULE子集：FREQ=DAILY|WEEKLY|MONTHLY|YEARLY，可选INTERVAL、BYDAY=MO,WE或2TU/-1FR、UNTIL=YYYYMMDD、COUNT），不重复则省略; '
+    "a:提前多少分钟提醒的整数数组（如提前1天和10分钟为[1440,10]），文本没有提到提醒则省略\n"
+    "相对时间按用户给出的当前时间换算；没有给出具体时刻时上午取09:00、下午取15:00、晚上取20:00；没有日程时输出[]。\n"
+    '例：每周三下午三点组会 -> [{"t":"组会","s":"<下一个周三> 15:00","r":"FREQ=WEEKLY;BYDAY=WE"}]'
+)
+
+KEY_ALIASES = {
+    "title": ("t", "title"),
+    "start_time": ("s", "start_time", "start"),
+    "location": ("l", "location"),
+    "description": ("d", "description"),
+    "rrule": ("r", "rrule"),
+}
+REMINDER_ALIASES = ("a", "reminders")
+
+def build_messages(text, now=None):
+    now = now or datetime.datetime.now()
+    weekday = "一二三四五六日"[now.weekday()]
+    return [
+        {"role": "system", "content": SCHEDULE_PARSE_PROMPT},
+        {"role": "user", "content": f"当前时间：{now.strftime('%Y-%m-%d %H:%M')} 星期{weekday}\n{text}"},
+    ]
+
+
+def extract_json_array(reply):
+    """
+    从模型回复中取出JSON数组（模型有时会加上```json代码块或多余的说明）
+    """
+    start, end = reply.find("["), reply.rfind("]")
+    if start < 0 or end < start:
+        raise ValueError(f"模型没有返回日程列表：{reply[:200]}")
+    items = json.loads(reply[start:end + 1])
+    if not isinstance(items, list):
+        raise ValueError("模型返回的不是日程列表")
+    return items
+
+
+def parse_entries(reply):
+    """
+    把模型的回复转换为日程列表，逐条校验；返回 (有效的日程, 无效条目数)
+    """
+    schedules, n_invalid = [], 0
+    for item in extract_json_array(reply):
+        if not isinstance(item, dict):
+            n_invalid += 1
+            continue
+        schedule = {}
+        for field, aliases in KEY_ALIASES.items():
+            value = next((item[key] for key in aliases if item.get(key)), "")
+            schedule[field] = str(value).strip()
+        # 允许省略秒
+        if re.fullmatch(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}', schedule["start_time"]):
+            schedule["start_time"] += ":00"
+        if not schedule["rrule"]:
+            del schedule["rrule"]
+        # 提醒时间是列表，不转换为字符串；格式不对时只丢弃提醒时间（使用默认值），日程本身保留
+        reminders = next((item[key] for key in REMINDER_ALIASES if item.get(key) is not None), None)
+        if reminders is not None:
+            try:
+                schedule["reminders"] = normalize_reminders(reminders)
+            except (ValueError, TypeError):
+                pass
+        schedule = normalize_schedule(schedule)
+        if schedule is None:
+            n_invalid += 1
+        else:
+            schedules.append(schedule)
+    return schedules, n_invalid
+
+
+def request_schedules(text, config, now=None):
+    """
+    发送一次请求，把text中的所有日程解析出来；返回 (有效的日程, 无效条目数)
+    :param config: 与OpenAI_request相同的配置（使用其中[OpenAI]一节的模型、地址、密钥与代理）
+    """
+    from request_llm.circuit_breaker import post_with_breaker
+    openai_config = config["OpenAI"]
+    proxy = openai_config.get("PROXY", "")
+    kwargs = {"proxies": {"http": proxy, "https": proxy}} if proxy and proxy.strip() else {}
+    payload = {
+        "model": openai_config["LLM_MODEL"],
+        "messages": build_messages(text, now),
+        "temperature": 0,
+        "n": 1,
+        "stream": False,
+    }
+    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {openai_config['OPENAI_API_KEY']}"}
+    response = post_with_breaker(openai_config["OPENAIAPI_URL"], headers=headers, json=payload,
+                                 timeout=int(openai_config["TIMEOUT_SECONDS"]), **kwargs)
+    if response.status_code != 200:
+        raise RuntimeError("OpenAI拒绝了请求：" + response.text)
+    choice = response.json()['choices'][0]
+    if choice.get('finish_reason') == 'length':
+        raise ConnectionAbortedError("输出不完整（token不足），请减少一次粘贴的日程数量。")
+    return parse_entries(choice['message']['content'])
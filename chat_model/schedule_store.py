@@ -0,0 +1,185 @@
+import bisect
+import heapq
+import itertools
+from chat_model.recurrence import Recurrence
+from chat_model.schedule_import import parse_time, TIME_FORMAT
+
+class ScheduleStore:
+    """
+    日程的内存索引，取代对日程列表的线性查找：
+        schedules   id -> 日程，id在日程的生命周期内保持不变（写入日程的"id"字段）
+        key_index   (标题, 开始时间) -> id 的哈希索引
+        time_index  按 (开始时间, id) 排序的列表，用于按时间顺序遍历与范围查询
+        recurring   重复日程的 id -> 解析后的重复规则（chat_model.recurrence.Recurrence）
+    开始时间统一为"YYYY-MM-DD HH:MM:SS"格式，字符串的字典序即时间先后，可以直接二分查找。
+    重复日程只存一条（开始时间为第一次发生的时间），范围查询时才按需展开为各次发生，
+    展开出的每次发生是日程的副本，id与原日程相同，start_time为该次发生的时间。
+    """
+    fields = ["title", "start_time", "description", "location", "rrule", "reminders"]
+
+    def __init__(self, schedules=()):
+        self.schedules = {}
+        self.key_index = {}
+        self.time_index = []
+        self.recurring = {}
+        self.next_id = 1
+        for schedule in schedules:
+            if isinstance(schedule.get("id"), int):
+                self.next_id = max(self.next_id, schedule["id"] + 1)
+        for schedule in schedules:
+            self.add(schedule)
+
+    def __len__(self):
+        return len(self.schedules)
+
+    def __contains__(self, schedule_id):
+        return schedule_id in self.schedules
+
+    @staticmethod
+    def get_key(schedule):
+        return (schedule["title"], schedule["start_time"])
+
+    def add(self, schedule):
+        """
+        加入一个日程，没有id（或id冲突）时分配新的id，返回id
+        """
+        schedule_id = schedule.get("id")
+        if not isinstance(schedule_id, int) or schedule_id in self.schedules:
+            schedule_id = self.next_id
+            schedule["id"] = schedule_id
+        self.index(schedule)
+        self.next_id = max(self.next_id, schedule_id + 1)
+        self.schedules[schedule_id] = schedule
+        return schedule_id
+
+    def index(self, schedule):
+        # 先解析重复规则，规则有误时抛出ValueError，索引保持不变
+        recurrence = Recurrence.parse(schedule["rrule"]) if schedule.get("rrule") else None
+        schedule_id = schedule["id"]
+        self.key_index.setdefault(self.get_key(schedule), schedule_id)
+        bisect.insort(self.time_index, (schedule["start_time"], schedule_id))
+        if recurrence is not None:
+            self.recurring[schedule_id] = recurrence
+
+    def get(self, schedule_id):
+        return self.schedules.get(schedule_id)
+
+    def find(self, title, start_time):
+        """
+        按标题与开始时间查找日程的id，没有时返回None
+        """
+        return self.key_index.get((title, start_time))
+
+    def unindex(self, schedule):
+        schedule_id = schedule["id"]
+        key = self.get_key(schedule)
+        if self.key_index.get(key) == schedule_id:
+            del self.key_index[key]
+            # 同一标题与时间的重复日程，把索引交给剩下的那个
+            position = bisect.bisect_left(self.time_index, (schedule["start_time"], -1))
+            while position < len(self.time_index) and self.time_index[position][0] == schedule["start_time"]:
+                other_id = self.time_index[position][1]
+                if other_id != schedule_id and self.schedules[other_id]["title"] == schedule["title"]:
+                    self.key_index[key] = other_id
+                    break
+                position += 1
+        position = bisect.bisect_left(self.time_index, (schedule["start_time"], schedule_id))
+        del self.time_index[position]
+        self.recurring.pop(schedule_id, None)
+
+    def update(self, schedule_id, **kwargs):
+        """
+        更新日程的字段，返回更新后的日程；id不存在时返回None
+        """
+        schedule = self.schedules.get(schedule_id)
+        if schedule is None: return None
+        if kwargs.get("rrule"): Recurrence.parse(kwargs["rrule"])
+        self.unindex(schedule)
+        for key, value in kwargs.items():
+            if key in self.fields:
+                schedule[key] = value
+        self.index(schedule)
+        return schedule
+
+    def delete(self, schedule_id):
+        """
+        删除日程，返回被删除的日程；id不存在时返回None
+        """
+        schedule = self.schedules.get(schedule_id)
+        if schedule is None: return None
+        self.unindex(schedule)
+        del self.schedules[schedule_id]
+        return schedule
+
+    def get_all(self):
+        """
+        按开始时间排列的所有日程（重复日程只出现一次）
+        """
+        return [self.schedules[schedule_id] for _, schedule_id in self.time_index]
+
+    def iter_occurrences(self, schedule, start=None, end=None):
+        """
+        按时间顺序产出日程开始时间在[start, end]之间的各次发生；不给end时对重复日程是无限的生成器
+        """
+        recurrence = self.recurring.get(schedule["id"])
+        if recurrence is None:
+            if (start is None or schedule["start_time"] >= start) and (end is None or schedule["start_time"] <= end):
+                yield schedule
+            return
+        window_start = parse_time(start) if start is not None else None
+        for dt in recurrence.iter_from(parse_time(schedule["start_time"]), window_start):
+            start_time = dt.strftime(TIME_FORMAT)
+            if end is not None and start_time > end: return
+            occurrence = dict(schedule)
+            occurrence["start_time"] = start_time
+            yield occurrence
+
+    def iter_between(self, start, end=None):
+        """
+        按时间顺序产出开始时间在[start, end]之间的所有日程，重复日程在范围内惰性展开
+        """
+        left = bisect.bisect_left(self.time_index, (start, -1))
+        right = len(self.time_index) if end is None else bisect.bisect_right(self.time_index, (end, float('inf')))
+        single = (self.schedules[self.time_index[i][1]] for i in range(left, right)
+                  if self.time_index[i][1] not in self.recurring)
+        streams = [self.iter_occurrences(self.schedules[schedule_id], start, end) for schedule_id in self.recurring]
+        return heapq.merge(single, *streams, key=lambda schedule: schedule["start_time"])
+
+    def get_upcoming(self, n, now):
+        """
+        开始时间不早于now的最近n个日程（重复日程按各次发生计）
+        """
+        return list(itertools.islice(self.iter_between(now), n))
+
+    def get_between(self, start, end):
+        """
+        开始时间在[start, end]之间的日程（重复日程按各次发生计）
+        """
+        return list(self.iter_between(start, end))
+
+    def query(self, keyword="", sort_field="start_time", descending=False):
+        """
+        供日程表格使用的查询：返回按sort_field排序、包含keyword（标题、地点或描述中）的日程id列表。
+        按开始时间排序时直接使用time_index，不需要重新排序。
+        """
+        if sort_field == "start_time":
+            ids = [schedule_id for _, schedule_id in self.time_index]
+        else:
+            ids = sorted(self.schedules, key=lambda schedule_id: self.get_sort_key(self.schedules[schedule_id], sort_field))
+        if keyword:
+            keyword = keyword.casefold()
+            ids = [schedule_id for schedule_id in ids if self.match(self.schedules[schedule_id], keyword)]
+        if descending:
+            ids.reverse()
+        return ids
+
+    @staticmethod
+    def get_sort_key(schedule, sort_field):
+        return (schedule.get(sort_field) or "", schedule["start_time"], schedule["id"])
+
+    @staticmethod
+    def match(schedule, keyword):
+        """
+        keyword需要已经casefold
+        """
+        return any(keyword in (schedule.get(field) or "").casefold() for field in ("title", "location", "description"))
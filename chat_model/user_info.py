@@ -1,14 +1,17 @@
 import os
 import json
 import datetime
+import threading
 from pathlib import Path
 
 class UserInfo:
     """
-    用户信息管理类，负责存储和读取用户信息
+    用户信息管理类，负责存储和读取用户信息。
+    会话摘要在后台线程中保存，修改与写入user_info.json都在self.lock中进行
     """
     def __init__(self, config):
         self.config = config
+        self.lock = threading.RLock()
         self.user_data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'user_data')
         self.ensure_user_data_dir()
         self.user_info_file = os.path.join(self.user_data_dir, 'user_info.json')
@@ -65,12 +68,15 @@ class UserInfo:
         """
         保存用户信息
         """
-        if user_info is None:
-            user_info = self.user_info
-        
         try:
-            with open(self.user_info_file, 'w', encoding='utf-8') as f:
-                json.dump(user_info, f, ensure_ascii=False, indent=4)
+            with self.lock:
+                if user_info is None:
+                    user_info = self.user_info
+                # 先写入临时文件再替换，写入中途退出也不会留下不完整的user_info.json
+                tmp_file = self.user_info_file + ".tmp"
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    json.dump(user_info, f, ensure_ascii=False, indent=4)
+                os.replace(tmp_file, self.user_info_file)
             return True
         except Exception as e:
             print(f"保存用户信息失败: {e}")
@@ -80,8 +86,9 @@ class UserInfo:
         """
         更新用户信息
         """
-        self.user_info[key] = value
-        return self.save_user_info()
+        with self.lock:
+            self.user_info[key] = value
+            return self.save_user_info()
     
     def get_user_info(self, key=None):
         """
@@ -104,34 +111,48 @@ class UserInfo:
             with open(chat_file, 'w', encoding='utf-8') as f:
                 json.dump(history, f, ensure_ascii=False, indent=4)
             
-            # 更新用户信息中的聊天会话列表
-            chat_sessions = self.user_info.get("chat_sessions", [])
-            
-            # 检查是否已存在该会话
-            session_exists = False
-            for session in chat_sessions:
-                if session.get("id") == chat_id:
-                    session["last_updated"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    session_exists = True
-                    break
-            
-            # 如果不存在则添加新会话
-            if not session_exists:
-                chat_sessions.append({
-                    "id": chat_id,
-                    "created_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "last_updated": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "title": f"聊天 {len(chat_sessions) + 1}"
-                })
-            
-            self.user_info["chat_sessions"] = chat_sessions
-            self.save_user_info()
+            with self.lock:
+                # 更新用户信息中的聊天会话列表
+                chat_sessions = self.user_info.get("chat_sessions", [])
+                
+                # 检查是否已存在该会话
+                session_exists = False
+                for session in chat_sessions:
+                    if session.get("id") == chat_id:
+                        session["last_updated"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                        session_exists = True
+                        break
+                
+                # 如果不存在则添加新会话
+                if not session_exists:
+                    chat_sessions.append({
+                        "id": chat_id,
+                        "created_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                        "last_updated": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                        "title": f"聊天 {len(chat_sessions) + 1}"
+                    })
+                
+                self.user_info["chat_sessions"] = chat_sessions
+                self.save_user_info()
             
             return True
         except Exception as e:
             print(f"保存聊天历史失败: {e}")
             return False
     
+    def save_chat_summary(self, chat_id, summary, summarized_turns):
+        """
+        保存会话的滚动摘要（较早轮次的压缩），与会话信息一起存放；在后台的摘要线程中调用
+        """
+        with self.lock:
+            for session in self.user_info.get("chat_sessions", []):
+                if session.get("id") == chat_id:
+                    session["summary"] = summary
+                    session["summarized_turns"] = summarized_turns
+                    session["last_updated"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    return self.save_user_info()
+        return False
+
     def load_chat_history(self, chat_id):
         """
         加载聊天历史
@@ -169,8 +190,9 @@ class UserInfo:
                 return False
         
         # 更新用户信息
-        chat_sessions = self.user_info.get("chat_sessions", [])
-        self.user_info["chat_sessions"] = [session for session in chat_sessions if session.get("id") != chat_id]
-        self.save_user_info()
+        with self.lock:
+            chat_sessions = self.user_info.get("chat_sessions", [])
+            self.user_info["chat_sessions"] = [session for session in chat_sessions if session.get("id") != chat_id]
+            self.save_user_info()
         
         return True
\ No newline at end of file
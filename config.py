@@ -37,6 +37,12 @@ LAYOUT = "LEFT-RIGHT"  # "LEFT-RIGHT"（左右布局） # "TOP-DOWN"（上下布
 # 发送请求到OpenAI后，等待多久判定为超时
 TIMEOUT_SECONDS = 30
 
+# 流式输出时界面刷新的最小间隔（秒），同一间隔内的多次刷新会被合并，设为0则每个token都刷新
+UI_REFRESH_INTERVAL = 0.05
+
+# 是否同时启动学术优化网页版（gradio），关闭时桌宠启动不会导入gradio等较慢的模块
+ENABLE_WEB_UI = False
+
 # 网页的端口, -1代表随机端口
 WEB_PORT = -1
 
@@ -47,9 +53,45 @@ MAX_RETRY = 2
 LLM_MODEL = "Qwen/QwQ-32B" # 可选 ↓↓↓
 AVAIL_LLM_MODELS = ["gpt-3.5-turbo", "api2d-gpt-3.5-turbo", "gpt-4", "api2d-gpt-4", "chatglm"]
 
+# 同时询问多个模型（如 "gpt-3.5-turbo&api2d-gpt-3.5-turbo"）时的调度方式，可在llm_kwargs['dispatch_mode']中单独指定：
+#   "all"   等待所有模型回答，合并显示（默认）
+#   "race"  同时发出，采用最先完整返回的回答，其余请求立即取消
+#   "hedge" 先只询问第一个模型，若其首个token的等待时间超过历史首token延迟的HEDGE_PERCENTILE分位数，
+#           才向下一个模型（只写一个模型时向同一模型换一个api-key）补发一份相同的请求，采用最先完成的回答
+LLM_DISPATCH_MODE = "all"
+HEDGE_PERCENTILE = 0.95
+# 历史样本不足时，hedge模式补发请求前等待的秒数
+HEDGE_DEFAULT_DELAY = 3.0
+
+# 熔断器：同一端点连续失败（超时、网络错误、HTTP 5xx）CIRCUIT_BREAKER_FAILURES次后熔断，
+# 熔断期间的请求立即失败并切换到后备模型，CIRCUIT_BREAKER_RECOVERY秒后放行一个探测请求
+CIRCUIT_BREAKER_FAILURES = 3
+CIRCUIT_BREAKER_RECOVERY = 30
+
+# 各模型的后备链，模型所在端点熔断或请求失败时依次尝试（跳过没有可用api-key的模型）
+# 桌宠对话的后备链可以在pet配置的[OpenAI] LLM_FALLBACK中单独设置，未设置时也使用这里登记的
+LLM_FALLBACK = {
+    "gpt-4": ["api2d-gpt-4", "gpt-3.5-turbo", "chatglm"],
+    "api2d-gpt-4": ["gpt-4", "api2d-gpt-3.5-turbo", "chatglm"],
+    "gpt-3.5-turbo": ["api2d-gpt-3.5-turbo", "chatglm"],
+    "api2d-gpt-3.5-turbo": ["gpt-3.5-turbo", "chatglm"],
+}
+
 # 本地LLM模型如ChatGLM的执行方式 CPU/GPU
 LOCAL_MODEL_DEVICE = "cpu" # 可选 "cuda"
 
+# 本地LLM模型的权重精度，可选 "FP32"（CPU）/"FP16"（GPU）、"INT8"、"INT4"，无GPU时建议使用INT8或INT4
+LOCAL_MODEL_QUANT = "FP32"
+
+# 本地LLM模型在CPU上推理时使用的线程数，0表示由torch自动决定（一般为物理核心数）
+LOCAL_MODEL_CPU_THREADS = 0
+
+# 是否在桌宠启动后于后台预加载本地LLM模型（ChatGLM），开启后第一次对话无需等待模型加载
+LOCAL_MODEL_PRELOAD = False
+
+# 本地LLM模型（ChatGLM）把多个插件线程的并发请求合并成一次批量生成时，每批最多的请求数，设为1则不合并
+LOCAL_MODEL_MAX_BATCH = 4
+
 # 设置gradio的并行线程数（不需要修改）
 CONCURRENT_COUNT = 100
 
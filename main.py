@@ -1,6 +1,25 @@
 import os; os.environ['no_proxy'] = '*' # 避免代理网络产生意外污染
-
-def main():
+import sys
+from startup_profiler import startup_timer
+
+# python main.py --profile-startup [--profile-output 路径]
+# 记录各模块导入耗时与启动各阶段的时间点，写入json报告后自动退出，配合benchmark_startup.py使用
+PROFILE_STARTUP = '--profile-startup' in sys.argv
+if PROFILE_STARTUP: startup_timer.enable_import_profiling()
+# python main.py --profile-idle [--profile-seconds 30]
+# 每5秒打印一次CPU占用、定时器唤醒次数与窗口移动次数，到时间后打印平均值并退出
+PROFILE_IDLE = '--profile-idle' in sys.argv
+
+def get_cli_option(name, default=None):
+    if name in sys.argv and sys.argv.index(name) + 1 < len(sys.argv):
+        return sys.argv[sys.argv.index(name) + 1]
+    return default
+
+def init_web_ui():
+    """
+    学术优化网页版（gradio）的初始化。gradio以及各个大语言模型的bridge导入很慢，因此只有在config中
+    开启ENABLE_WEB_UI时才会在后台线程中调用本函数，不影响桌宠的启动速度
+    """
     import gradio as gr
     from request_llm.bridge_all import predict
     from toolbox import format_io, find_free_port, on_file_uploaded, on_report_generated, get_conf, ArgsGeneralWrapper, DummyWith
@@ -17,13 +36,6 @@ def main():
     title_html = f"<h1 align=\"center\">ChatGPT 学术优化 {get_current_version()}</h1>"
     description =  """代码开源和更新[地址🚀](https://github.com/binary-husky/chatgpt_academic)，感谢热情的[开发者们❤️](https://github.com/binary-husky/chatgpt_academic/graphs/contributors)"""
 
-    # 问询记录, python 版本建议3.9+（越新越好）
-    import logging
-    os.makedirs("gpt_log", exist_ok=True)
-    try:logging.basicConfig(filename="gpt_log/chat_secrets.log", level=logging.INFO, encoding="utf-8")
-    except:logging.basicConfig(filename="gpt_log/chat_secrets.log", level=logging.INFO)
-    print("所有问询记录将自动保存在本地目录./gpt_log/chat_secrets.log, 请注意自我隐私保护哦！")
-
     # 一些普通功能模块
     from core_functional import get_core_functions
     functional = get_core_functions()
@@ -35,10 +47,6 @@ def main():
     from theme import adjust_theme, advanced_css
     set_theme = adjust_theme()
 
-    # 代理与自动更新
-    from check_proxy import check_proxy, auto_update, warm_up_modules
-    proxy_info = check_proxy(proxies)
-
     gr_L1 = lambda: gr.Row().style()
     gr_L2 = lambda scale: gr.Column(scale=scale)
     if LAYOUT == "TOP-DOWN": 
@@ -61,21 +69,37 @@ def main():
     #     threading.Thread(target=auto_update, name="self-upgrade", daemon=True).start()
     #     threading.Thread(target=warm_up_modules, name="warm-up", daemon=True).start()
 
-    
+    # 移动到宠物的聊天监听中，可以快捷键打开。具体查看toggle_chat_web
+    #auto_opentab_delay()
+    #demo.queue(concurrency_count=CONCURRENT_COUNT).launch(server_name="0.0.0.0", server_port=PORT, auth=AUTHENTICATION, favicon_path="docs/logo.png")
+
+
+def main():
+    # 桌宠优先显示，其余较慢的初始化（代理检查、网页版）都放到桌宠出现之后的后台线程中
+    from toolbox import get_conf
+    proxies, ENABLE_WEB_UI, LOCAL_MODEL_PRELOAD = get_conf('proxies', 'ENABLE_WEB_UI', 'LOCAL_MODEL_PRELOAD')
+    startup_timer.mark('config_loaded')
+
+    # 问询记录, python 版本建议3.9+（越新越好）
+    import logging
+    os.makedirs("gpt_log", exist_ok=True)
+    try:logging.basicConfig(filename="gpt_log/chat_secrets.log", level=logging.INFO, encoding="utf-8")
+    except:logging.basicConfig(filename="gpt_log/chat_secrets.log", level=logging.INFO)
+    print("所有问询记录将自动保存在本地目录./gpt_log/chat_secrets.log, 请注意自我隐私保护哦！")
+
     #桌面宠物的类
     #导入桌宠界面
-    import sys
-    from PyQt5.QtCore import Qt, QPoint, QTimer, QSize, QObject
-    from PyQt5.QtGui import  QMovie, QKeySequence
+    from PyQt5.QtCore import Qt, QPoint, QTimer, QObject
+    from PyQt5.QtGui import  QKeySequence
     from PyQt5.QtWidgets import QApplication, QWidget, QMenu, QAction, QLabel, QGraphicsDropShadowEffect, QFileDialog, QDialog, QVBoxLayout, \
-        QPushButton, QLineEdit, QHBoxLayout, QInputDialog, QDesktopWidget, QCheckBox, QKeySequenceEdit
+        QPushButton, QLineEdit, QHBoxLayout, QInputDialog, QCheckBox, QKeySequenceEdit
     import configparser
     import random
     import codecs
-    from chat_model.chat_main_windows import ChatWindow
+    # 聊天窗口与日程对话框会连带导入requests等模块，改为在第一次打开时再导入
     from chat_model.schedule_manager import ScheduleManager
-    from chat_model.schedule_dialog import ScheduleDialog
-    import configparser
+    from pet_motion import PetMotion, WakeupMonitor
+    from sprite_cache import SpritePlayer
     #全局快捷键
     import keyboard
     import threading
@@ -83,27 +107,22 @@ def main():
         def __init__(self, config):
             super().__init__()
             self.config = config
+            # pet自由移动（只在走动时运行定时器，停下、隐藏或拖动时完全停止）
+            self.motion = PetMotion(self, speed=self.config.getint("Pet", "WALK_SPEED", fallback=20))
             self.init_ui()
 
             self.chat_window_state_changed = False
             
-            # 初始化日程管理器
-            self.schedule_manager = ScheduleManager(config, self)
+            # 初始化日程管理器（推迟到事件循环启动、桌宠显示出来之后）
+            self.schedule_manager = None
+            QTimer.singleShot(0, self.init_schedule_manager)
 
             # 监听全局快捷键的线程
             keyboard_listener_thread = threading.Thread(target=self._run_keyboard_listener, daemon=True)
             keyboard_listener_thread.start()
-            # pet自由移动
-            self.timer = QTimer()
-            self.timer.timeout.connect(self.update_position)
+            self.motion.set_direction(random.choice([-1, 1]))  # 初始化移动方向
             self.toggle_walk(self.config.getboolean("Pet", "RANDOM_WALK"))
 
-            # 获取最大屏幕
-            desktop = QDesktopWidget().availableGeometry()
-            self.max_x = desktop.width() - self.width()
-            self.max_y = desktop.height() - self.height()
-
-            self.direction = random.choice([-1, 1])  # 初始化移动方向
             # 停止和移动判断
             self.stop_timer = QTimer()
             self.stop_timer.timeout.connect(self.restart_movement)
@@ -118,6 +137,9 @@ def main():
 
 
 
+        def init_schedule_manager(self):
+            self.schedule_manager = ScheduleManager(self.config, self)
+
         #初始化界面
         def init_ui(self):
             #父容器
@@ -130,11 +152,11 @@ def main():
             self.move(screen_geometry.width() - self.width()-500, screen_geometry.height() - self.height()-100)
 
             #宠物信息
-            self.pet_movie = QMovie(self.config["Pet"]["PET_ICON"])
-            self.pet_movie.setScaledSize(QSize(self.pet_width, self.pet_height))
+            # 动画的各帧预先缩放好缓存在user_data/sprite_cache中，播放时不再缩放
             self.pet_label = QLabel(self)
-            self.pet_label.setMovie(self.pet_movie)
-            self.pet_movie.start()
+            sprite_cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'user_data', 'sprite_cache')
+            self.pet_sprite = SpritePlayer(self.pet_label, sprite_cache_dir)
+            self.load_pet_sprite()
             self.nickname = self.config["Pet"]["NICKNAME"]
 
             # 创建一个布局管理器
@@ -179,7 +201,9 @@ def main():
                 self.chat_window = None
                 self.chat_window_state_changed = True
             else:
+                from chat_model.chat_main_windows import ChatWindow
                 self.chat_window = ChatWindow(self, self.config)
+                startup_timer.mark_once('chat_window_created')
                 self.chat_window.show()
                 self.chat_window_open = True
                 self.chat_window_state_changed = True
@@ -203,13 +227,42 @@ def main():
         def mousePressEvent(self, event):
             if event.button() == Qt.LeftButton:
                 self.drag_position = event.globalPos() - self.frameGeometry().topLeft()
+                # 拖动时暂停走动
+                self.motion.pause("drag")
                 event.accept()
 
+        def mouseReleaseEvent(self, event):
+            if event.button() == Qt.LeftButton:
+                self.motion.resume("drag")
+
         def mouseMoveEvent(self, event):
             if event.buttons() == Qt.LeftButton:
                 self.move(event.globalPos() - self.drag_position)
                 self.update_chat_dialog_position()
 
+        def hideEvent(self, event):
+            # 隐藏时停止走动与动画，不产生任何定时器唤醒
+            self.motion.pause("hidden")
+            self.pet_sprite.set_paused(True)
+            super().hideEvent(event)
+
+        def showEvent(self, event):
+            self.motion.resume("hidden")
+            self.pet_sprite.set_paused(False)
+            super().showEvent(event)
+            # 移动到缩放比例不同的屏幕时，换用对应分辨率的帧
+            if not getattr(self, 'screen_change_connected', False) and self.windowHandle() is not None:
+                self.windowHandle().screenChanged.connect(self.on_screen_changed)
+                self.screen_change_connected = True
+
+        def on_screen_changed(self, screen):
+            if round(screen.devicePixelRatio(), 2) != self.sprite_device_pixel_ratio:
+                self.load_pet_sprite()
+
+        def load_pet_sprite(self):
+            self.sprite_device_pixel_ratio = round(self.devicePixelRatioF(), 2)
+            self.pet_sprite.load(self.config["Pet"]["PET_ICON"], self.pet_width, self.pet_height, self.sprite_device_pixel_ratio)
+
         def contextMenuEvent(self, event):
             self.menu.exec_(event.globalPos())
 
@@ -220,15 +273,10 @@ def main():
             options |= QFileDialog.ReadOnly
             new_icon_path, _ = QFileDialog.getOpenFileName(self, "选择新图标", "", "Images (*.png *.xpm *.jpg *.bmp, *.gif);;All Files (*)", options=options)
             if new_icon_path:
-                self.pet_movie.stop()  # 停止动画
-                # 替换影片
-                self.pet_movie.setFileName(new_icon_path)
-                # 获取图片尺寸
-                self.pet_movie.setScaledSize(QSize(self.pet_width, self.pet_height))
-                # 开始播放影片
-                self.pet_movie.start()
                 # 修改配置项
                 self.config.set('Pet', 'PET_ICON', new_icon_path)
+                # 播放新的图标（第一次使用时生成帧缓存）
+                self.load_pet_sprite()
                 # 保存修改后的配置文件
                 self.save_config()
 
@@ -245,42 +293,22 @@ def main():
         def restart_movement(self):
             self.stop_timer.stop()
             self.movement_timer.stop()
-            self.direction = random.choice([-1, 1])  # 随机选择一个方向
+            self.motion.set_direction(random.choice([-1, 1]))  # 随机选择一个方向
             self.set_new_timers()
 
         def stop_movement(self):
             self.stop_timer.stop()
             self.movement_timer.stop()
-            self.direction = 0  # 停止移动
+            self.motion.set_direction(0)  # 停止移动（定时器随之停止）
             self.set_new_timers()  # 重新设置停止时间和移动时间
 
-        def update_position(self):
-            if self.direction == 0:  # 如果宠物停止了移动
-                return  # 不执行任何移动操作
-            if self.direction != 0:
-                current_pos = self.pos()
-                if self.direction == 1:  # 向右移动
-                    new_pos = QPoint(current_pos.x() + 1, current_pos.y())
-                    if new_pos.x() >= self.max_x:
-                        self.direction = -1  # 碰到右边界，掉头向左
-                else:  # 向左移动
-                    new_pos = QPoint(current_pos.x() - 1, current_pos.y())
-                    if new_pos.x() <= 0:
-                        self.direction = 1  # 碰到左边界，掉头向右
-                self.move(new_pos)
-            else:  # 停止移动
-                self.stop_timer.stop()
-                self.movement_timer.stop()
-                stop_time = random.randint(2000, 5000)  # 生成一个2~5秒的随机数，作为移动时间
-                self.stop_timer.start(stop_time)
-            
         def random_speak(self):
             #待优化部分，应该是先区访问gpt，然后返回应该主动挑起的话题
             dialogues = ["我好无聊啊", "你想听个笑话吗？", "你有什么好玩的事情吗？", "你觉得我可爱吗？"]
             selected_dialogue = random.choice(dialogues)
             self.show_bubble(selected_dialogue)
         
-        def show_bubble(self, text, is_schedule_reminder=False, on_close_callback=None):
+        def show_bubble(self, text, is_schedule_reminder=False, on_close_callback=None, on_snooze_callback=None):
             if not text:
                 return
             print(f"[DEBUG] 桌宠收到气泡显示请求: {text}")
@@ -289,6 +317,9 @@ def main():
             if hasattr(self, 'close_button') and self.close_button:
                 self.close_button.deleteLater()
                 self.close_button = None
+            if hasattr(self, 'snooze_button') and self.snooze_button:
+                self.snooze_button.deleteLater()
+                self.snooze_button = None
             
             # 设置气泡文本
             self.bubble.setText(text)
@@ -320,6 +351,17 @@ def main():
                     self.close_button.clicked.connect(self.bubble.hide)
                     
                 self.close_button.show()
+                
+                # 如果提供了稍后提醒的回调函数，在关闭按钮左边添加"稍后提醒"按钮
+                if on_snooze_callback:
+                    self.snooze_button = QPushButton("稍后提醒", self.bubble)
+                    self.snooze_button.setStyleSheet("background-color: #f0f0f0; border-radius: 5px; padding: 2px 5px;")
+                    self.snooze_button.move(self.bubble.width() - 120, self.bubble.height() - 25)
+                    def on_snooze():
+                        self.bubble.hide()
+                        on_snooze_callback()
+                    self.snooze_button.clicked.connect(on_snooze)
+                    self.snooze_button.show()
             else:
                 # 非日程提醒，5秒后自动关闭
                 QTimer.singleShot(5000, self.bubble.hide)
@@ -337,7 +379,7 @@ def main():
             layout = QVBoxLayout()
 
             self.walk_checkbox = QCheckBox("是否自由走动", self)
-            self.walk_checkbox.setChecked(self.timer.isActive())
+            self.walk_checkbox.setChecked(self.motion.enabled)
             self.walk_checkbox.stateChanged.connect(self.toggle_walk)
             layout.addWidget(self.walk_checkbox)
 
@@ -413,10 +455,7 @@ def main():
 
         # 控制宠物自由走动和随机提问功能
         def toggle_walk(self, state):
-            if state:
-                self.timer.start(50)
-            else:
-                self.timer.stop()
+            self.motion.set_enabled(state)
         
         def change_size(self):
             flags = Qt.WindowSystemMenuHint | Qt.WindowTitleHint
@@ -455,7 +494,7 @@ def main():
                 self.pet_height = new_height
                 self.config.set("Pet", "HEIGHT", str(new_height))
 
-            self.pet_movie.setScaledSize(QSize(self.pet_width, self.pet_height))
+            self.load_pet_sprite()
 
             # 保存修改后的配置文件
             self.save_config()
@@ -483,22 +522,68 @@ def main():
             """
             显示日程管理对话框
             """
+            from chat_model.schedule_dialog import ScheduleDialog
+            if self.schedule_manager is None:
+                self.init_schedule_manager()
             schedule_dialog = ScheduleDialog(self, self.schedule_manager)
             schedule_dialog.exec_()
 
+    startup_timer.mark('qt_imported')
+
     config_private = 'pet_config_private.ini'
     app = QApplication(sys.argv)
+    startup_timer.mark('qt_app_created')
     config = configparser.ConfigParser()
     with codecs.open(config_private, 'r', 'utf-8') as f:
         # 读取配置文件内容
         config = configparser.ConfigParser()
         config.read_file(f)
     pet = DesktopPet(config)
+    startup_timer.mark('pet_ui_created')
+
+    def after_pet_shown():
+        # 事件循环已经启动，桌宠已经绘制出来
+        startup_timer.mark('pet_shown')
+        startup_timer.report()
+        # 代理检查需要访问网络，放到后台线程中
+        from check_proxy import check_proxy
+        threading.Thread(target=check_proxy, args=(proxies,), name="check-proxy", daemon=True).start()
+        if ENABLE_WEB_UI:
+            threading.Thread(target=init_web_ui, name="web-ui", daemon=True).start()
+        if LOCAL_MODEL_PRELOAD:
+            from request_llm.bridge_chatglm import preload
+            threading.Thread(target=preload, name="chatglm-preload", daemon=True).start()
+        if PROFILE_STARTUP:
+            QTimer.singleShot(0, profile_remaining_phases)
+        if PROFILE_IDLE:
+            profile_idle(float(get_cli_option('--profile-seconds', 30)))
+
+    def profile_idle(seconds):
+        monitor = WakeupMonitor(app, pet.motion)
+        monitor.start()
+        def finish():
+            # 只统计完整的周期，最后不足一个周期的部分时间太短，CPU占用不准确
+            monitor.stop()
+            monitor.summary()
+            app.quit()
+        QTimer.singleShot(int(seconds * 1000), finish)
+
+    def profile_remaining_phases():
+        # 聊天窗口与tokenizer预热平时是按需加载的，性能分析模式下主动执行一遍以便统计
+        pet.toggle_chat_window()
+        pet.toggle_chat_window()
+        from check_proxy import warm_up_modules
+        try:
+            warm_up_modules()
+            startup_timer.mark('tokenizer_warmed_up')
+        except:
+            import traceback
+            traceback.print_exc()
+            print('tokenizer预热失败，报告中不包含该阶段')
+        startup_timer.write_json(get_cli_option('--profile-output'))
+        app.quit()
+    QTimer.singleShot(0, after_pet_shown)
     sys.exit(app.exec_())
 
-    # 移动到宠物的聊天监听中，可以快捷键打开。具体查看toggle_chat_web
-    #auto_opentab_delay()
-    #demo.queue(concurrency_count=CONCURRENT_COUNT).launch(server_name="0.0.0.0", server_port=PORT, auth=AUTHENTICATION, favicon_path="docs/logo.png")
-
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,141 @@
+"""
+    桌宠的走动与运行开销统计
+
+    PetMotion: 随机走动。位置按 速度×经过的时间 计算（与定时器的抖动无关，不会越走越慢），
+    定时器间隔取走一个像素所需的时间（不短于一帧16ms），每次唤醒都恰好移动窗口一次；
+    停止走动、窗口隐藏或正在被拖动时定时器完全停止，空闲时不产生任何唤醒。
+
+    WakeupMonitor: 以 `python main.py --profile-idle [--profile-seconds 30]` 启动时安装，
+    统计进程的CPU占用、每秒定时器唤醒次数（按接收对象的类型分类）与每秒窗口移动次数。
+"""
+import time
+from PyQt5.QtCore import QObject, QTimer, QElapsedTimer, QEvent, Qt
+from PyQt5.QtWidgets import QApplication
+
+class PetMotion(QObject):
+    def __init__(self, widget, speed=20, min_interval_ms=16):
+        """
+        :param widget: 走动的窗口
+        :param speed: 走动速度（像素/秒）
+        :param min_interval_ms: 定时器的最短间隔（一帧）
+        """
+        super().__init__(widget)
+        self.widget = widget
+        self.speed = max(1, speed)
+        self.interval_ms = max(min_interval_ms, int(1000 / self.speed))
+        self.enabled = False
+        self.direction = 0          # 1向右，-1向左，0停止
+        self.paused = set()         # 暂停的原因，例如"hidden"、"drag"
+        self.n_moves = 0
+        self.origin_x = 0
+        self.min_x, self.max_x = 0, 0
+        self.clock = QElapsedTimer()
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self.step)
+
+    def is_running(self):
+        return self.timer.isActive()
+
+    def set_enabled(self, enabled):
+        self.enabled = bool(enabled)
+        self.update_timer()
+
+    def set_direction(self, direction):
+        self.direction = direction
+        self.start_segment()
+        self.update_timer()
+
+    def pause(self, reason):
+        self.paused.add(reason)
+        self.update_timer()
+
+    def resume(self, reason):
+        self.paused.discard(reason)
+        # 拖动之后窗口的位置变了，从新的位置开始计算
+        self.start_segment()
+        self.update_timer()
+
+    def update_timer(self):
+        """
+        只有在需要移动时才运行定时器
+        """
+        if self.enabled and self.direction != 0 and not self.paused:
+            if not self.timer.isActive():
+                self.start_segment()
+                self.timer.start(self.interval_ms)
+        else:
+            self.timer.stop()
+
+    def start_segment(self):
+        """
+        以当前位置为起点重新计时；同时更新可以走动的范围（屏幕分辨率可能改变）
+        """
+        geometry = QApplication.desktop().availableGeometry(self.widget)
+        self.min_x = geometry.left()
+        self.max_x = geometry.left() + geometry.width() - self.widget.width()
+        self.origin_x = self.widget.x()
+        self.clock.start()
+
+    def step(self):
+        x = self.origin_x + self.direction * int(self.speed * self.clock.elapsed() / 1000)
+        if (x >= self.max_x and self.direction > 0) or (x <= self.min_x and self.direction < 0):
+            # 朝外走到边界，掉头；已经掉头往回走时不再重复判断，否则会停在边界上
+            x = min(max(x, self.min_x), self.max_x)
+            self.direction = -self.direction
+            self.widget.move(x, self.widget.y())
+            self.start_segment()
+            self.n_moves += 1
+        elif x != self.widget.x():
+            self.widget.move(x, self.widget.y())
+            self.n_moves += 1
+
+
+class WakeupMonitor(QObject):
+    def __init__(self, app, motion=None, report_interval=5.0):
+        super().__init__()
+        self.app = app
+        self.motion = motion
+        self.report_interval = report_interval
+        self.counts = {}            # 接收定时器事件的对象类型 -> 次数
+        self.samples = []           # 每个统计周期的 (CPU占用%, 唤醒次数/秒, 窗口移动次数/秒)
+        self.report_timer = QTimer(self)
+        self.report_timer.timeout.connect(self.report)
+
+    def start(self):
+        self.app.installEventFilter(self)
+        self.t0, self.cpu0 = time.perf_counter(), time.process_time()
+        self.moves0 = self.motion.n_moves if self.motion is not None else 0
+        self.report_timer.start(int(self.report_interval * 1000))
+
+    def stop(self):
+        self.app.removeEventFilter(self)
+        self.report_timer.stop()
+
+    def eventFilter(self, obj, event):
+        # 统计自身的定时器不计入
+        if event.type() == QEvent.Timer and obj is not self.report_timer:
+            name = type(obj).__name__
+            self.counts[name] = self.counts.get(name, 0) + 1
+        return False
+
+    def report(self):
+        t, cpu = time.perf_counter(), time.process_time()
+        elapsed = max(t - self.t0, 1e-6)
+        n_moves = self.motion.n_moves if self.motion is not None else 0
+        wakeups = sum(self.counts.values())
+        sample = (100 * (cpu - self.cpu0) / elapsed, wakeups / elapsed, (n_moves - self.moves0) / elapsed)
+        self.samples.append(sample)
+        top = sorted(self.counts.items(), key=lambda kv: kv[1], reverse=True)[:3]
+        walking = "走动中" if self.motion is not None and self.motion.is_running() else "空闲"
+        print(f'[运行开销] {walking}  CPU {sample[0]:.1f}%  定时器唤醒 {sample[1]:.1f} 次/秒  窗口移动 {sample[2]:.1f} 次/秒  '
+              + '  '.join(f'{name}:{n / elapsed:.1f}' for name, n in top))
+        self.counts = {}
+        self.t0, self.cpu0, self.moves0 = t, cpu, n_moves
+
+    def summary(self):
+        if not self.samples:
+            return
+        n = len(self.samples)
+        cpu, wakeups, moves = (sum(s[i] for s in self.samples) / n for i in range(3))
+        print(f'[运行开销] 平均（{n}个周期）: CPU {cpu:.1f}%  定时器唤醒 {wakeups:.1f} 次/秒  窗口移动 {moves:.1f} 次/秒')
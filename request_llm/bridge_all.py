@@ -8,18 +8,52 @@
     具备多线程调用能力的函数
     2. predict_no_ui_long_connection：在实验过程中发现调用predict_no_ui处理长文档时，和openai的连接容易断掉，这个函数用stream的方式解决这个问题，同样支持多线程
 """
-import tiktoken
+import copy
+import time
+import logging
+import importlib
+import threading
+from collections import deque
 from functools import wraps, lru_cache
 from concurrent.futures import ThreadPoolExecutor
 
-from .bridge_chatgpt import predict_no_ui_long_connection as chatgpt_noui
-from .bridge_chatgpt import predict as chatgpt_ui
+# 各个后端的bridge模块（以及它们依赖的transformers、torch等）只在第一次用到时才导入
+backend_registry = {
+    "chatgpt": ".bridge_chatgpt",
+    "chatglm": ".bridge_chatglm",
+    # "tgui": ".bridge_tgui",
+}
+
+def register_backend(backend, module_name):
+    """
+    注册一个新的后端，module_name中需要提供predict与predict_no_ui_long_connection两个函数
+    """
+    backend_registry[backend] = module_name
+
+@lru_cache(maxsize=None)
+def load_backend(backend):
+    print(f'正在加载 {backend} 后端')
+    return importlib.import_module(backend_registry[backend], package=__package__)
+
+class LazyloadBackend(object):
+    def __init__(self, backend, fn_name):
+        self.backend = backend
+        self.fn_name = fn_name
 
-from .bridge_chatglm import predict_no_ui_long_connection as chatglm_noui
-from .bridge_chatglm import predict as chatglm_ui
+    def get_fn(self):
+        return getattr(load_backend(self.backend), self.fn_name)
 
-# from .bridge_tgui import predict_no_ui_long_connection as tgui_noui
-# from .bridge_tgui import predict as tgui_ui
+    def __call__(self, *args, **kwargs):
+        return self.get_fn()(*args, **kwargs)
+
+chatgpt_noui = LazyloadBackend("chatgpt", "predict_no_ui_long_connection")
+chatgpt_ui = LazyloadBackend("chatgpt", "predict")
+
+chatglm_noui = LazyloadBackend("chatglm", "predict_no_ui_long_connection")
+chatglm_ui = LazyloadBackend("chatglm", "predict")
+
+# tgui_noui = LazyloadBackend("tgui", "predict_no_ui_long_connection")
+# tgui_ui = LazyloadBackend("tgui", "predict")
 
 colors = ['#FF00FF', '#00FFFF', '#FF0000', '#990099', '#009999', '#990044']
 
@@ -30,6 +64,7 @@ class LazyloadTiktoken(object):
     @staticmethod
     @lru_cache(maxsize=128)
     def get_encoder(model):
+        import tiktoken
         print('正在加载tokenizer，如果是第一次运行，可能需要一点时间下载参数')
         tmp = tiktoken.encoding_for_model(model)
         print('加载tokenizer完毕')
@@ -51,6 +86,7 @@ get_token_num_gpt4 = lambda txt: len(tokenizer_gpt4.encode(txt, disallowed_speci
 model_info = {
     # openai
     "gpt-3.5-turbo": {
+        "backend": "chatgpt",
         "fn_with_ui": chatgpt_ui,
         "fn_without_ui": chatgpt_noui,
         "endpoint": "https://api.openai.com/v1/chat/completions",
@@ -60,6 +96,7 @@ model_info = {
     },
 
     "gpt-4": {
+        "backend": "chatgpt",
         "fn_with_ui": chatgpt_ui,
         "fn_without_ui": chatgpt_noui,
         "endpoint": "https://api.openai.com/v1/chat/completions",
@@ -70,6 +107,7 @@ model_info = {
 
     # api_2d
     "api2d-gpt-3.5-turbo": {
+        "backend": "chatgpt",
         "fn_with_ui": chatgpt_ui,
         "fn_without_ui": chatgpt_noui,
         "endpoint": "https://openai.api2d.net/v1/chat/completions",
@@ -79,6 +117,7 @@ model_info = {
     },
 
     "api2d-gpt-4": {
+        "backend": "chatgpt",
         "fn_with_ui": chatgpt_ui,
         "fn_without_ui": chatgpt_noui,
         "endpoint": "https://openai.api2d.net/v1/chat/completions",
@@ -89,6 +128,7 @@ model_info = {
 
     # chatglm
     "chatglm": {
+        "backend": "chatglm",
         "fn_with_ui": chatglm_ui,
         "fn_without_ui": chatglm_noui,
         "endpoint": None,
@@ -100,6 +140,45 @@ model_info = {
 }
 
 
+def get_fallback_chain(model, llm_kwargs):
+    """
+    模型本身及其后备模型（llm_kwargs['fallback']，缺省时使用config中的LLM_FALLBACK），
+    跳过没有可用api-key的后备模型，端点未熔断的排在前面；全部熔断时只返回模型本身，由熔断器立即报错
+    """
+    from toolbox import get_conf, get_avail_api_keys
+    from .circuit_breaker import is_endpoint_available
+    fallback = llm_kwargs.get('fallback', None)
+    if fallback is None:
+        LLM_FALLBACK, = get_conf('LLM_FALLBACK')
+        fallback = LLM_FALLBACK.get(model, [])
+    chain = [model]
+    for m in fallback:
+        if m not in model_info or m in chain: continue
+        if model_info[m]["backend"] == "chatgpt" and len(get_avail_api_keys(llm_kwargs.get('api_key', ''), m)) == 0: continue
+        chain.append(m)
+    avail = [m for m in chain if is_endpoint_available(model_info[m]["endpoint"])]
+    return avail if avail else chain[:1]
+
+
+def predict_with_fallback(inputs, llm_kwargs, history, sys_prompt, observe_window, console_slience):
+    """
+    按后备链依次尝试，端点熔断、超时或网络错误时切换到下一个模型；
+    其他错误（例如token超限时的ConnectionAbortedError）直接抛出，交给调用方裁剪输入后重试
+    """
+    import requests
+    from .circuit_breaker import CircuitOpenError
+    chain = get_fallback_chain(llm_kwargs['llm_model'], llm_kwargs)
+    for i, model in enumerate(chain):
+        llm_kwargs_feedin = copy.deepcopy(llm_kwargs)
+        llm_kwargs_feedin['llm_model'] = model
+        try:
+            return model_info[model]["fn_without_ui"](inputs, llm_kwargs_feedin, history, sys_prompt, observe_window, console_slience)
+        except (CircuitOpenError, TimeoutError, requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if i == len(chain) - 1: raise
+            print(f'[后备模型] {model} 不可用（{e}），切换到 {chain[i+1]}')
+            if observe_window is not None and len(observe_window) >= 1: observe_window[0] = ""
+
+
 def LLM_CATCH_EXCEPTION(f):
     """
     装饰器函数，将错误显示出来
@@ -117,6 +196,128 @@ def LLM_CATCH_EXCEPTION(f):
     return decorated
 
 
+# 各模型首个token的延迟（秒），hedge模式据此决定何时补发请求
+first_token_latency = {}
+first_token_latency_lock = threading.Lock()
+
+def record_first_token_latency(model, latency, maxlen=200):
+    with first_token_latency_lock:
+        first_token_latency.setdefault(model, deque(maxlen=maxlen)).append(latency)
+
+def get_hedge_delay(model, min_samples=5):
+    """
+    取该模型历史首token延迟的HEDGE_PERCENTILE分位数，样本不足时使用HEDGE_DEFAULT_DELAY
+    """
+    from toolbox import get_conf
+    percentile, default_delay = get_conf('HEDGE_PERCENTILE', 'HEDGE_DEFAULT_DELAY')
+    with first_token_latency_lock:
+        samples = sorted(first_token_latency.get(model, []))
+    if len(samples) < min_samples:
+        return default_delay
+    return samples[min(len(samples)-1, int(percentile * len(samples)))]
+
+
+class Contender():
+    """
+    race/hedge模式下的一路请求，在独立的守护线程中运行，胜出者产生后其余的通过看门狗取消
+    """
+    def __init__(self, model, inputs, llm_kwargs, history, sys_prompt, console_slience):
+        self.model = model
+        self.window = ["", time.time(), ""]
+        self.t_start = None
+        self.t_first_token = None
+        self.result = None
+        self.error = None
+        self.done = False
+        self.cancelled = False
+        llm_kwargs_feedin = copy.deepcopy(llm_kwargs)
+        llm_kwargs_feedin['llm_model'] = model
+        self.args = (inputs, llm_kwargs_feedin, history, sys_prompt, self.window, console_slience)
+
+    def start(self, exclude_keys=()):
+        """
+        exclude_keys: 不使用的api-key（同一模型上正在进行的请求已经选用的），排除后没有可用的key时不排除
+        """
+        from toolbox import get_avail_api_keys
+        llm_kwargs = self.args[1]
+        if exclude_keys and model_info[self.model]["backend"] == "chatgpt":
+            keys = [k for k in llm_kwargs['api_key'].split(',') if k not in exclude_keys]
+            if len(get_avail_api_keys(','.join(keys), self.model)) > 0:
+                llm_kwargs['api_key'] = ','.join(keys)
+        self.t_start = time.time()
+        threading.Thread(target=self.run, name=f"llm-contender-{self.model}", daemon=True).start()
+
+    def run(self):
+        try:
+            self.result = model_info[self.model]["fn_without_ui"](*self.args)
+        except Exception as e:
+            self.error = e
+        self.done = True
+
+    @property
+    def started(self):
+        return self.t_start is not None
+
+    def poll_first_token(self):
+        if self.t_first_token is None and len(self.window[0]) > 0:
+            self.t_first_token = time.time()
+            record_first_token_latency(self.model, self.t_first_token - self.t_start)
+        return self.t_first_token is not None
+
+    def cancel(self):
+        # 看门狗时间戳置零，线程在收到下一个token时退出
+        if self.started and not self.done:
+            self.cancelled = True
+            self.window[1] = 0
+            if self.t_first_token is None:
+                # 被取消时仍未出现首token，其延迟至少为已等待的时间，同样计入统计
+                record_first_token_latency(self.model, time.time() - self.t_start)
+
+
+def predict_first_complete(models, inputs, llm_kwargs, history, sys_prompt, observe_window, console_slience, mode):
+    """
+    race：同时询问所有模型，采用最先完整返回的回答，其余请求取消
+    hedge：先询问第一个模型，若在首token延迟的分位数内没有收到任何token，才依次补发给下一个模型
+    所有请求都失败时，抛出最后一个异常
+    """
+    contenders = [Contender(model, inputs, llm_kwargs, history, sys_prompt, console_slience) for model in models]
+    n_start = len(contenders) if mode == 'race' else 1
+    for c in contenders[:n_start]: c.start()
+    t_last_start = time.time()
+    try:
+        while True:
+            time.sleep(0.05)
+            started = [c for c in contenders if c.started]
+            any_token = any([c.poll_first_token() for c in started])
+            # 看门狗（watchdog）
+            watchdog = observe_window[1] if observe_window is not None and len(observe_window) >= 2 else time.time()
+            for c in started:
+                if not c.cancelled: c.window[1] = watchdog
+            # 观察窗（window），显示领先的回答
+            leader = max(started, key=lambda c: len(c.window[0]))
+            if observe_window is not None and len(observe_window) >= 1 and leader.window[0]:
+                observe_window[0] = leader.window[0]
+            # 胜出者
+            for c in started:
+                if c.done and c.error is None:
+                    logging.info(f'[{mode}] {c.model} 胜出，耗时 {time.time()-c.t_start:.1f}s')
+                    return c.result
+            # 补发（hedge）
+            pending = [c for c in contenders if not c.started]
+            all_failed = all([c.done for c in started])
+            if pending and (all_failed or (not any_token and time.time() - t_last_start > get_hedge_delay(started[-1].model))):
+                logging.info(f'[{mode}] {started[-1].model} 等待首个token超时或失败，补发至 {pending[0].model}')
+                # 补发到同一模型时换用其他api-key，否则同一个慢key上的请求再慢一次
+                used_keys = [c.args[1].get('selected_api_key') for c in started if c.model == pending[0].model]
+                pending[0].start(exclude_keys=[k for k in used_keys if k])
+                t_last_start = time.time()
+                continue
+            if not pending and all_failed:
+                raise started[-1].error
+    finally:
+        for c in contenders: c.cancel()
+
+
 def predict_no_ui_long_connection(inputs, llm_kwargs, history, sys_prompt, observe_window, console_slience=False):
     """
     发送至LLM，等待回复，一次性完成，不显示中间过程。但内部用stream的方法避免中途网线被掐。
@@ -130,17 +331,29 @@ def predict_no_ui_long_connection(inputs, llm_kwargs, history, sys_prompt, obser
         是之前的对话列表
     observe_window = None：
         用于负责跨越线程传递已经输出的部分，大部分时候仅仅为了fancy的视觉效果，留空即可。observe_window[0]：观测窗。observe_window[1]：看门狗
+    llm_kwargs['dispatch_mode']：
+        可选，"all"/"race"/"hedge"，同时询问多个模型时的调度方式，缺省时使用config中的LLM_DISPATCH_MODE
+    llm_kwargs['fallback']：
+        可选，后备模型列表，缺省时使用config中的LLM_FALLBACK
     """
-    import threading, time, copy
+    from toolbox import get_conf, get_avail_api_keys
 
     model = llm_kwargs['llm_model']
+    mode = llm_kwargs.get('dispatch_mode', None) or get_conf('LLM_DISPATCH_MODE')[0]
     n_model = 1
+    if mode == 'hedge' and '&' not in model and model in model_info and model_info[model]["backend"] == "chatgpt" \
+            and len(get_avail_api_keys(llm_kwargs['api_key'], model)) < 2:
+        # 只写一个模型的hedge需要换用另一个api-key补发，只有一个可用key时补发没有意义，按普通请求处理
+        mode = 'all'
+    if mode in ('race', 'hedge') and ('&' in model or mode == 'hedge'):
+        # 只写一个模型的hedge：用另一个api-key向同一模型补发一份请求
+        models = model.split('&') if '&' in model else [model, model]
+        return predict_first_complete(models, inputs, llm_kwargs, history, sys_prompt, observe_window, console_slience, mode)
     if '&' not in model:
         assert not model.startswith("tgui"), "TGUI不支持函数插件的实现"
 
-        # 如果只询问1个大语言模型：
-        method = model_info[model]["fn_without_ui"]
-        return method(inputs, llm_kwargs, history, sys_prompt, observe_window, console_slience)
+        # 如果只询问1个大语言模型：端点熔断或失败时按后备链切换模型
+        return predict_with_fallback(inputs, llm_kwargs, history, sys_prompt, observe_window, console_slience)
     else:
         # 如果同时询问多个大语言模型：
         executor = ThreadPoolExecutor(max_workers=4)
@@ -203,8 +416,15 @@ def predict(inputs, llm_kwargs, *args, **kwargs):
     history 是之前的对话列表（注意无论是inputs还是history，内容太长了都会触发token数量溢出的错误）
     chatbot 为WebUI中显示的对话列表，修改它，然后yeild出去，可以直接修改对话界面内容
     additional_fn代表点击的哪个按钮，按钮见functional.py
+    流式输出产生的界面刷新会按照UI_REFRESH_INTERVAL合并
+    模型所在端点熔断时，直接使用后备链中第一个可用的模型
     """
 
-    method = model_info[llm_kwargs['llm_model']]["fn_with_ui"]
-    yield from method(inputs, llm_kwargs, *args, **kwargs)
+    from toolbox import coalesce_ui_updates
+    model = get_fallback_chain(llm_kwargs['llm_model'], llm_kwargs)[0]
+    if model != llm_kwargs['llm_model']:
+        print(f"[后备模型] {llm_kwargs['llm_model']} 所在端点已熔断，本次使用 {model}")
+        llm_kwargs = dict(llm_kwargs, llm_model=model)
+    method = model_info[model]["fn_with_ui"]
+    yield from coalesce_ui_updates(method(inputs, llm_kwargs, *args, **kwargs))
 
@@ -1,14 +1,35 @@
 
-from transformers import AutoModel, AutoTokenizer
+
 import time
-import importlib
-from toolbox import update_ui, get_conf
+import queue
+import threading
+import itertools
+from toolbox import update_ui, get_conf, core_functional_registry
 from multiprocessing import Process, Pipe
 
 load_message = "ChatGLM尚未加载，加载需要一段时间。注意，取决于`config.py`的配置，ChatGLM消耗大量的内存（CPU）或显存（GPU），也许会导致低配计算机卡死 ……"
 
+# 子进程加载模型的各个阶段，通过管道实时汇报给主进程
+load_stages = {
+    "starting":          "[1/4] 正在启动ChatGLM进程 ……",
+    "loading_tokenizer": "[1/4] 正在加载tokenizer ……",
+    "loading_weights":   "[2/4] tokenizer加载完毕，正在加载模型权重（耗时最长） ……",
+    "warming_up":        "[3/4] 模型权重加载完毕，正在预热（生成第一个token） ……",
+    "ready":             "[4/4] ChatGLM已就绪",
+    "failed":            "[Local Message] Call ChatGLM fail 不能正常加载ChatGLM的参数。",
+}
+
 #################################################################################
 class GetGLMHandle(Process):
+    """
+    常驻的ChatGLM子进程，所有线程共用同一个模型。
+    每个请求都带有请求ID，子进程按ID回传结果，主进程中的分发线程再把结果投递到各个请求自己的队列中，
+    因此多个插件线程可以同时调用而不会互相串流。
+    子进程内的调度器轮流推进各个流式请求，并把可以合并的非流式请求（batchable）合并成一次批量生成。
+        主进程 -> 子进程: (请求ID, kwargs) 或 (请求ID, '[Cancel]')
+        子进程 -> 主进程: (请求ID, 回复)，请求ID为None时表示发给所有请求的消息
+                          ('[Status]', (阶段, 附加信息))，汇报模型加载进度
+    """
     def __init__(self):
         super().__init__(daemon=True)
         self.parent, self.child = Pipe()
@@ -16,9 +37,21 @@ class GetGLMHandle(Process):
         self.chatglm_tokenizer = None
         self.info = ""
         self.success = True
+        self.max_batch_size, = get_conf('LOCAL_MODEL_MAX_BATCH')
+        self.stage = "starting"
+        self.stage_info = ""
         self.check_dependency()
         self.start()
-        
+        # 关闭主进程中子进程一端的管道，子进程退出（崩溃、被系统杀掉）时parent.recv()才会抛出EOFError
+        self.child.close()
+        # 以下成员只在主进程中使用（在start之后创建，避免spawn方式启动子进程时被pickle）
+        self.ready_event = threading.Event()
+        self.response_queues = {}
+        self.request_ids = itertools.count()
+        self.send_lock = threading.Lock()
+        self.dead_message = None
+        threading.Thread(target=self.dispatch, name="chatglm-dispatch", daemon=True).start()
+
     def check_dependency(self):
         try:
             import sentencepiece
@@ -29,7 +62,26 @@ class GetGLMHandle(Process):
             self.success = False
 
     def ready(self):
-        return self.chatglm_model is not None
+        return self.stage == "ready"
+
+    def failed(self):
+        # 加载权重时子进程可能被系统杀掉（内存不足），此时不会再汇报任何阶段
+        return self.stage == "failed" or self.dead_message is not None or not self.is_alive()
+
+    def wait_ready(self, timeout=None):
+        return self.ready_event.wait(timeout)
+
+    def get_progress(self):
+        """
+        模型加载进度的描述，供界面显示
+        """
+        if self.stage != "failed" and self.failed():
+            return "[Local Message] ChatGLM进程在加载过程中退出（可能是内存不足），" + load_stages.get(self.stage, self.stage)
+        progress = load_stages.get(self.stage, self.stage)
+        return progress + (f"（{self.stage_info}）" if self.stage_info else "")
+
+    def send_status(self, stage, info=""):
+        self.child.send(('[Status]', (stage, info)))
 
     def run(self):
         # 第一次运行，加载参数
@@ -37,58 +89,301 @@ class GetGLMHandle(Process):
         while True:
             try:
                 if self.chatglm_model is None:
-                    self.chatglm_tokenizer = AutoTokenizer.from_pretrained("THUDM/chatglm-6b", trust_remote_code=True)
-                    device, = get_conf('LOCAL_MODEL_DEVICE')
-                    if device=='cpu':
-                        self.chatglm_model = AutoModel.from_pretrained("THUDM/chatglm-6b", trust_remote_code=True).float()
-                    else:
-                        self.chatglm_model = AutoModel.from_pretrained("THUDM/chatglm-6b", trust_remote_code=True).half().cuda()
-                    self.chatglm_model = self.chatglm_model.eval()
+                    self.load_model()
+                    self.warm_up()
                     break
                 else:
                     break
             except:
                 retry += 1
                 if retry > 3: 
-                    self.child.send('[Local Message] Call ChatGLM fail 不能正常加载ChatGLM的参数。')
+                    self.send_status("failed")
+                    self.child.send((None, load_stages["failed"]))
+                    self.child.send((None, '[Finish]'))
                     raise RuntimeError("不能正常加载ChatGLM的参数！")
+                self.chatglm_model = None
+                self.send_status("loading_tokenizer", f"加载失败，第{retry}次重试")
+        self.send_status("ready")
+
+        # 进入任务调度状态
+        self.schedule()
+
+    def load_model(self):
+        """
+        加载模型，CPU模式下可选择权重量化与线程数：
+            FP32: 完整精度，约需24GB内存
+            INT8: 直接加载官方预量化的THUDM/chatglm-6b-int8权重，约需9GB内存
+            INT4: 直接加载官方预量化的THUDM/chatglm-6b-int4权重，约需6GB内存
+        量化权重不经过完整精度的模型，内存峰值与最终占用相当；CPU上需要gcc编译量化kernel（首次加载时自动完成）
+        """
+        # transformers（以及torch）只在子进程中导入，不使用ChatGLM时无需安装，也不占用主进程的启动时间和内存
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+        device, quant, cpu_threads = get_conf('LOCAL_MODEL_DEVICE', 'LOCAL_MODEL_QUANT', 'LOCAL_MODEL_CPU_THREADS')
+        quant = quant.upper()
+        model_name = {"INT8": "THUDM/chatglm-6b-int8", "INT4": "THUDM/chatglm-6b-int4"}.get(quant, "THUDM/chatglm-6b")
+        t_start = time.time()
+        self.send_status("loading_tokenizer")
+        self.chatglm_tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
+        self.send_status("loading_weights", f"{model_name}，{device}，{quant}")
+        if device=='cpu':
+            if cpu_threads > 0:
+                torch.set_num_threads(cpu_threads)
+                try: torch.set_num_interop_threads(1)  # 逐token生成几乎没有算子间并行，线程留给算子内并行
+                except RuntimeError: pass
+            # low_cpu_mem_usage: 不再先构造一份随机初始化的模型再覆盖权重；
+            # float()只转换未量化的参数（embedding、layernorm等），量化后的权重保持int8/int4
+            model = AutoModel.from_pretrained(model_name, trust_remote_code=True, low_cpu_mem_usage=True).float()
+        else:
+            model = AutoModel.from_pretrained(model_name, trust_remote_code=True).half().cuda()
+        self.chatglm_model = model.eval()
+        peak_rss = get_peak_rss_mb()
+        print(f'[ChatGLM] 模型加载完毕：{model_name}，设备 {device}，精度 {quant}，线程数 {torch.get_num_threads()}，'
+              f'耗时 {time.time()-t_start:.1f}s，峰值内存 {"未知" if peak_rss is None else f"{peak_rss:.0f}MB"}')
+
+    def warm_up(self):
+        # 生成第一个token，完成kernel初始化与内存分配，之后的第一个真实请求不必再等待
+        self.send_status("warming_up")
+        t_start = time.time()
+        for response, history in self.chatglm_model.stream_chat(self.chatglm_tokenizer, "你好", history=[], max_length=16):
+            break
+        print(f'[ChatGLM] 预热完毕，首个token耗时 {time.time()-t_start:.1f}s')
+
+    def report_speed(self, t_start, responses):
+        # 统计生成速度（tokens/s）与峰值内存
+        n_token = sum(len(self.chatglm_tokenizer.encode(r)) for r in responses)
+        elapsed = max(time.time() - t_start, 1e-6)
+        peak_rss = get_peak_rss_mb()
+        print(f'[ChatGLM] 生成 {n_token} tokens（{len(responses)} 个请求），耗时 {elapsed:.1f}s，'
+              f'{n_token/elapsed:.2f} tokens/s，峰值内存 {"未知" if peak_rss is None else f"{peak_rss:.0f}MB"}')
+
+    ############################## 子进程：调度器 ##############################
+    def schedule(self):
+        streaming = {}      # 请求ID -> stream_chat生成器，轮流推进，每次推进一个token
+        batch_pending = []  # [(请求ID, kwargs)]，等待合并成一次批量生成
+        self.request_stats = {}  # 请求ID -> [开始时间, 最新回复]，用于统计生成速度
+        self.batch_supported = True
+        while True:
+            # 没有任务时阻塞等待，有任务时只取走管道中已有的请求
+            if not streaming and not batch_pending:
+                self.accept(self.child.recv(), streaming, batch_pending)
+            while self.child.poll():
+                self.accept(self.child.recv(), streaming, batch_pending)
+
+            if batch_pending:
+                self.run_batch(batch_pending, streaming)
+
+            for req_id, gen in list(streaming.items()):
+                try:
+                    response, history = next(gen)
+                    self.child.send((req_id, response))
+                    if req_id in self.request_stats: self.request_stats[req_id][1] = response
+                except StopIteration:
+                    del streaming[req_id]
+                    t_start, response = self.request_stats.pop(req_id, (None, ''))
+                    if t_start is not None: self.report_speed(t_start, [response])
+                    self.child.send((req_id, '[Finish]'))
+                except:
+                    del streaming[req_id]
+                    self.request_stats.pop(req_id, None)
+                    self.child.send((req_id, '[Local Message] Call ChatGLM fail.'))
+                    self.child.send((req_id, '[Finish]'))
+
+    def accept(self, msg, streaming, batch_pending):
+        req_id, kwargs = msg
+        if kwargs == '[Cancel]':
+            # 调用方已经放弃了这个请求（例如看门狗超时），不再为它生成
+            streaming.pop(req_id, None)
+            self.request_stats.pop(req_id, None)
+            batch_pending[:] = [(i, k) for i, k in batch_pending if i != req_id]
+            return
+        self.request_stats[req_id] = [time.time(), '']
+        batchable = kwargs.pop('batchable', False)
+        if batchable and self.batch_supported and self.max_batch_size > 1:
+            batch_pending.append((req_id, kwargs))
+        else:
+            streaming[req_id] = self.chatglm_model.stream_chat(self.chatglm_tokenizer, **kwargs)
+
+    def run_batch(self, batch_pending, streaming):
+        """
+        把生成参数相同的请求合并为一次前向计算，每个请求一次性得到完整回复
+        """
+        key = lambda kwargs: (kwargs.get('max_length'), kwargs.get('top_p'), kwargs.get('temperature'))
+        first_key = key(batch_pending[0][1])
+        batch = [(i, k) for i, k in batch_pending if key(k) == first_key][:self.max_batch_size]
+        batch_pending[:] = [item for item in batch_pending if item not in batch]
+        if len(batch) == 1:
+            # 只有一个请求时，按普通的流式请求处理
+            req_id, kwargs = batch[0]
+            streaming[req_id] = self.chatglm_model.stream_chat(self.chatglm_tokenizer, **kwargs)
+            return
+        try:
+            t_start = time.time()
+            responses = self.batch_chat([k for _, k in batch])
+            self.report_speed(t_start, responses)
+        except:
+            # 模型不支持批量生成（如tokenizer不支持padding），退回到逐个流式生成
+            import traceback
+            traceback.print_exc()
+            self.batch_supported = False
+            for req_id, kwargs in batch:
+                streaming[req_id] = self.chatglm_model.stream_chat(self.chatglm_tokenizer, **kwargs)
+            return
+        for (req_id, _), response in zip(batch, responses):
+            self.request_stats.pop(req_id, None)
+            self.child.send((req_id, response))
+            self.child.send((req_id, '[Finish]'))
+
+    @staticmethod
+    def build_prompt(query, history):
+        # 与ChatGLM-6B的chat/stream_chat中的prompt格式保持一致
+        if not history:
+            return query
+        prompt = ""
+        for i, (old_query, response) in enumerate(history):
+            prompt += "[Round {}]\n问：{}\n答：{}\n".format(i, old_query, response)
+        prompt += "[Round {}]\n问：{}\n答：".format(len(history), query)
+        return prompt
 
-        # 进入任务等待状态
+    def batch_chat(self, kwargs_list):
+        import torch
+        model, tokenizer = self.chatglm_model, self.chatglm_tokenizer
+        prompts = [self.build_prompt(k['query'], k.get('history', [])) for k in kwargs_list]
+        inputs = tokenizer(prompts, return_tensors="pt", padding=True).to(model.device)
+        gen_kwargs = {"max_length": kwargs_list[0].get('max_length', 2048), "do_sample": True,
+                      "top_p": kwargs_list[0].get('top_p', 0.7), "temperature": kwargs_list[0].get('temperature', 0.95)}
+        with torch.no_grad():
+            outputs = model.generate(**inputs, **gen_kwargs)
+        input_len = inputs["input_ids"].shape[1]
+        responses = []
+        for output in outputs.tolist():
+            response = tokenizer.decode(output[input_len:])
+            if hasattr(model, 'process_response'): response = model.process_response(response)
+            responses.append(response.strip())
+        return responses
+
+    ############################## 主进程：请求与分发 ##############################
+    def dispatch(self):
+        # 把子进程的回复按请求ID投递到各自的队列
         while True:
-            kwargs = self.child.recv()
             try:
-                for response, history in self.chatglm_model.stream_chat(self.chatglm_tokenizer, **kwargs):
-                    self.child.send(response)
-            except:
-                self.child.send('[Local Message] Call ChatGLM fail.')
-            self.child.send('[Finish]')
+                req_id, res = self.parent.recv()
+            except (EOFError, OSError):
+                # 子进程已经退出，通知所有等待中的请求
+                self.dead_message = '[Local Message] ChatGLM进程已退出。'
+                self.ready_event.set()
+                for q in list(self.response_queues.values()):
+                    q.put(self.dead_message); q.put('[Finish]')
+                return
+            if req_id == '[Status]':
+                self.stage, self.stage_info = res
+                if self.stage in ("ready", "failed"): self.ready_event.set()
+            elif req_id is None:
+                for q in list(self.response_queues.values()): q.put(res)
+            elif req_id in self.response_queues:
+                self.response_queues[req_id].put(res)
 
     def stream_chat(self, **kwargs):
-        self.parent.send(kwargs)
-        while True:
-            res = self.parent.recv()
-            if res != '[Finish]':
-                yield res
-            else:
-                break
+        if self.dead_message is not None:
+            yield self.dead_message
+            return
+        req_id = next(self.request_ids)
+        response_queue = queue.Queue()
+        self.response_queues[req_id] = response_queue
+        if self.dead_message is not None:
+            # 注册之前子进程刚好退出，分发线程已经不会再通知这个请求
+            self.response_queues.pop(req_id, None)
+            yield self.dead_message
+            return
+        finished = False
+        try:
+            with self.send_lock:
+                self.parent.send((req_id, kwargs))
+            while True:
+                res = response_queue.get()
+                if res != '[Finish]':
+                    yield res
+                else:
+                    finished = True
+                    break
+        finally:
+            self.response_queues.pop(req_id, None)
+            if not finished and self.dead_message is None:
+                with self.send_lock:
+                    self.parent.send((req_id, '[Cancel]'))
         return
     
+def get_peak_rss_mb():
+    """
+    当前进程的峰值常驻内存（MB），无法获取时返回None
+    """
+    import sys
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil   # Windows
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / 1024 / 1024
+    except ImportError:
+        return None
+
 global glm_handle
 glm_handle = None
+glm_handle_lock = threading.Lock()
+
+def get_glm_handle():
+    """
+    获取（必要时创建）全局唯一的ChatGLM进程
+    """
+    global glm_handle
+    with glm_handle_lock:
+        if glm_handle is None:
+            glm_handle = GetGLMHandle()
+        return glm_handle
+
+def release_glm_handle():
+    global glm_handle
+    with glm_handle_lock:
+        glm_handle = None
+
+def preload():
+    """
+    在后台提前启动ChatGLM进程并加载模型（config中LOCAL_MODEL_PRELOAD=True时，桌宠启动后调用）
+    """
+    glm_handle = get_glm_handle()
+    if not glm_handle.success:
+        print(glm_handle.info)
+        release_glm_handle()
+        return
+    glm_handle.wait_ready()
+    print(glm_handle.get_progress())
 #################################################################################
 def predict_no_ui_long_connection(inputs, llm_kwargs, history=[], sys_prompt="", observe_window=None, console_slience=False):
     """
         多线程方法
         函数的说明请见 request_llm/bridge_all.py
     """
-    global glm_handle
-    if glm_handle is None:
-        glm_handle = GetGLMHandle()
-        observe_window[0] = load_message + "\n\n" + glm_handle.info
-        if not glm_handle.success: 
-            error = glm_handle.info
-            glm_handle = None
-            raise RuntimeError(error)
+    watch_dog_patience = 5 # 看门狗 (watchdog) 的耐心, 设置5秒即可
+    glm_handle = get_glm_handle()
+    if not glm_handle.success: 
+        error = glm_handle.info
+        release_glm_handle()
+        raise RuntimeError(error)
+
+    # 模型尚未就绪时，在观测窗中显示加载进度
+    while not glm_handle.ready():
+        if glm_handle.failed():
+            release_glm_handle()
+            raise RuntimeError(glm_handle.get_progress())
+        if observe_window is not None:
+            observe_window[0] = load_message + "\n\n" + glm_handle.get_progress()
+            if len(observe_window) >= 2 and (time.time()-observe_window[1]) > watch_dog_patience:
+                raise RuntimeError("程序终止。")
+        glm_handle.wait_ready(timeout=0.5)
 
     # chatglm 没有 sys_prompt 接口，因此把prompt加入 history
     history_feedin = []
@@ -96,9 +391,10 @@ def predict_no_ui_long_connection(inputs, llm_kwargs, history=[], sys_prompt="",
         history_feedin.append(["What can I do?", sys_prompt] )
         history_feedin.append([history[2*i], history[2*i+1]] )
 
-    watch_dog_patience = 5 # 看门狗 (watchdog) 的耐心, 设置5秒即可
     response = ""
-    for response in glm_handle.stream_chat(query=inputs, history=history_feedin, max_length=llm_kwargs['max_length'], top_p=llm_kwargs['top_p'], temperature=llm_kwargs['temperature']):
+    # 多线程调用时不需要逐字显示，允许子进程把多个线程的请求合并成一次批量生成
+    for response in glm_handle.stream_chat(query=inputs, history=history_feedin, max_length=llm_kwargs['max_length'], top_p=llm_kwargs['top_p'], temperature=llm_kwargs['temperature'], batchable=True):
+        if observe_window is None: continue
         observe_window[0] = response
         if len(observe_window) >= 2:  
             if (time.time()-observe_window[1]) > watch_dog_patience:
@@ -114,21 +410,25 @@ def predict(inputs, llm_kwargs, plugin_kwargs, chatbot, history=[], system_promp
     """
     chatbot.append((inputs, ""))
 
-    global glm_handle
-    if glm_handle is None:
-        glm_handle = GetGLMHandle()
+    glm_handle = get_glm_handle()
+    if not glm_handle.success: 
         chatbot[-1] = (inputs, load_message + "\n\n" + glm_handle.info)
         yield from update_ui(chatbot=chatbot, history=[])
-        if not glm_handle.success: 
-            glm_handle = None
+        release_glm_handle()
+        return
+
+    # 模型尚未就绪时（首次使用，或者后台预加载还没有完成），实时显示加载进度
+    while not glm_handle.ready():
+        failed = glm_handle.failed()
+        chatbot[-1] = (inputs, load_message + "\n\n" + glm_handle.get_progress())
+        yield from update_ui(chatbot=chatbot, history=[])
+        if failed:
+            release_glm_handle()
             return
+        glm_handle.wait_ready(timeout=0.5)
 
     if additional_fn is not None:
-        import core_functional
-        importlib.reload(core_functional)    # 热更新prompt
-        core_functional = core_functional.get_core_functions()
-        if "PreProcess" in core_functional[additional_fn]: inputs = core_functional[additional_fn]["PreProcess"](inputs)  # 获取预处理函数（如果有的话）
-        inputs = core_functional[additional_fn]["Prefix"] + inputs + core_functional[additional_fn]["Suffix"]
+        inputs = core_functional_registry.apply(additional_fn, inputs)  # 拼接Prefix、预处理函数与Suffix（core_functional.py被修改时自动热更新）
 
     history_feedin = []
     for i in range(len(history)//2):
@@ -13,15 +13,14 @@
 
 import json
 import time
-import gradio as gr
 import logging
 import traceback
 import requests
-import importlib
+from .circuit_breaker import post_with_breaker, CircuitOpenError
 
 # config_private.py放自己的秘密如API和代理网址
 # 读取时首先看是否存在私密的config_private配置文件（不受git管控），如果有，则覆盖原config文件
-from toolbox import get_conf, update_ui, is_any_api_key, select_api_key
+from toolbox import get_conf, update_ui, is_any_api_key, select_api_key, report_api_key_result, core_functional_registry
 proxies, API_KEY, TIMEOUT_SECONDS, MAX_RETRY = \
     get_conf('proxies', 'API_KEY', 'TIMEOUT_SECONDS', 'MAX_RETRY')
 
@@ -39,6 +38,26 @@ def get_full_error(chunk, stream_response):
             break
     return chunk
 
+def report_response(headers, response, t_start):
+    """
+        把本次请求的首包延迟、错误信息与限流响应头反馈给api-key池
+    """
+    api_key = headers["Authorization"][len("Bearer "):]
+    error = None if response.ok else f"HTTP {response.status_code} {response.text}"
+    report_api_key_result(api_key, latency=time.time()-t_start, error=error, headers=response.headers)
+
+
+def report_request_error(headers, e):
+    """
+        请求没有得到响应时释放key的占用：端点熔断（请求没有发出）或用户取消时只释放占用；
+        其他异常（超时、连接失败、SSL错误等）计为一次错误
+    """
+    api_key = headers["Authorization"][len("Bearer "):]
+    if isinstance(e, (CircuitOpenError, GeneratorExit, KeyboardInterrupt)):
+        report_api_key_result(api_key)
+    else:
+        report_api_key_result(api_key, error=str(e) or type(e).__name__)
+
 
 def predict_no_ui_long_connection(inputs, llm_kwargs, history=[], sys_prompt="", observe_window=None, console_slience=False):
     """
@@ -57,18 +76,25 @@ def predict_no_ui_long_connection(inputs, llm_kwargs, history=[], sys_prompt="",
     watch_dog_patience = 5 # 看门狗的耐心, 设置5秒即可
     headers, payload = generate_payload(inputs, llm_kwargs, history, system_prompt=sys_prompt, stream=True)
     retry = 0
-    while True:
-        try:
-            # make a POST request to the API endpoint, stream=False
-            from .bridge_all import model_info
-            endpoint = model_info[llm_kwargs['llm_model']]['endpoint']
-            response = requests.post(endpoint, headers=headers, proxies=proxies,
-                                    json=payload, stream=True, timeout=TIMEOUT_SECONDS); break
-        except requests.exceptions.ReadTimeout as e:
-            retry += 1
-            traceback.print_exc()
-            if retry > MAX_RETRY: raise TimeoutError
-            if MAX_RETRY!=0: print(f'请求超时，正在重试 ({retry}/{MAX_RETRY}) ……')
+    t_start = time.time()
+    # generate_payload选出的key已经计入进行中的请求，无论请求如何结束都要反馈，否则该key一直被视为占用
+    try:
+        while True:
+            try:
+                # make a POST request to the API endpoint, stream=False
+                from .bridge_all import model_info
+                endpoint = model_info[llm_kwargs['llm_model']]['endpoint']
+                response = post_with_breaker(endpoint, headers=headers, proxies=proxies,
+                                        json=payload, stream=True, timeout=TIMEOUT_SECONDS); break
+            except requests.exceptions.ReadTimeout as e:
+                retry += 1
+                traceback.print_exc()
+                if retry > MAX_RETRY: raise TimeoutError("timeout")
+                if MAX_RETRY!=0: print(f'请求超时，正在重试 ({retry}/{MAX_RETRY}) ……')
+    except BaseException as e:
+        report_request_error(headers, e)
+        raise
+    report_response(headers, response, t_start)
 
     stream_response =  response.iter_lines()
     result = ''
@@ -127,11 +153,7 @@ def predict(inputs, llm_kwargs, plugin_kwargs, chatbot, history=[], system_promp
         return
 
     if additional_fn is not None:
-        import core_functional
-        importlib.reload(core_functional)    # 热更新prompt
-        core_functional = core_functional.get_core_functions()
-        if "PreProcess" in core_functional[additional_fn]: inputs = core_functional[additional_fn]["PreProcess"](inputs)  # 获取预处理函数（如果有的话）
-        inputs = core_functional[additional_fn]["Prefix"] + inputs + core_functional[additional_fn]["Suffix"]
+        inputs = core_functional_registry.apply(additional_fn, inputs)  # 拼接Prefix、预处理函数与Suffix（core_functional.py被修改时自动热更新）
 
     raw_input = inputs
     logging.info(f'[raw_input] {raw_input}')
@@ -148,19 +170,34 @@ def predict(inputs, llm_kwargs, plugin_kwargs, chatbot, history=[], system_promp
     history.append(inputs); history.append(" ")
 
     retry = 0
-    while True:
-        try:
-            # make a POST request to the API endpoint, stream=True
-            from .bridge_all import model_info
-            endpoint = model_info[llm_kwargs['llm_model']]['endpoint']
-            response = requests.post(endpoint, headers=headers, proxies=proxies,
-                                    json=payload, stream=True, timeout=TIMEOUT_SECONDS);break
-        except:
-            retry += 1
-            chatbot[-1] = ((chatbot[-1][0], timeout_bot_msg))
-            retry_msg = f"，正在重试 ({retry}/{MAX_RETRY}) ……" if MAX_RETRY > 0 else ""
-            yield from update_ui(chatbot=chatbot, history=history, msg="请求超时"+retry_msg) # 刷新界面
-            if retry > MAX_RETRY: raise TimeoutError
+    t_start = time.time()
+    try:
+        while True:
+            try:
+                # make a POST request to the API endpoint, stream=True
+                from .bridge_all import model_info
+                endpoint = model_info[llm_kwargs['llm_model']]['endpoint']
+                response = post_with_breaker(endpoint, headers=headers, proxies=proxies,
+                                        json=payload, stream=True, timeout=TIMEOUT_SECONDS);break
+            except CircuitOpenError:
+                raise
+            except:
+                retry += 1
+                chatbot[-1] = ((chatbot[-1][0], timeout_bot_msg))
+                retry_msg = f"，正在重试 ({retry}/{MAX_RETRY}) ……" if MAX_RETRY > 0 else ""
+                yield from update_ui(chatbot=chatbot, history=history, msg="请求超时"+retry_msg) # 刷新界面
+                if retry > MAX_RETRY: raise TimeoutError("timeout")
+    except CircuitOpenError as e:
+        # 端点已熔断，不再等待超时重试
+        report_request_error(headers, e)
+        chatbot[-1] = ((chatbot[-1][0], f"[Local Message] {e}"))
+        yield from update_ui(chatbot=chatbot, history=history, msg="端点熔断") # 刷新界面
+        return
+    except BaseException as e:
+        # 包括界面关闭生成器时的GeneratorExit
+        report_request_error(headers, e)
+        raise
+    report_response(headers, response, t_start)
 
     gpt_replying_buffer = ""
     
@@ -223,6 +260,7 @@ def generate_payload(inputs, llm_kwargs, history, system_prompt, stream):
         raise AssertionError("你提供了错误的API_KEY。\n\n1. 临时解决方案：直接在输入区键入api_key，然后回车提交。\n\n2. 长效解决方案：在config.py中配置。")
 
     api_key = select_api_key(llm_kwargs['api_key'], llm_kwargs['llm_model'])
+    llm_kwargs['selected_api_key'] = api_key    # hedge向同一模型补发请求时据此换用其他key
 
     headers = {
         "Content-Type": "application/json",
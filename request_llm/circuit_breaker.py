@@ -0,0 +1,124 @@
+"""
+    按端点（endpoint）划分的熔断器
+
+    closed（闭合）：正常放行请求，连续失败达到 CIRCUIT_BREAKER_FAILURES 次后进入 open
+    open（断开）：直接拒绝请求（抛出CircuitOpenError，耗时为毫秒级），经过 CIRCUIT_BREAKER_RECOVERY 秒后进入 half_open
+    half_open（半开）：只放行一个探测请求，成功则回到 closed，失败则重新 open
+
+    只有网络错误、超时与HTTP 5xx计为端点故障；key无效、额度不足等错误由toolbox中的api-key池处理。
+"""
+import time
+import threading
+
+class CircuitOpenError(ConnectionError):
+    """
+    端点处于熔断状态，请求没有发出
+    """
+    pass
+
+
+class CircuitBreaker():
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold=3, recovery_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.n_failure = 0
+        self.opened_at = 0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def set_state(self, state):
+        if state != self.state:
+            print(f'[熔断器] {self.name}: {self.state} -> {state}')
+            self.state = state
+
+    def allow_request(self):
+        """
+        判断是否放行一个请求；open状态超过恢复时间后放行一个探测请求
+        """
+        with self.lock:
+            if self.state == self.OPEN and time.time() - self.opened_at >= self.recovery_timeout:
+                self.set_state(self.HALF_OPEN)
+                self.probing = False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def is_available(self):
+        """
+        只查询，不占用half_open状态的探测名额，用于选择后备模型
+        """
+        with self.lock:
+            if self.state == self.OPEN:
+                return time.time() - self.opened_at >= self.recovery_timeout
+            return self.state == self.CLOSED or not self.probing
+
+    def record_success(self):
+        with self.lock:
+            self.n_failure = 0
+            self.probing = False
+            self.set_state(self.CLOSED)
+
+    def record_failure(self):
+        with self.lock:
+            self.n_failure += 1
+            self.probing = False
+            if self.state == self.HALF_OPEN or self.n_failure >= self.failure_threshold:
+                self.opened_at = time.time()
+                self.set_state(self.OPEN)
+
+    def get_state(self):
+        with self.lock:
+            retry_in = max(0, self.recovery_timeout - (time.time() - self.opened_at)) if self.state == self.OPEN else 0
+            return {'state': self.state, 'n_failure': self.n_failure, 'retry_in': round(retry_in, 1)}
+
+
+breakers = {}
+breakers_lock = threading.Lock()
+
+def get_breaker(endpoint):
+    from toolbox import get_conf
+    with breakers_lock:
+        if endpoint not in breakers:
+            failure_threshold, recovery_timeout = get_conf('CIRCUIT_BREAKER_FAILURES', 'CIRCUIT_BREAKER_RECOVERY')
+            breakers[endpoint] = CircuitBreaker(endpoint, failure_threshold, recovery_timeout)
+        return breakers[endpoint]
+
+def get_breaker_states():
+    """
+    所有端点熔断器的当前状态，如 {"https://api.openai.com/v1/chat/completions": {"state": "open", ...}}
+    """
+    with breakers_lock:
+        items = list(breakers.items())
+    return {endpoint: breaker.get_state() for endpoint, breaker in items}
+
+def is_endpoint_available(endpoint):
+    if endpoint is None: return True    # 本地模型
+    return get_breaker(endpoint).is_available()
+
+def post_with_breaker(endpoint, **kwargs):
+    """
+    经过熔断器的requests.post，参数与requests.post相同；端点熔断时立即抛出CircuitOpenError
+    """
+    import requests
+    breaker = get_breaker(endpoint)
+    if not breaker.allow_request():
+        raise CircuitOpenError(f"{endpoint} 连续请求失败，已熔断，{breaker.get_state()['retry_in']:.0f}秒后重新探测。")
+    try:
+        response = requests.post(endpoint, **kwargs)
+    except Exception:
+        breaker.record_failure()
+        raise
+    if response.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return response
@@ -0,0 +1,260 @@
+"""
+    桌宠动画的预缩放帧缓存
+
+    QMovie.setScaledSize会在每一帧显示时重新缩放原图，原图较大时（例如pet_image/yuansheng中的GIF）一直占用CPU。
+    这里把动画只解码一次，每一帧按配置的WIDTH/HEIGHT乘以屏幕的缩放比例（HiDPI）缩放好，
+    拼成一张帧图集（PNG）连同各帧的时长（JSON）缓存在 user_data/sprite_cache/ 中；
+    之后直接从图集切出各帧的QPixmap播放，播放时不再做任何缩放。
+
+    缓存以 源文件路径、修改时间、大小、目标尺寸与缩放比例 为键，修改任意一项都会生成新的缓存，
+    只保留最近使用的max_cache_entries个。第一次生成缓存在后台线程中进行，期间仍用QMovie显示，不拖慢启动。
+"""
+import os
+import json
+import math
+import hashlib
+from PyQt5.QtCore import QObject, QTimer, QThread, QRect, QSize, Qt, pyqtSignal, QCoreApplication
+from PyQt5.QtGui import QImage, QImageReader, QPixmap, QPainter, QMovie
+
+CACHE_VERSION = 1
+
+def get_cache_key(source, width, height, device_pixel_ratio):
+    stat = os.stat(source)
+    text = f"{CACHE_VERSION}|{os.path.abspath(source)}|{stat.st_mtime_ns}|{stat.st_size}|{width}x{height}@{device_pixel_ratio:g}"
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+def build_atlas(source, width, height, device_pixel_ratio, atlas_file, meta_file, is_interrupted=None):
+    """
+    解码source的所有帧，缩放为 (width, height)×device_pixel_ratio 像素后按网格拼成一张图集；
+    先写入图集再写入元数据，元数据存在即表示缓存完整。is_interrupted()返回True时放弃生成（抛出InterruptedError）
+    """
+    reader = QImageReader(source)
+    frame_width, frame_height = round(width * device_pixel_ratio), round(height * device_pixel_ratio)
+    frames, delays = [], []
+    while reader.canRead():
+        if is_interrupted is not None and is_interrupted():
+            raise InterruptedError("程序退出，放弃生成帧缓存")
+        image = reader.read()
+        if image.isNull(): break
+        # 与setScaledSize一样不保持宽高比；只在这里缩放一次，因此使用平滑缩放
+        frames.append(image.scaled(frame_width, frame_height, Qt.IgnoreAspectRatio, Qt.SmoothTransformation))
+        # 读取一帧之后，nextImageDelay是这一帧的显示时长
+        delay = reader.nextImageDelay()
+        delays.append(delay if delay > 0 else 100)
+    if not frames:
+        raise ValueError(f"无法读取图片 {source}: {reader.errorString()}")
+
+    columns = math.ceil(math.sqrt(len(frames)))
+    rows = math.ceil(len(frames) / columns)
+    atlas = QImage(columns * frame_width, rows * frame_height, QImage.Format_ARGB32_Premultiplied)
+    atlas.fill(Qt.transparent)
+    painter = QPainter(atlas)
+    for i, frame in enumerate(frames):
+        painter.drawImage((i % columns) * frame_width, (i // columns) * frame_height, frame)
+    painter.end()
+
+    if not atlas.save(atlas_file + ".tmp", "PNG"):
+        raise OSError(f"无法写入帧缓存 {atlas_file}")
+    os.replace(atlas_file + ".tmp", atlas_file)
+    meta = {
+        "version": CACHE_VERSION,
+        "source": os.path.abspath(source),
+        "frame_width": frame_width,
+        "frame_height": frame_height,
+        "device_pixel_ratio": device_pixel_ratio,
+        "columns": columns,
+        "delays": delays,
+        "loop_count": reader.loopCount(),   # -1表示无限循环
+    }
+    with open(meta_file + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(meta_file + ".tmp", meta_file)
+
+
+def load_atlas(atlas_file, meta):
+    """
+    从图集中切出各帧（QPixmap需要在主线程中创建）
+    """
+    atlas = QImage(atlas_file)
+    if atlas.isNull():
+        raise ValueError(f"帧缓存已损坏 {atlas_file}")
+    width, height, columns = meta["frame_width"], meta["frame_height"], meta["columns"]
+    frames = []
+    for i in range(len(meta["delays"])):
+        pixmap = QPixmap.fromImage(atlas.copy(QRect((i % columns) * width, (i // columns) * height, width, height)))
+        pixmap.setDevicePixelRatio(meta["device_pixel_ratio"])
+        frames.append(pixmap)
+    return frames
+
+
+class SpriteBuildThread(QThread):
+    """
+    在后台线程中生成帧缓存（QImage与QImageReader可以在非GUI线程中使用）
+    """
+    built = pyqtSignal(str)     # 缓存键
+    failed = pyqtSignal(str, str)
+
+    def __init__(self, key, source, width, height, device_pixel_ratio, atlas_file, meta_file):
+        super().__init__()
+        self.key = key
+        self.args = (source, width, height, device_pixel_ratio, atlas_file, meta_file)
+
+    def run(self):
+        try:
+            build_atlas(*self.args, is_interrupted=self.isInterruptionRequested)
+            self.built.emit(self.key)
+        except Exception as e:
+            self.failed.emit(self.key, str(e))
+
+
+class SpritePlayer(QObject):
+    """
+    在QLabel上播放缓存中的帧：每帧一个单次定时器，时长取自原动画；暂停时定时器完全停止
+    """
+    def __init__(self, label, cache_dir, max_cache_entries=16):
+        super().__init__(label)
+        self.label = label
+        self.cache_dir = cache_dir
+        self.max_cache_entries = max_cache_entries
+        self.frames, self.delays = [], []
+        self.loop_count, self.n_loops, self.index = -1, 0, 0
+        self.paused = False
+        self.key = None
+        self.movie = None           # 缓存生成之前临时使用的QMovie
+        self.threads = []
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.next_frame)
+        # 程序退出时后台线程可能还在生成缓存，需要等它结束，否则Qt会因为销毁运行中的QThread而中止
+        QCoreApplication.instance().aboutToQuit.connect(self.stop_threads)
+
+    def stop_threads(self):
+        for thread in list(self.threads):
+            thread.requestInterruption()
+            thread.wait()
+
+    def get_cache_files(self, key):
+        return os.path.join(self.cache_dir, key + ".png"), os.path.join(self.cache_dir, key + ".json")
+
+    def load(self, source, width, height, device_pixel_ratio=1.0):
+        """
+        播放source（GIF或静态图片），缩放为width×height（逻辑像素）；没有缓存时先用QMovie显示，后台生成缓存
+        """
+        self.stop()
+        device_pixel_ratio = round(device_pixel_ratio, 2)
+        try:
+            self.key = get_cache_key(source, width, height, device_pixel_ratio)
+        except OSError as e:
+            # 图标文件被移动或删除：与QMovie一样什么都不显示，而不是让桌宠启动失败
+            print(f"无法读取桌宠图标 {source}: {e}")
+            self.key = None
+            self.play_movie(source, width, height)
+            return
+        atlas_file, meta_file = self.get_cache_files(self.key)
+        if os.path.exists(meta_file) and os.path.exists(atlas_file):
+            try:
+                self.play_from_cache(self.key)
+                return
+            except Exception as e:
+                print(f"读取帧缓存失败，重新生成: {e}")
+
+        self.play_movie(source, width, height)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+        except OSError as e:
+            print(f"无法创建帧缓存目录，继续使用QMovie播放: {e}")
+            return
+        thread = SpriteBuildThread(self.key, source, width, height, device_pixel_ratio, atlas_file, meta_file)
+        thread.built.connect(self.on_built)
+        thread.failed.connect(self.on_build_failed)
+        thread.finished.connect(lambda: self.threads.remove(thread))
+        self.threads.append(thread)
+        thread.start()
+
+    def play_movie(self, source, width, height):
+        self.movie = QMovie(source)
+        self.movie.setScaledSize(QSize(width, height))
+        self.label.setMovie(self.movie)
+        if not self.paused: self.movie.start()
+
+    def on_built(self, key):
+        # 生成期间可能已经换了图标或尺寸
+        if key != self.key: return
+        try:
+            self.play_from_cache(key)
+            self.prune_cache()
+        except Exception as e:
+            print(f"读取帧缓存失败，继续使用QMovie播放: {e}")
+
+    def on_build_failed(self, key, error):
+        print(f"生成帧缓存失败，继续使用QMovie播放: {error}")
+
+    def play_from_cache(self, key):
+        atlas_file, meta_file = self.get_cache_files(key)
+        with open(meta_file, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get("version") != CACHE_VERSION:
+            raise ValueError("帧缓存版本不匹配")
+        frames = load_atlas(atlas_file, meta)
+        # 更新访问时间，用于清理最久没有使用的缓存
+        os.utime(meta_file)
+        if self.movie is not None:
+            self.movie.stop()
+            self.label.clear()
+            self.movie.deleteLater()
+            self.movie = None
+        self.frames, self.delays, self.loop_count = frames, meta["delays"], meta["loop_count"]
+        self.index, self.n_loops = 0, 0
+        self.label.setPixmap(self.frames[0])
+        if not self.paused: self.schedule_next()
+
+    def schedule_next(self):
+        if len(self.frames) > 1:
+            self.timer.start(self.delays[self.index])
+
+    def next_frame(self):
+        self.index += 1
+        if self.index >= len(self.frames):
+            self.n_loops += 1
+            # loop_count为-1时无限循环，否则在播放loop_count+1遍后停在最后一帧
+            if 0 <= self.loop_count < self.n_loops:
+                self.index = len(self.frames) - 1
+                return
+            self.index = 0
+        self.label.setPixmap(self.frames[self.index])
+        self.schedule_next()
+
+    def set_paused(self, paused):
+        self.paused = paused
+        if self.movie is not None:
+            if not paused and self.movie.state() == QMovie.NotRunning:
+                self.movie.start()
+            else:
+                self.movie.setPaused(paused)
+        elif paused:
+            self.timer.stop()
+        elif not self.timer.isActive():
+            self.schedule_next()
+
+    def stop(self):
+        self.timer.stop()
+        if self.movie is not None:
+            self.movie.stop()
+            self.label.clear()
+            self.movie.deleteLater()
+            self.movie = None
+        self.frames, self.delays = [], []
+
+    def prune_cache(self):
+        """
+        只保留最近使用的max_cache_entries个缓存
+        """
+        metas = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir) if name.endswith(".json")]
+        metas.sort(key=os.path.getmtime, reverse=True)
+        for meta_file in metas[self.max_cache_entries:]:
+            for file_path in (meta_file, meta_file[:-len(".json")] + ".png"):
+                try:
+                    os.remove(file_path)
+                except OSError:
+                    pass
@@ -0,0 +1,210 @@
+"""
+    启动耗时统计
+
+    StartupTimer: 记录启动过程中各个阶段（读取配置、创建Qt应用、桌宠显示等）相对于进程启动的时间点，
+    并在桌宠显示之后打印一份启动耗时报告。目标是桌宠窗口在1秒内出现。
+
+    ImportTimeRecorder: 以 `python main.py --profile-startup` 启动时安装，记录每个模块的导入耗时
+    （类似 `python -X importtime`，但是以结构化的方式保存），与各阶段时间点一起写入json报告，
+    报告可以交给 benchmark_startup.py 进行比较。
+"""
+import sys
+import time
+import threading
+import importlib.abc
+
+class _TimedLoader():
+    """
+    包装原有的loader，统计create_module与exec_module的耗时
+    """
+    def __init__(self, loader, recorder, fullname):
+        self.loader = loader
+        self.recorder = recorder
+        self.fullname = fullname
+
+    def create_module(self, spec):
+        # 扩展模块（.pyd/.so）的加载发生在create_module中，计入该模块的耗时
+        create_module = getattr(self.loader, 'create_module', None)
+        self.recorder.enter(self.fullname)
+        try:
+            return None if create_module is None else create_module(spec)
+        finally:
+            self.recorder.pause(self.fullname)
+
+    def exec_module(self, module):
+        # 还原loader，避免影响依赖loader类型的代码（如importlib.resources）
+        if getattr(module, '__spec__', None) is not None: module.__spec__.loader = self.loader
+        module.__loader__ = self.loader
+        self.recorder.resume(self.fullname)
+        try:
+            self.loader.exec_module(module)
+        finally:
+            self.recorder.exit(self.fullname)
+
+    def __getattr__(self, attr):
+        return getattr(self.loader, attr)
+
+
+class ImportTimeRecorder(importlib.abc.MetaPathFinder):
+    """
+    安装在sys.meta_path最前面，记录每个模块的自身耗时(self)与包含子模块导入的累计耗时(cumulative)。
+    后台线程（如预加载、日程管理）也会导入模块，导入栈按线程分开记录，写入records时加锁
+    """
+    def __init__(self):
+        self.records = {}
+        self.order = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @property
+    def stack(self):
+        # 当前线程的导入栈 [模块名, 开始时间, 子模块耗时]
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    @property
+    def paused(self):
+        if not hasattr(self.local, 'paused'):
+            self.local.paused = {}
+        return self.local.paused
+
+    def install(self):
+        if self not in sys.meta_path:
+            sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self: continue
+            find_spec = getattr(finder, 'find_spec', None)
+            if find_spec is None: continue
+            spec = find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if spec.loader is None or not hasattr(spec.loader, 'exec_module'):
+            return spec
+        spec.loader = _TimedLoader(spec.loader, self, fullname)
+        return spec
+
+    def enter(self, fullname):
+        self.stack.append([fullname, time.perf_counter(), 0.0])
+
+    def pause(self, fullname):
+        # create_module与exec_module之间还会执行模块属性初始化，先记下已经花费的时间
+        name, start, child = self.stack.pop()
+        self.paused[fullname] = (time.perf_counter() - start, child)
+
+    def resume(self, fullname):
+        spent, child = self.paused.pop(fullname, (0.0, 0.0))
+        self.stack.append([fullname, time.perf_counter() - spent, child])
+
+    def exit(self, fullname):
+        stack = self.stack
+        name, start, child = stack.pop()
+        cumulative = time.perf_counter() - start
+        parent = stack[-1][0] if stack else None
+        if stack:
+            stack[-1][2] += cumulative
+        with self.lock:
+            self.order += 1
+            self.records[fullname] = {
+                'module': fullname,
+                'parent': parent,
+                'depth': len(stack),
+                'order': self.order,
+                'thread': threading.current_thread().name,
+                'self_ms': round((cumulative - child) * 1000, 3),
+                'cumulative_ms': round(cumulative * 1000, 3),
+            }
+
+    def get_records(self, top=None):
+        with self.lock:
+            records = list(self.records.values())
+        records.sort(key=lambda r: r['cumulative_ms'], reverse=True)
+        return records if top is None else records[:top]
+
+    def get_total_ms(self):
+        # 只统计主线程：后台线程的导入与主线程重叠，不增加启动时间
+        return round(sum(r['cumulative_ms'] for r in self.get_records()
+                         if r['depth'] == 0 and r.get('thread') == 'MainThread'), 3)
+
+
+class StartupTimer():
+    def __init__(self, budget=1.0):
+        self.t0 = time.perf_counter()
+        self.budget = budget   # 期望的桌宠出现时间（秒）
+        self.phases = []
+        self.import_recorder = None
+
+    def enable_import_profiling(self):
+        """
+        开始记录模块导入耗时，应尽早调用（在导入其他模块之前）
+        """
+        if self.import_recorder is None:
+            self.import_recorder = ImportTimeRecorder()
+            self.import_recorder.install()
+
+    def mark(self, phase):
+        """
+        记录一个启动阶段的完成时间
+        """
+        self.phases.append((phase, time.perf_counter() - self.t0))
+
+    def mark_once(self, phase):
+        if self.elapsed(phase) is None:
+            self.mark(phase)
+
+    def elapsed(self, phase):
+        for name, t in self.phases:
+            if name == phase: return t
+        return None
+
+    def report(self, target_phase='pet_shown'):
+        from colorful import print亮绿, print亮黄
+        last = 0
+        lines = []
+        for name, t in self.phases:
+            lines.append(f'\t{name:<24s}{t*1000:8.1f} ms  (+{(t-last)*1000:.1f} ms)')
+            last = t
+        print('[启动耗时]\n' + '\n'.join(lines))
+        t_target = self.elapsed(target_phase)
+        if t_target is None:
+            return
+        if t_target <= self.budget:
+            print亮绿(f'[启动耗时] 桌宠在 {t_target*1000:.0f} ms 内出现')
+        else:
+            print亮黄(f'[启动耗时] 桌宠出现耗时 {t_target*1000:.0f} ms，超过了 {self.budget*1000:.0f} ms 的目标')
+
+    def to_dict(self):
+        res = {
+            'created_at': time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
+            'python': sys.version,
+            'platform': sys.platform,
+            'phases_ms': {name: round(t * 1000, 3) for name, t in self.phases},
+        }
+        if self.import_recorder is not None:
+            res['total_import_ms'] = self.import_recorder.get_total_ms()
+            res['imports'] = self.import_recorder.get_records()
+        return res
+
+    def write_json(self, file_path=None):
+        """
+        写入json报告，默认写入 gpt_log/startup_profile_[时间].json
+        """
+        import os
+        import json
+        if file_path is None:
+            os.makedirs('./gpt_log/', exist_ok=True)
+            file_path = './gpt_log/startup_profile_' + time.strftime("%Y-%m-%d-%H-%M-%S", time.localtime()) + '.json'
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=4)
+        print('启动耗时报告已经写入' + os.path.abspath(file_path))
+        return file_path
+
+startup_timer = StartupTimer()
@@ -1,9 +1,7 @@
-import markdown
 import importlib
 import traceback
 import inspect
 import re
-from latex2mathml.converter import convert as tex2mathml
 from functools import wraps, lru_cache
 ############################### 插件输入输出接驳区 #######################################
 class ChatBotWithCookies(list):
@@ -54,6 +52,62 @@ def update_ui(chatbot, history, msg='正常', **kwargs):  # 刷新界面
     assert isinstance(chatbot, ChatBotWithCookies), "在传递chatbot的过程中不要将其丢弃。必要时，可用clear将其清空，然后用for+append循环重新赋值。"
     yield chatbot.get_cookies(), chatbot, history, msg
 
+class UIUpdateCoalescer():
+    """
+    界面刷新合并器：把流式生成器在一个帧间隔（例如50ms）内产生的多次update_ui合并为一次，
+    最后一帧总是会被推送出去，保证界面停留在最终状态；状态栏信息(msg)变化的帧（例如"等待响应"）立即推送，
+    因为上游在这之后往往会阻塞（等待请求、重试前的等待），被暂存的帧要等到上游再次产生帧时才能推送。
+    chatbot与history在各帧之间是同一个可变对象，因此只保留最新的一帧即可，被跳过的帧不会丢失内容。
+        merged: 被合并进后续帧的帧数
+        dropped: 被合并、且其状态栏信息(msg)从未显示过的帧数
+    """
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.emitted = 0
+        self.merged = 0
+        self.dropped = 0
+
+    def wrap(self, gen):
+        import time
+        last_emit_time = 0
+        last_msg = None
+        pending = None
+        for frame in gen:
+            if pending is not None:
+                # 上一帧被当前帧覆盖
+                self.merged += 1
+                if pending[-1] != frame[-1]: self.dropped += 1
+                pending = None
+            now = time.time()
+            if now - last_emit_time >= self.interval or frame[-1] != last_msg:
+                last_emit_time = now
+                last_msg = frame[-1]
+                self.emitted += 1
+                yield frame
+            else:
+                pending = frame
+        if pending is not None:
+            # 最后一帧必须推送，否则界面会停在中间状态
+            self.emitted += 1
+            yield pending
+
+    def get_stats(self):
+        return {'emitted': self.emitted, 'merged': self.merged, 'dropped': self.dropped}
+
+def coalesce_ui_updates(gen, interval=None):
+    """
+    对产生update_ui的生成器进行刷新合并，interval缺省时读取config中的UI_REFRESH_INTERVAL
+    """
+    import logging
+    if interval is None:
+        interval, = get_conf('UI_REFRESH_INTERVAL')
+    if interval <= 0:
+        yield from gen
+        return
+    coalescer = UIUpdateCoalescer(interval)
+    yield from coalescer.wrap(gen)
+    logging.info(f'[ui_coalesce] {coalescer.get_stats()}')
+
 def CatchException(f):
     """
     装饰器函数，捕捉函数f中的异常并封装到一个生成器中返回，并显示到聊天当中。
@@ -93,6 +147,59 @@ def HotReload(f):
     return decorated
 
 
+class CoreFunctionalRegistry():
+    """
+    core_functional中按钮模板的注册表。
+    模块只加载一次，并把每个按钮的Prefix/Suffix/PreProcess预先组合成一个函数；
+    每次取用时只检查core_functional.py的修改时间，文件被修改后才重新加载，从而保留热更新prompt的能力。
+    """
+    def __init__(self, module_name='core_functional'):
+        import threading
+        self.module_name = module_name
+        self.module = None
+        self.mtime = None
+        self.compiled = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def compile_template(template):
+        prefix = template["Prefix"]
+        suffix = template["Suffix"]
+        pre_process = template.get("PreProcess", None)
+        if pre_process is None:
+            return lambda inputs: prefix + inputs + suffix
+        return lambda inputs: prefix + pre_process(inputs) + suffix
+
+    def get_mtime(self):
+        import os
+        try:
+            return os.path.getmtime(self.module.__file__)
+        except:
+            return None
+
+    def load(self):
+        if self.module is None:
+            self.module = importlib.import_module(self.module_name)
+        else:
+            self.module = importlib.reload(self.module)    # 热更新prompt
+        self.mtime = self.get_mtime()
+        self.compiled = {name: self.compile_template(template)
+                         for name, template in self.module.get_core_functions().items()}
+
+    def get(self, additional_fn):
+        """
+        获取按钮additional_fn对应的模板函数，输入inputs，返回拼接好的prompt
+        """
+        with self.lock:
+            if self.module is None or self.get_mtime() != self.mtime:
+                self.load()
+            return self.compiled[additional_fn]
+
+    def apply(self, additional_fn, inputs):
+        return self.get(additional_fn)(inputs)
+
+core_functional_registry = CoreFunctionalRegistry()
+
 ####################################### 其他小工具 #####################################
 
 def get_reduce_token_percent(text):
@@ -183,6 +290,8 @@ def markdown_convertion(txt):
     """
     将Markdown格式的文本转换为HTML格式。如果包含数学公式，则先将公式转换为HTML格式。
     """
+    import markdown # markdown与latex2mathml只在网页版中用到，用到时再导入，以加快桌宠启动
+    from latex2mathml.converter import convert as tex2mathml
     pre = '<div class="markdown-body">'
     suf = '</div>'
     markdown_extension_configs = {
@@ -275,6 +384,7 @@ def format_io(self, y):
     """
     将输入和输出解析为HTML格式。将y中最后一项的输入部分段落化，并将输出部分的Markdown和数学公式转换为HTML格式。
     """
+    import markdown
     if y is None or y == []:
         return []
     i_ask, gpt_reply = y[-1]
@@ -433,8 +543,123 @@ def is_any_api_key(key):
         return is_openai_api_key(key) or is_api2d_key(key)
 
 
-def select_api_key(keys, llm_model):
-    import random
+def parse_rate_limit_reset(text):
+    """
+    解析OpenAI限流响应头中的重置时间，如 "1s"、"6m0s"、"20ms"，返回秒数
+    """
+    units = {'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}
+    matches = re.findall(r"([\d.]+)(ms|h|m|s)", text)
+    if not matches:
+        try: return float(text)
+        except ValueError: return None
+    return sum(float(v) * units[u] for v, u in matches)
+
+
+class ApiKeyPool():
+    """
+    api-key的健康状况统计与调度，取代随机选择。
+    每个key记录：进行中的请求数、首包延迟与错误率（指数滑动平均）、限流响应头中的剩余额度；
+    选择时排除隔离中的key，在其余key中按 负载×延迟×错误率 加权选择（越空闲、越快、越稳定的key被选中的概率越大）。
+    额度用尽、key无效的key长时间隔离，触发限流的key隔离到限流重置为止，连续出错的key短暂隔离。
+    """
+    quota_errors = ("exceeded your current quota", "insufficient_quota", "bad forward key", "Incorrect API key", "invalid_api_key")
+    rate_limit_errors = ("Rate limit", "rate_limit", "HTTP 429")
+
+    def __init__(self, quota_quarantine=3600, error_quarantine=30, default_latency=2.0, alpha=0.3, stale_seconds=600):
+        import threading
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.quota_quarantine = quota_quarantine        # 额度不足、key无效时的隔离时间（秒）
+        self.error_quarantine = error_quarantine        # 连续出错时的隔离时间（秒）
+        self.default_latency = default_latency          # 尚无统计时假定的首包延迟（秒）
+        self.alpha = alpha                              # 滑动平均系数
+        self.stale_seconds = stale_seconds              # 超过该时间仍未反馈结果的请求不再计入负载
+
+    def get_key_stats(self, key):
+        if key not in self.stats:
+            self.stats[key] = {'inflight': [], 'n_request': 0, 'n_error': 0, 'n_consecutive_error': 0,
+                               'latency': None, 'error_rate': 0.0, 'quarantine_until': 0, 'quarantine_reason': ''}
+        return self.stats[key]
+
+    def score(self, stat, now):
+        stat['inflight'] = [t for t in stat['inflight'] if now - t < self.stale_seconds]
+        latency = self.default_latency if stat['latency'] is None else stat['latency']
+        return (len(stat['inflight']) + 1) * latency * (1 + 4 * stat['error_rate'])
+
+    def acquire(self, key_list):
+        """
+        从候选key中选出一个，并计入进行中的请求；调用方请求结束后应调用report反馈结果
+        """
+        import random, time
+        now = time.time()
+        with self.lock:
+            stats = [self.get_key_stats(k) for k in key_list]
+            avail = [(k, s) for k, s in zip(key_list, stats) if s['quarantine_until'] <= now]
+            if len(avail) == 0:
+                # 全部处于隔离中，选择最早解除隔离的key，而不是直接失败
+                k, s = min(zip(key_list, stats), key=lambda ks: ks[1]['quarantine_until'])
+            else:
+                weights = [1 / self.score(s, now) for k, s in avail]
+                k, s = random.choices(avail, weights=weights)[0]
+            s['inflight'].append(now)
+            s['n_request'] += 1
+            return k
+
+    def report(self, key, latency=None, error=None, headers=None):
+        """
+        反馈一次请求的结果：latency为首包延迟（秒），error为错误信息（成功时为None），headers为响应头
+        """
+        import time
+        now = time.time()
+        with self.lock:
+            s = self.get_key_stats(key)
+            if s['inflight']: s['inflight'].pop(0)
+            if latency is None and error is None and headers is None:
+                return  # 请求没有发出（例如端点熔断），只释放占用
+            if latency is not None:
+                s['latency'] = latency if s['latency'] is None else (1-self.alpha) * s['latency'] + self.alpha * latency
+            s['error_rate'] = (1-self.alpha) * s['error_rate'] + self.alpha * (error is not None)
+            if error is None:
+                s['n_consecutive_error'] = 0
+            else:
+                s['n_error'] += 1
+                s['n_consecutive_error'] += 1
+            quarantine, reason = self.get_quarantine(s, error, headers)
+            if quarantine > 0 and now + quarantine > s['quarantine_until']:
+                s['quarantine_until'] = now + quarantine
+                s['quarantine_reason'] = reason
+                print(f'[API_KEY] {key[:8]}*** {reason}，隔离 {quarantine:.0f} 秒')
+
+    def get_quarantine(self, stat, error, headers):
+        headers = headers or {}
+        if error is not None and any(e in error for e in self.quota_errors):
+            return self.quota_quarantine, '额度不足或key无效'
+        if error is not None and any(e in error for e in self.rate_limit_errors):
+            wait = parse_rate_limit_reset(headers.get('retry-after', '') or headers.get('x-ratelimit-reset-requests', ''))
+            return (self.error_quarantine if wait is None else wait), '触发限流'
+        # 请求成功但剩余额度已经用完：隔离到限流重置为止
+        for kind in ('requests', 'tokens'):
+            remaining = headers.get(f'x-ratelimit-remaining-{kind}', None)
+            if remaining is not None and remaining.strip() == '0':
+                wait = parse_rate_limit_reset(headers.get(f'x-ratelimit-reset-{kind}', ''))
+                if wait: return wait, '限流额度已用完'
+        if stat['n_consecutive_error'] >= 3:
+            return self.error_quarantine * (stat['n_consecutive_error'] - 2), '连续出错'
+        return 0, ''
+
+    def get_stats(self):
+        import time
+        now = time.time()
+        with self.lock:
+            return {key[:8] + '***': {
+                        'inflight': len(s['inflight']), 'n_request': s['n_request'], 'n_error': s['n_error'],
+                        'latency': s['latency'], 'error_rate': round(s['error_rate'], 3),
+                        'quarantine': max(0, round(s['quarantine_until'] - now)), 'quarantine_reason': s['quarantine_reason'],
+                    } for key, s in self.stats.items()}
+
+api_key_pool = ApiKeyPool()
+
+def get_avail_api_keys(keys, llm_model):
     avail_key_list = []
     key_list = keys.split(',')
 
@@ -445,13 +670,22 @@ def select_api_key(keys, llm_model):
     if llm_model.startswith('api2d-'):
         for k in key_list:
             if is_api2d_key(k): avail_key_list.append(k)
+    return avail_key_list
 
+def select_api_key(keys, llm_model):
+    avail_key_list = get_avail_api_keys(keys, llm_model)
     if len(avail_key_list) == 0:
         raise RuntimeError(f"您提供的api-key不满足要求，不包含任何可用于{llm_model}的api-key。")
 
-    api_key = random.choice(avail_key_list) # 随机负载均衡
+    api_key = api_key_pool.acquire(avail_key_list) # 按key的健康状况负载均衡
     return api_key
 
+def report_api_key_result(api_key, latency=None, error=None, headers=None):
+    """
+    请求结束后反馈select_api_key选出的key的使用结果，用于后续的负载均衡与隔离
+    """
+    api_key_pool.report(api_key, latency=latency, error=error, headers=headers)
+
 @lru_cache(maxsize=128)
 def read_single_conf_with_lru_cache(arg):
     from colorful import print亮红, print亮绿